@@ -0,0 +1,89 @@
+# coding=utf-8
+"""
+Size on disk and speed of EncodedArchive compared with Archive.
+
+Stores synthetic ticks, with prices on a one cent grid like real ones,
+with each compression and reports bytes per tick, compression ratio
+against the raw rows, and ticks/sec for append and for reading
+everything back:
+
+    python benchmarks/bench_encoded_archive.py --ticks 2000000
+
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pyiqfeed as iq  # noqa: E402
+
+
+def make_ticks(num_ticks: int, num_days: int = 5) -> np.array:
+    """Random ticks spread over num_days trading days."""
+    rng = np.random.default_rng(0)
+    ticks = np.zeros(num_ticks, iq.HistoryConn.tick_type)
+    per_day = -(-num_ticks // num_days)
+    ticks['tick_id'] = np.arange(num_ticks) * 3 + 1000
+    ticks['date'] = np.datetime64('2023-01-02') + np.arange(
+        num_ticks) // per_day
+    session_us = int(6.5 * 3600 * 1000000)
+    ticks['time'] = np.timedelta64(9 * 3600 + 1800, 's') + np.sort(
+        rng.integers(0, session_us, num_ticks)).astype('m8[us]')
+    cents = 10000 + np.cumsum(rng.integers(-2, 3, num_ticks))
+    ticks['last'] = cents / 100
+    ticks['bid'] = (cents - 1) / 100
+    ticks['ask'] = (cents + 1) / 100
+    ticks['last_sz'] = rng.choice([1, 100, 200, 500], num_ticks)
+    ticks['tot_vlm'] = np.cumsum(ticks['last_sz'])
+    ticks['last_type'] = rng.choice([b'O', b'C'], num_ticks, p=[0.9, 0.1])
+    ticks['mkt_ctr'] = rng.integers(1, 20, num_ticks)
+    ticks['cond1'] = rng.choice([0, 0x3D, 0x87], num_ticks)
+    return ticks
+
+
+def _dir_bytes(dir_name: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name))
+               for path, _, names in os.walk(dir_name) for name in names)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--ticks', type=int, default=2000000)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    ticks = make_ticks(args.ticks)
+    raw_bytes = ticks.nbytes
+    print("%-14s %10s %7s %14s %14s" % (
+        "archive", "bytes/tick", "ratio", "append/sec", "read/sec"))
+    cases = [("Archive", lambda root: iq.Archive(root))]
+    cases.extend(("Encoded %s" % compression,
+                  lambda root, compression=compression: iq.EncodedArchive(
+                      root, compression=compression))
+                 for compression in (None, 'zlib', 'lzma'))
+    for label, make_archive in cases:
+        append_secs = read_secs = float('inf')
+        for _ in range(args.repeats):
+            with tempfile.TemporaryDirectory() as root:
+                archive = make_archive(root)
+                start = time.perf_counter()
+                archive.append("AAPL", "ticks", ticks)
+                append_secs = min(append_secs, time.perf_counter() - start)
+                start = time.perf_counter()
+                # np.array so Archive's memmap is actually read.
+                read = np.array(archive.read("AAPL", "ticks"))
+                read_secs = min(read_secs, time.perf_counter() - start)
+                assert np.array_equal(read, ticks)
+                disk_bytes = _dir_bytes(root)
+        print("%-14s %10.1f %7.1f %13.2fM %13.2fM" % (
+            label, disk_bytes / args.ticks, raw_bytes / disk_bytes,
+            args.ticks / append_secs / 1e6, args.ticks / read_secs / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# coding=utf-8
+"""
+Rows/sec of HistoryConn for different DatapointsPerSend values.
+
+Runs against the mock IQFeed in tests/conftest.py, which waits
+--batch-ms before sending each batch of DatapointsPerSend lines to stand
+in for IQFeed's round trips. Compares fixed values with
+adapt_pts_per_send=True:
+
+    python benchmarks/bench_pts_per_send.py --rows 100000 --batch-ms 1
+
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pyiqfeed as iq  # noqa: E402
+from conftest import MockIQFeed, tick_line  # noqa: E402
+
+
+def _rows_per_sec(hist_conn: iq.HistoryConn, num_rows: int) -> float:
+    start = time.perf_counter()
+    ticks = hist_conn.request_ticks("AAPL", num_rows, timeout=600)
+    assert len(ticks) == num_rows
+    return num_rows / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--batch-ms', type=float, default=1.0,
+                        dest='batch_ms')
+    parser.add_argument('--repeats', type=int, default=8)
+    args = parser.parse_args()
+
+    mock = MockIQFeed()
+    mock.batch_secs = args.batch_ms / 1000
+    lines = [tick_line(tick_id, "2023-01-03 09:30:00.000001")
+             for tick_id in range(args.rows)]
+    mock.handler = lambda fields: lines[:int(fields[2])]
+
+    def run(label, **kwargs):
+        hist_conn = iq.HistoryConn(name="bench", host="127.0.0.1",
+                                   port=mock.port, **kwargs)
+        hist_conn.connect()
+        try:
+            rates = []
+            for _ in range(args.repeats):
+                rates.append(_rows_per_sec(hist_conn, args.rows))
+            print("%-12s best %10.0f rows/sec, last %10.0f rows/sec, "
+                  "DatapointsPerSend now %d" % (
+                      label, max(rates), rates[-1], hist_conn.pts_per_send))
+        finally:
+            hist_conn._stop.set()
+            mock.nudge()
+            hist_conn.disconnect()
+
+    for pts_per_send in (100, 1000, 10000):
+        run("fixed %d" % pts_per_send, pts_per_send=pts_per_send)
+    run("adaptive", pts_per_send=100, adapt_pts_per_send=True)
+    mock.close()
+
+
+if __name__ == "__main__":
+    main()
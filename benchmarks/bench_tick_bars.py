@@ -0,0 +1,68 @@
+# coding=utf-8
+"""
+Ticks/sec of bars.tick_bars on synthetic ticks, with and without filters:
+
+    python benchmarks/bench_tick_bars.py --ticks 10000000
+
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pyiqfeed as iq  # noqa: E402
+
+
+def make_ticks(num_ticks: int, num_days: int = 5) -> np.array:
+    """Random ticks spread over num_days trading days."""
+    rng = np.random.default_rng(0)
+    ticks = np.zeros(num_ticks, iq.HistoryConn.tick_type)
+    per_day = -(-num_ticks // num_days)
+    ticks['date'] = np.datetime64('2023-01-02') + np.arange(
+        num_ticks) // per_day
+    session_us = int(6.5 * 3600 * 1000000)
+    ticks['time'] = np.timedelta64(9 * 3600 + 1800, 's') + np.sort(
+        rng.integers(0, session_us, num_ticks)).astype('m8[us]')
+    ticks['last'] = 100 + np.cumsum(rng.normal(0, 0.01, num_ticks))
+    ticks['last_sz'] = rng.integers(1, 500, num_ticks)
+    ticks['tot_vlm'] = np.cumsum(ticks['last_sz'])
+    ticks['last_type'] = rng.choice([b'O', b'C'], num_ticks, p=[0.9, 0.1])
+    ticks['cond1'] = rng.choice([0, 0x3D, 0x87], num_ticks)
+    ticks['cond2'] = rng.choice([0, 0x17], num_ticks)
+    return ticks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ticks', type=int, default=10000000)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+    ticks = make_ticks(args.ticks)
+    cases = [
+        ("60s bars", dict(interval_len=60)),
+        ("25000 volume bars", dict(interval_len=25000, interval_type='v')),
+        ("100 tick bars", dict(interval_len=100, interval_type='t')),
+        ("60s bars, exclude_conds", dict(interval_len=60,
+                                         exclude_conds=[0x3D, 0x17])),
+        ("60s bars, last_types", dict(interval_len=60,
+                                      last_types=[b'O'])),
+        ("60s bars, both filters", dict(interval_len=60,
+                                        exclude_conds=[0x3D, 0x17],
+                                        last_types=[b'O'])),
+    ]
+    for label, kwargs in cases:
+        best = float('inf')
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            iq.bars.tick_bars(ticks, **kwargs)
+            best = min(best, time.perf_counter() - start)
+        print("%-26s %6.1fM ticks/sec" % (label, args.ticks / best / 1e6))
+
+
+if __name__ == "__main__":
+    main()
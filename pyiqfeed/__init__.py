@@ -14,9 +14,24 @@ from .listeners import VerboseAdminListener, VerboseBarListener
 
 from .service import FeedService
 
+from .history_cache import HistoryCache
+from .request_cache import RequestCache
+from .chain_cache import ChainCache
+from .parallel import ConnPool
+from . import parallel
+from .scheduler import RequestScheduler
+from . import columnar
+from .archive import Archive, EncodedArchive
+from .stitch import TickStitcher
+from . import bars
+from .adjust import AdjustmentCache, AdjustmentListener
+from .symbols import SymbolMaster
+from .options import OptionChain
+
 from .field_readers import (us_since_midnight_to_time,
                             datetime64_to_date,
                             date_us_to_datetime)
 
 from .exceptions import NoDataError, UnexpectedField, UnexpectedMessage
 from .exceptions import UnexpectedProtocol, UnauthorizedError
+from .exceptions import MemoryBudgetError
@@ -0,0 +1,299 @@
+# coding=utf-8
+"""
+Adjust history for splits and dividends.
+
+IQFeed returns daily, bar and tick data unadjusted. QuoteConn fundamental
+messages carry the last two splits and the latest dividend of a symbol.
+AdjustmentCache records these as they arrive, keeps a cumulative
+adjustment factor series per symbol and applies it to history arrays.
+
+    adjustments = iq.AdjustmentCache("/data/adjustments", hist_conn)
+    quote_conn.add_listener(iq.AdjustmentListener("adj", adjustments))
+    quote_conn.watch("AAPL")
+    ...
+    adjustments.resolve_pending(timeout=30)
+    daily = adjustments.adjust("AAPL", hist_conn.request_daily_data(
+        "AAPL", 1000))
+
+Prices on days before a split are multiplied by the split factor IQFeed
+reports, eg 0.25 for a 4 for 1 split, and volumes are divided by it.
+Prices on days before an ex-dividend date are multiplied by
+(1 - dividend / close on the day before the ex-dividend date). Volumes
+are not adjusted for dividends.
+
+Looking up that close is a history request, which mustn't be made on the
+QuoteConn reader thread the listener is called on, so new dividends wait
+until you call resolve_pending.
+
+"""
+
+import datetime
+import os
+import threading
+import urllib.parse
+
+import numpy as np
+from .conn import HistoryConn
+from .exceptions import NoDataError
+from .listeners import SilentQuoteListener
+
+
+class AdjustmentCache:
+    """
+    Split and dividend history and adjustment factors for each symbol.
+
+    :param root_dir: Directory the events of each symbol are saved in so
+        they survive restarts. None means keep them in memory only.
+    :param hist_conn: Connected HistoryConn resolve_pending uses to look
+        up the close before each ex-dividend date. Without one dividends
+        are recorded but not adjusted for.
+
+    """
+
+    # One row for each split or dividend. value is the split factor or
+    # dividend amount and factor is what to multiply earlier prices by.
+    # factor is NaN for a dividend until the close before it is known.
+    event_type = np.dtype([('date', 'M8[D]'), ('kind', 'S1'),
+                           ('value', 'f8'), ('factor', 'f8')])
+
+    # Cumulative factors. Rows dated before date are adjusted by price and
+    # volume. The last row has date NaT and factors of 1.
+    factor_type = np.dtype([('date', 'M8[D]'), ('price', 'f8'),
+                            ('volume', 'f8')])
+
+    split = b'S'
+    dividend = b'D'
+
+    price_fields = ('open_p', 'high_p', 'low_p', 'close_p', 'last', 'bid',
+                    'ask')
+    volume_fields = ('prd_vlm', 'tot_vlm', 'last_sz')
+
+    def __init__(self, root_dir: str = None, hist_conn: HistoryConn = None):
+        self._root_dir = root_dir
+        self._hist_conn = hist_conn
+        self._events = {}
+        self._factors = {}
+        # Symbols with dividends that have no factor yet, and the
+        # (symbol, ex-date) of those IQFeed has no close for.
+        self._pending = set()
+        self._no_data = set()
+        self._lock = threading.RLock()
+        if root_dir is not None:
+            os.makedirs(root_dir, exist_ok=True)
+
+    def update(self, fundamentals: np.array) -> None:
+        """
+        Record any splits and dividends in fundamental messages not seen yet.
+
+        :param fundamentals: Array of QuoteConn.fundamental_type, one row
+            per symbol, as passed to process_fundamentals.
+
+        """
+        for fund in np.atleast_1d(fundamentals):
+            symbol = fund['Symbol'].decode()
+            for split_num in (1, 2):
+                self.add_split(symbol,
+                               fund['Split Factor %d Date' % split_num],
+                               fund['Split Factor %d' % split_num])
+            self.add_dividend(symbol, fund['Ex-dividend Date'],
+                              fund['Dividend Amount'])
+
+    def add_split(self, symbol: str, date: np.datetime64,
+                  factor: float) -> None:
+        """Record a split. Prices before date are multiplied by factor."""
+        if not AdjustmentCache._is_valid(date, factor):
+            return
+        self._add_event(symbol, date, AdjustmentCache.split, factor, factor)
+
+    def add_dividend(self, symbol: str, ex_date: np.datetime64,
+                     amount: float, prev_close: float = None) -> None:
+        """
+        Record a dividend.
+
+        :param symbol: Symbol paying the dividend.
+        :param ex_date: Ex-dividend date.
+        :param amount: Dividend per share.
+        :param prev_close: Close on the trading day before ex_date. Looked
+            up by resolve_pending if not given.
+
+        """
+        if not AdjustmentCache._is_valid(ex_date, amount):
+            return
+        factor = np.nan
+        if prev_close is not None and prev_close > amount:
+            factor = 1.0 - amount / prev_close
+        self._add_event(symbol, ex_date, AdjustmentCache.dividend, amount,
+                        factor)
+
+    def events(self, symbol: str) -> np.array:
+        """Splits and dividends of symbol as AdjustmentCache.event_type."""
+        with self._lock:
+            return self._symbol_events(symbol).copy()
+
+    def factors(self, symbol: str) -> np.array:
+        """Cumulative factors of symbol as AdjustmentCache.factor_type."""
+        with self._lock:
+            factors = self._factors.get(symbol)
+            if factors is None:
+                factors = AdjustmentCache._cumulate(
+                    self._symbol_events(symbol))
+                self._factors[symbol] = factors
+            return factors
+
+    def adjust(self, symbol: str, data: np.array) -> np.array:
+        """
+        Return a copy of history data adjusted for splits and dividends.
+
+        :param symbol: Symbol the data is for.
+        :param data: Array returned by any HistoryConn request_xxx method
+            for daily, bar or tick data, in either order.
+        :return: Array of the same dtype with prices and volumes adjusted.
+
+        """
+        factors = self.factors(symbol)
+        if 'date' in data.dtype.names:
+            dates = data['date'].astype('M8[D]')
+        else:
+            dates = data['timestamp'].astype('M8[D]')
+        idx = np.searchsorted(factors['date'][:-1], dates, side='right')
+        adjusted = np.array(data)
+        price = factors['price'][idx]
+        for name in AdjustmentCache.price_fields:
+            if name in data.dtype.names:
+                adjusted[name] = data[name] * price
+        volume = factors['volume'][idx]
+        for name in AdjustmentCache.volume_fields:
+            if name in data.dtype.names:
+                adjusted[name] = np.rint(data[name] / volume)
+        return adjusted
+
+    def _add_event(self, symbol: str, date: np.datetime64, kind: bytes,
+                   value: float, factor: float) -> None:
+        with self._lock:
+            events = self._symbol_events(symbol)
+            same = ((events['date'] == date) & (events['kind'] == kind))
+            if not same.any():
+                event = np.array([(date, kind, value, factor)],
+                                 AdjustmentCache.event_type)
+                events = np.sort(np.concatenate((events, event)),
+                                 order=['date', 'kind'])
+                self._save(symbol, events)
+            elif not (np.isnan(factor) or
+                      events['factor'][same][0] == factor):
+                events['factor'][same] = factor
+                self._save(symbol, events)
+            if kind == AdjustmentCache.dividend and np.isnan(factor):
+                self._pending.add(symbol)
+
+    def resolve_pending(self, timeout: int = None) -> int:
+        """
+        Look up the closes needed for dividends without a factor yet.
+
+        Dividends IQFeed has no close for are not looked up again.
+
+        :param timeout: Wait upto timeout seconds for each request.
+        :return: Number of dividends resolved.
+
+        """
+        if self._hist_conn is None:
+            return 0
+        today = np.datetime64(datetime.date.today(), 'D')
+        with self._lock:
+            symbols = sorted(self._pending)
+        num_resolved = 0
+        for symbol in symbols:
+            events = self.events(symbol)
+            pending = ((events['kind'] == AdjustmentCache.dividend) &
+                       np.isnan(events['factor']))
+            if not (pending & (events['date'] > today)).any():
+                # Else keep it for the dividends going ex later.
+                with self._lock:
+                    self._pending.discard(symbol)
+            for event in events[pending & (events['date'] <= today)]:
+                if (symbol, event['date']) in self._no_data:
+                    continue
+                ex_date = event['date'].astype(datetime.date)
+                try:
+                    daily = self._hist_conn.request_daily_data_for_dates(
+                        symbol, ex_date - datetime.timedelta(days=10),
+                        ex_date - datetime.timedelta(days=1), ascend=True,
+                        timeout=timeout)
+                except NoDataError:
+                    daily = None
+                if daily is None or len(daily) == 0:
+                    with self._lock:
+                        self._no_data.add((symbol, event['date']))
+                    continue
+                self.add_dividend(symbol, event['date'], event['value'],
+                                  daily['close_p'][-1])
+                num_resolved += 1
+        return num_resolved
+
+    def _symbol_events(self, symbol: str) -> np.array:
+        events = self._events.get(symbol)
+        if events is None:
+            file_name = self._file_name(symbol)
+            if file_name is not None and os.path.isfile(file_name):
+                events = np.load(file_name)
+            else:
+                events = np.empty(0, AdjustmentCache.event_type)
+            self._events[symbol] = events
+            if ((events['kind'] == AdjustmentCache.dividend) &
+                    np.isnan(events['factor'])).any():
+                self._pending.add(symbol)
+        return events
+
+    def _save(self, symbol: str, events: np.array) -> None:
+        self._events[symbol] = events
+        self._factors.pop(symbol, None)
+        file_name = self._file_name(symbol)
+        if file_name is not None:
+            tmp_name = file_name + ".tmp"
+            with open(tmp_name, 'wb') as tmp_file:
+                np.save(tmp_file, events)
+            os.replace(tmp_name, file_name)
+
+    def _file_name(self, symbol: str) -> str:
+        if self._root_dir is None:
+            return None
+        return os.path.join(self._root_dir, "%s.npy" % urllib.parse.quote(
+            symbol, safe=''))
+
+    @staticmethod
+    def _is_valid(date: np.datetime64, value: float) -> bool:
+        """IQFeed sends a blank date and NaN value for no event."""
+        return (not np.isnat(date) and date > np.datetime64('1900-01-01')
+                and not np.isnan(value) and value > 0)
+
+    @staticmethod
+    def _cumulate(events: np.array) -> np.array:
+        """Turn events into cumulative factors."""
+        price = np.where(np.isnan(events['factor']), 1.0, events['factor'])
+        volume = np.where(events['kind'] == AdjustmentCache.split,
+                          events['factor'], 1.0)
+        factors = np.empty(len(events) + 1, AdjustmentCache.factor_type)
+        factors['date'][:-1] = events['date']
+        factors['date'][-1] = np.datetime64('NaT')
+        # Data before event i is adjusted by event i and all later events.
+        factors['price'][:-1] = np.cumprod(price[::-1])[::-1]
+        factors['volume'][:-1] = np.cumprod(volume[::-1])[::-1]
+        factors[-1]['price'] = 1.0
+        factors[-1]['volume'] = 1.0
+        return factors
+
+
+class AdjustmentListener(SilentQuoteListener):
+    """
+    QuoteListener that passes fundamental messages to an AdjustmentCache.
+
+    :param name: Name of the listener.
+    :param cache: AdjustmentCache to update.
+
+    """
+
+    def __init__(self, name: str, cache: AdjustmentCache):
+        super().__init__(name)
+        self._cache = cache
+
+    def process_fundamentals(self, fund: np.array) -> None:
+        self._cache.update(fund)
@@ -0,0 +1,510 @@
+# coding=utf-8
+"""
+Store data from HistoryConn in append-only files you can memory-map.
+
+An Archive keeps one directory per symbol and data type (say "ticks" or
+"bars_60s") under root_dir. Each directory has three files:
+
+    data.bin:   The rows, back to back, exactly as they are laid out in
+                the numpy array. Rows are always appended in time order.
+    dtype.npy:  An empty array with the dtype of the rows.
+    index.npy:  The row number at which each day starts.
+
+Reading a time range looks up the days in the index, binary searches the
+timestamps of just those days and returns a read-only np.memmap view of
+data.bin. Nothing is copied, so reading a year of minute bars takes about
+as long as opening the file.
+
+Arrays with a timestamp column (timestamps=True or compact=True in
+HistoryConn), date and time columns (the default) or just a date column
+(daily data) can be stored.
+
+    archive = iq.Archive("/data/iqfeed")
+    archive.append("@ES#", "bars_60s", hist_conn.request_bars(...))
+    bars = archive.read("@ES#", "bars_60s", bgn, end)
+
+EncodedArchive has the same API but delta encodes and compresses the data
+in blocks. It takes a fraction of the space on disk at the cost of
+decoding the blocks a read touches.
+
+"""
+
+import datetime
+import lzma
+import os
+import threading
+import urllib.parse
+import zlib
+
+import numpy as np
+
+
+class Archive:
+    """
+    Append-only per-symbol store of numpy structured arrays.
+
+    :param root_dir: Directory under which everything is stored.
+
+    """
+
+    data_file = "data.bin"
+    dtype_file = "dtype.npy"
+    index_file = "index.npy"
+
+    # Each row of index.npy is a day and the row number in data.bin at
+    # which that day starts. The last row has day NaT and the number of
+    # rows in data.bin.
+    index_type = np.dtype([('day', 'M8[D]'), ('start', 'i8')])
+
+    def __init__(self, root_dir: str):
+        self._root_dir = root_dir
+        self._lock = threading.Lock()
+
+    def append(self, symbol: str, data_name: str, data: np.array) -> None:
+        """
+        Add rows to the end of what's stored.
+
+        :param symbol: Symbol the data is for.
+        :param data_name: Type of data, eg "ticks" or "bars_60s".
+        :param data: Rows sorted oldest first, none older than what's
+            already stored. See last_timestamp.
+
+        """
+        if len(data) == 0:
+            return
+        ts = Archive._timestamps(data)
+        if np.any(ts[1:] < ts[:-1]):
+            raise ValueError("Rows must be sorted oldest first")
+        data_dir = self._data_dir(symbol, data_name)
+        with self._lock:
+            os.makedirs(data_dir, exist_ok=True)
+            dtype = Archive._read_dtype(data_dir)
+            if dtype is None:
+                dtype = data.dtype
+                np.save(os.path.join(data_dir, Archive.dtype_file),
+                        np.empty(0, dtype))
+            elif dtype != data.dtype:
+                raise ValueError("Stored dtype is %s, not %s" % (
+                    dtype, data.dtype))
+            index = Archive._read_index(data_dir)
+            num_rows = int(index['start'][-1])
+            if num_rows > 0:
+                last_ts = Archive._last_timestamp(data_dir, dtype, num_rows)
+                if ts[0] < last_ts:
+                    raise ValueError(
+                        "Rows start at %s, before the last stored row at "
+                        "%s" % (ts[0], last_ts))
+            # Anything past num_rows is left over from an append that
+            # didn't finish so it's overwritten.
+            with open(os.path.join(data_dir, Archive.data_file),
+                      'ab') as data_file:
+                data_file.truncate(num_rows * dtype.itemsize)
+                data_file.write(np.ascontiguousarray(data).tobytes())
+            days = ts.astype('M8[D]')
+            new_day = np.concatenate(([True], days[1:] != days[:-1]))
+            if len(index) > 1 and index['day'][-2] == days[0]:
+                new_day[0] = False
+            new_entries = np.empty(int(new_day.sum()) + 1,
+                                   Archive.index_type)
+            new_entries['day'][:-1] = days[new_day]
+            new_entries['start'][:-1] = num_rows + np.flatnonzero(new_day)
+            new_entries[-1] = (np.datetime64('NaT'), num_rows + len(data))
+            Archive._write_npy(os.path.join(data_dir, Archive.index_file),
+                               np.concatenate((index[:-1], new_entries)))
+
+    def read(self, symbol: str, data_name: str,
+             bgn: datetime.datetime = None,
+             end: datetime.datetime = None) -> np.array:
+        """
+        Rows from bgn to end, both inclusive, oldest first.
+
+        :param symbol: Symbol the data is for.
+        :param data_name: Type of data, eg "ticks" or "bars_60s".
+        :param bgn: Earliest timestamp. Default is the first stored.
+        :param end: Latest timestamp. Default is the last stored.
+        :return: A read-only np.memmap. An empty array if nothing is stored.
+
+        """
+        data_dir = self._data_dir(symbol, data_name)
+        dtype = Archive._read_dtype(data_dir)
+        if dtype is None:
+            raise KeyError("Nothing stored for %s %s" % (symbol, data_name))
+        index = Archive._read_index(data_dir)
+        num_rows = int(index['start'][-1])
+        if num_rows == 0:
+            return np.empty(0, dtype)
+        data = Archive._memmap(data_dir, dtype, num_rows)
+        days = index['day'][:-1]
+        starts = index['start']
+        first = 0
+        last = num_rows
+        if bgn is not None:
+            bgn = np.datetime64(bgn)
+            day_num = max(np.searchsorted(
+                days, bgn.astype('M8[D]'), side='right') - 1, 0)
+            lo, hi = starts[day_num], starts[day_num + 1]
+            first = lo + np.searchsorted(Archive._timestamps(data[lo:hi]),
+                                         bgn, side='left')
+        if end is not None:
+            end = np.datetime64(end)
+            day_num = np.searchsorted(
+                days, end.astype('M8[D]'), side='right') - 1
+            if day_num < 0:
+                last = 0
+            else:
+                lo, hi = starts[day_num], starts[day_num + 1]
+                last = lo + np.searchsorted(
+                    Archive._timestamps(data[lo:hi]), end, side='right')
+        return data[first:max(first, last)]
+
+    def days(self, symbol: str, data_name: str) -> np.array:
+        """Days for which there is data, as an array of M8[D]."""
+        index = Archive._read_index(self._data_dir(symbol, data_name))
+        return index['day'][:-1].copy()
+
+    def last_timestamp(self, symbol: str, data_name: str) -> np.datetime64:
+        """Timestamp of the last stored row or None if there isn't one."""
+        data_dir = self._data_dir(symbol, data_name)
+        dtype = Archive._read_dtype(data_dir)
+        if dtype is None:
+            return None
+        num_rows = int(Archive._read_index(data_dir)['start'][-1])
+        if num_rows == 0:
+            return None
+        return Archive._last_timestamp(data_dir, dtype, num_rows)
+
+    def _data_dir(self, symbol: str, data_name: str) -> str:
+        return os.path.join(self._root_dir,
+                            urllib.parse.quote(symbol, safe=''),
+                            data_name)
+
+    @staticmethod
+    def _timestamps(data: np.array) -> np.array:
+        names = data.dtype.names
+        if 'timestamp' in names:
+            return data['timestamp']
+        if 'time' in names:
+            return data['date'] + data['time'].astype('m8[us]')
+        return data['date'].astype('M8[us]')
+
+    @staticmethod
+    def _read_dtype(data_dir: str) -> np.dtype:
+        dtype_name = os.path.join(data_dir, Archive.dtype_file)
+        if not os.path.isfile(dtype_name):
+            return None
+        return np.load(dtype_name).dtype
+
+    @staticmethod
+    def _read_index(data_dir: str) -> np.array:
+        index_name = os.path.join(data_dir, Archive.index_file)
+        if os.path.isfile(index_name):
+            return np.load(index_name)
+        return np.array([(np.datetime64('NaT'), 0)], Archive.index_type)
+
+    @staticmethod
+    def _memmap(data_dir: str, dtype: np.dtype, num_rows: int) -> np.memmap:
+        return np.memmap(os.path.join(data_dir, Archive.data_file),
+                         dtype=dtype, mode='r', shape=(num_rows,))
+
+    @staticmethod
+    def _last_timestamp(data_dir: str, dtype: np.dtype,
+                        num_rows: int) -> np.datetime64:
+        with open(os.path.join(data_dir, Archive.data_file),
+                  'rb') as data_file:
+            data_file.seek((num_rows - 1) * dtype.itemsize)
+            last_row = np.frombuffer(data_file.read(dtype.itemsize), dtype)
+        return Archive._timestamps(last_row)[0]
+
+    @staticmethod
+    def _write_npy(file_name: str, data: np.array) -> None:
+        """Write a .npy so readers never see a half written file."""
+        tmp_name = file_name + ".tmp"
+        with open(tmp_name, 'wb') as tmp_file:
+            np.save(tmp_file, data)
+        os.replace(tmp_name, file_name)
+
+
+class EncodedArchive:
+    """
+    Like Archive but stores the data encoded and compressed in blocks.
+
+    :param root_dir: Directory under which everything is stored.
+    :param compression: 'zlib', 'lzma' or None to store the columns as is.
+    :param block_rows: Most rows in a block. Blocks never span days.
+
+    Each column of a block is encoded separately. Timestamps, dates, times
+    and integers are stored as the difference from the previous row.
+    Prices are scaled to integers by the smallest power of 10 that
+    gets them back exactly and then stored as differences too. Anything
+    else, or any column that wouldn't come back exactly, is stored as is.
+    The bytes of each column are then shuffled so the high bytes of
+    every value are next to each other, and the block is compressed.
+
+    read() decodes only the blocks that overlap the requested range and
+    returns an ordinary numpy array. It has the same API as Archive
+    otherwise.
+
+    """
+
+    block_file = "blocks.bin"
+    dtype_file = Archive.dtype_file
+    index_file = "blocks.npy"
+
+    index_type = np.dtype([('first', 'M8[ns]'), ('last', 'M8[ns]'),
+                           ('offset', 'i8'), ('nbytes', 'i8'),
+                           ('num_rows', 'i8'), ('codec', 'u1')])
+
+    # How each column of a block is encoded.
+    _col_header_type = np.dtype([('kind', 'u1'), ('exp', 'i1'),
+                                 ('nbytes', 'i8')])
+    _raw = 0
+    _delta = 1
+    _scaled_delta = 2
+    _max_exp = 8
+
+    _codecs = {None: 0, 'zlib': 1, 'lzma': 2}
+
+    def __init__(self, root_dir: str, compression: str = 'zlib',
+                 block_rows: int = 65536):
+        assert compression in EncodedArchive._codecs
+        assert block_rows > 0
+        self._root_dir = root_dir
+        self._codec = EncodedArchive._codecs[compression]
+        self._block_rows = block_rows
+        self._lock = threading.Lock()
+
+    def append(self, symbol: str, data_name: str, data: np.array) -> None:
+        """
+        Add rows to the end of what's stored.
+
+        :param symbol: Symbol the data is for.
+        :param data_name: Type of data, eg "ticks" or "bars_60s".
+        :param data: Rows sorted oldest first, none older than what's
+            already stored. See last_timestamp.
+
+        """
+        if len(data) == 0:
+            return
+        ts = Archive._timestamps(data).astype('M8[ns]')
+        if np.any(ts[1:] < ts[:-1]):
+            raise ValueError("Rows must be sorted oldest first")
+        data_dir = self._data_dir(symbol, data_name)
+        with self._lock:
+            os.makedirs(data_dir, exist_ok=True)
+            dtype = Archive._read_dtype(data_dir)
+            if dtype is None:
+                dtype = data.dtype
+                np.save(os.path.join(data_dir, EncodedArchive.dtype_file),
+                        np.empty(0, dtype))
+            elif dtype != data.dtype:
+                raise ValueError("Stored dtype is %s, not %s" % (
+                    dtype, data.dtype))
+            index = EncodedArchive._read_index(data_dir)
+            if len(index) > 0 and ts[0] < index['last'][-1]:
+                raise ValueError(
+                    "Rows start at %s, before the last stored row at %s" % (
+                        ts[0], index['last'][-1]))
+            offset = 0
+            if len(index) > 0:
+                offset = int(index['offset'][-1] + index['nbytes'][-1])
+            days = ts.astype('M8[D]')
+            day_starts = np.flatnonzero(np.concatenate(
+                ([True], days[1:] != days[:-1])))
+            bounds = []
+            for day_num, start in enumerate(day_starts):
+                stop = (day_starts[day_num + 1]
+                        if day_num + 1 < len(day_starts) else len(data))
+                bounds.extend(
+                    (bgn, min(bgn + self._block_rows, stop))
+                    for bgn in range(start, stop, self._block_rows))
+            new_entries = np.empty(len(bounds), EncodedArchive.index_type)
+            # Anything past offset is left over from an append that
+            # didn't finish so it's overwritten.
+            with open(os.path.join(data_dir, EncodedArchive.block_file),
+                      'ab') as block_file:
+                block_file.truncate(offset)
+                for block_num, (bgn, end) in enumerate(bounds):
+                    block = EncodedArchive._encode(data[bgn:end],
+                                                   self._codec)
+                    block_file.write(block)
+                    new_entries[block_num] = (ts[bgn], ts[end - 1], offset,
+                                              len(block), end - bgn,
+                                              self._codec)
+                    offset += len(block)
+            Archive._write_npy(
+                os.path.join(data_dir, EncodedArchive.index_file),
+                np.concatenate((index, new_entries)))
+
+    def read(self, symbol: str, data_name: str,
+             bgn: datetime.datetime = None,
+             end: datetime.datetime = None) -> np.array:
+        """
+        Rows from bgn to end, both inclusive, oldest first.
+
+        :param symbol: Symbol the data is for.
+        :param data_name: Type of data, eg "ticks" or "bars_60s".
+        :param bgn: Earliest timestamp. Default is the first stored.
+        :param end: Latest timestamp. Default is the last stored.
+        :return: A numpy array. Empty if nothing is stored.
+
+        """
+        data_dir = self._data_dir(symbol, data_name)
+        dtype = Archive._read_dtype(data_dir)
+        if dtype is None:
+            raise KeyError("Nothing stored for %s %s" % (symbol, data_name))
+        index = EncodedArchive._read_index(data_dir)
+        first_block = 0
+        last_block = len(index)
+        if bgn is not None:
+            bgn = np.datetime64(bgn).astype('M8[ns]')
+            first_block = np.searchsorted(index['last'], bgn, side='left')
+        if end is not None:
+            end = np.datetime64(end).astype('M8[ns]')
+            last_block = np.searchsorted(index['first'], end, side='right')
+        if first_block >= last_block:
+            return np.empty(0, dtype)
+        blocks = index[first_block:last_block]
+        data = np.empty(int(blocks['num_rows'].sum()), dtype)
+        row_num = 0
+        with open(os.path.join(data_dir, EncodedArchive.block_file),
+                  'rb') as block_file:
+            block_file.seek(int(blocks['offset'][0]))
+            raw = block_file.read(int(blocks['offset'][-1] +
+                                      blocks['nbytes'][-1] -
+                                      blocks['offset'][0]))
+        base = int(blocks['offset'][0])
+        for block in blocks:
+            block_bgn = int(block['offset']) - base
+            num_rows = int(block['num_rows'])
+            data[row_num:row_num + num_rows] = EncodedArchive._decode(
+                raw[block_bgn:block_bgn + int(block['nbytes'])], dtype,
+                num_rows, int(block['codec']))
+            row_num += num_rows
+        ts = Archive._timestamps(data)
+        first = 0 if bgn is None else np.searchsorted(ts, bgn, side='left')
+        last = len(data) if end is None else np.searchsorted(ts, end,
+                                                             side='right')
+        return data[first:last]
+
+    def days(self, symbol: str, data_name: str) -> np.array:
+        """Days for which there is data, as an array of M8[D]."""
+        index = EncodedArchive._read_index(
+            self._data_dir(symbol, data_name))
+        return np.unique(index['first'].astype('M8[D]'))
+
+    def last_timestamp(self, symbol: str, data_name: str) -> np.datetime64:
+        """Timestamp of the last stored row or None if there isn't one."""
+        index = EncodedArchive._read_index(
+            self._data_dir(symbol, data_name))
+        if len(index) == 0:
+            return None
+        return index['last'][-1]
+
+    def _data_dir(self, symbol: str, data_name: str) -> str:
+        return os.path.join(self._root_dir,
+                            urllib.parse.quote(symbol, safe=''),
+                            data_name)
+
+    @staticmethod
+    def _read_index(data_dir: str) -> np.array:
+        index_name = os.path.join(data_dir, EncodedArchive.index_file)
+        if os.path.isfile(index_name):
+            return np.load(index_name)
+        return np.empty(0, EncodedArchive.index_type)
+
+    @staticmethod
+    def _shuffle(col_bytes: np.array, itemsize: int) -> bytes:
+        """Put byte k of every value together, for each k."""
+        return col_bytes.reshape(-1, itemsize).T.tobytes()
+
+    @staticmethod
+    def _unshuffle(col_bytes: bytes, itemsize: int) -> np.array:
+        return np.frombuffer(col_bytes, 'u1').reshape(itemsize, -1).T
+
+    @staticmethod
+    def _encode_col(col: np.array):
+        """Return (kind, exp, array to store) for one column."""
+        kind = col.dtype.kind
+        if kind in 'Mm':
+            values = col.view('i8')
+            return EncodedArchive._delta, 0, np.diff(values, prepend=0)
+        if kind in 'iu' and (kind == 'i' or col.dtype.itemsize < 8 or
+                             np.all(col <= np.iinfo('i8').max)):
+            values = col.astype('i8')
+            return EncodedArchive._delta, 0, np.diff(values, prepend=0)
+        if kind == 'f' and np.all(np.isfinite(col)):
+            for exp in range(EncodedArchive._max_exp + 1):
+                scaled = np.rint(col.astype('f8') * 10 ** exp)
+                if np.any(np.abs(scaled) >= 2 ** 53):
+                    break
+                values = scaled.astype('i8')
+                back = (values / 10 ** exp).astype(col.dtype)
+                # -0.0 == 0.0 but only 0.0 comes back, so check signs too.
+                if (np.array_equal(back, col) and
+                        np.array_equal(np.signbit(back), np.signbit(col))):
+                    return (EncodedArchive._scaled_delta, exp,
+                            np.diff(values, prepend=0))
+        return EncodedArchive._raw, 0, col
+
+    @staticmethod
+    def _decode_col(kind: int, exp: int, stored: np.array,
+                    dtype: np.dtype) -> np.array:
+        if kind == EncodedArchive._raw:
+            return stored.view(dtype).reshape(-1)
+        values = np.cumsum(stored.view('i8').reshape(-1))
+        if kind == EncodedArchive._scaled_delta:
+            return (values / 10 ** exp).astype(dtype)
+        if dtype.kind in 'Mm':
+            return values.view(dtype)
+        return values.astype(dtype)
+
+    @staticmethod
+    def _encode(data: np.array, codec: int) -> bytes:
+        """Encode and compress a block of rows."""
+        names = data.dtype.names
+        headers = np.empty(len(names), EncodedArchive._col_header_type)
+        payloads = []
+        for col_num, name in enumerate(names):
+            if codec == EncodedArchive._codecs[None]:
+                # Encoding only pays off if the result is compressed
+                kind, exp, stored = EncodedArchive._raw, 0, data[name]
+            else:
+                kind, exp, stored = EncodedArchive._encode_col(data[name])
+            stored = np.ascontiguousarray(stored)
+            payload = EncodedArchive._shuffle(stored.view('u1'),
+                                              stored.dtype.itemsize)
+            headers[col_num] = (kind, exp, len(payload))
+            payloads.append(payload)
+        block = headers.tobytes() + b"".join(payloads)
+        if codec == EncodedArchive._codecs['zlib']:
+            block = zlib.compress(block)
+        elif codec == EncodedArchive._codecs['lzma']:
+            block = lzma.compress(block)
+        return block
+
+    @staticmethod
+    def _decode(block: bytes, dtype: np.dtype, num_rows: int,
+                codec: int) -> np.array:
+        """Decompress and decode a block of rows."""
+        if codec == EncodedArchive._codecs['zlib']:
+            block = zlib.decompress(block)
+        elif codec == EncodedArchive._codecs['lzma']:
+            block = lzma.decompress(block)
+        names = dtype.names
+        header_len = len(names) * EncodedArchive._col_header_type.itemsize
+        headers = np.frombuffer(block[:header_len],
+                                EncodedArchive._col_header_type)
+        data = np.empty(num_rows, dtype)
+        pos = header_len
+        for name, (kind, exp, nbytes) in zip(names, headers):
+            payload = block[pos:pos + nbytes]
+            pos += nbytes
+            if kind == EncodedArchive._raw:
+                itemsize = dtype[name].itemsize
+            else:
+                itemsize = 8
+            stored = np.ascontiguousarray(
+                EncodedArchive._unshuffle(payload, itemsize))
+            data[name] = EncodedArchive._decode_col(kind, exp, stored,
+                                                    dtype[name])
+        return data
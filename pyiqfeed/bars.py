@@ -0,0 +1,280 @@
+# coding=utf-8
+"""
+Build bars locally from ticks or from finer bars.
+
+If you already have 1 minute bars there is no need to ask IQFeed for 5,
+15 or 60 minute bars for the same period. resample_bars builds them from
+the 1 minute bars, and weekly_bars and monthly_bars build weekly and
+monthly bars from daily data. All of them work on whole arrays at a time
+using numpy's reduceat, so they are fast even for years of data.
+
+Bars are grouped within a day the same way IQFeed does, counting
+intervals from midnight, so a 300 second bar labelled at the end covers
+the 5 one minute bars labelled from 09:31:00 to 09:35:00 and is itself
+labelled 09:35:00.
+
+tick_bars builds time, volume and tick bars from tick data, optionally
+leaving out trades with particular trade conditions or last types.
+
+"""
+
+import numpy as np
+from .conn import HistoryConn
+
+
+def _group_starts(keys: np.array) -> np.array:
+    """Index of the first row of each run of equal keys."""
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.intp)
+    return np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+
+
+def _combine(data: np.array, starts: np.array, out: np.array) -> None:
+    """Fill the price and volume fields of out, one row per group."""
+    last = np.concatenate((starts[1:], [len(data)])) - 1
+    out['open_p'] = data['open_p'][starts]
+    out['high_p'] = np.maximum.reduceat(data['high_p'], starts)
+    out['low_p'] = np.minimum.reduceat(data['low_p'], starts)
+    out['close_p'] = data['close_p'][last]
+    for name in ('prd_vlm', 'num_trds'):
+        if name in data.dtype.names:
+            out[name] = np.add.reduceat(data[name].astype('u8'), starts)
+    for name in ('tot_vlm', 'open_int'):
+        if name in data.dtype.names:
+            out[name] = data[name][last]
+
+
+def _is_descending(ts: np.array) -> bool:
+    return len(ts) > 1 and ts[0] > ts[-1]
+
+
+def resample_bars(bars: np.array, interval_len: int,
+                  label_at_beginning: bool = False) -> np.array:
+    """
+    Combine bars into bars interval_len seconds long.
+
+    :param bars: Bars from request_bars and friends, in either order. May
+        be of dtype HistoryConn.bar_type, bar_ts_type or bar_compact_type.
+    :param interval_len: Length of the new bars in seconds. Should be a
+        multiple of the length of the bars passed in.
+    :param label_at_beginning: Whether bars are labelled with the time at
+        the beginning or the end of the bar. Must match how the bars passed
+        in were requested.
+    :return: Array with the same dtype and order as bars.
+
+    tot_vlm of each new bar is tot_vlm of the last bar in it.
+
+    """
+    assert interval_len > 0
+    if 'timestamp' in bars.dtype.names:
+        ts = bars['timestamp']
+    else:
+        ts = bars['date'] + bars['time']
+    descending = _is_descending(ts)
+    if descending:
+        bars = bars[::-1]
+        ts = ts[::-1]
+    day = ts.astype('M8[D]')
+    since_midnight = (ts - day).astype('m8[us]').astype('i8')
+    interval_us = np.int64(interval_len) * 1000000
+    if label_at_beginning:
+        label = since_midnight // interval_us * interval_us
+    else:
+        label = -(-since_midnight // interval_us) * interval_us
+    starts = _group_starts(day.astype('i8') * 86400000000 + label)
+    resampled = np.empty(len(starts), bars.dtype)
+    if len(starts) > 0:
+        new_time = label[starts].astype('m8[us]')
+        if 'timestamp' in bars.dtype.names:
+            resampled['timestamp'] = day[starts] + new_time
+        else:
+            resampled['date'] = day[starts]
+            resampled['time'] = new_time
+        _combine(bars, starts, resampled)
+    return resampled[::-1] if descending else resampled
+
+
+def _daily_groups(daily: np.array, keys: np.array) -> np.array:
+    """Combine daily_type rows with the same key into one row each."""
+    starts = _group_starts(keys)
+    combined = np.empty(len(starts), daily.dtype)
+    if len(starts) > 0:
+        last = np.concatenate((starts[1:], [len(daily)])) - 1
+        combined['date'] = daily['date'][last]
+        _combine(daily, starts, combined)
+    return combined
+
+
+def weekly_bars(daily: np.array) -> np.array:
+    """
+    Combine daily data into weeks starting on Monday.
+
+    :param daily: Array of dtype HistoryConn.daily_type in either order.
+    :return: Array of the same dtype and order, one row per week, dated
+        with the last day in daily that falls in that week.
+
+    """
+    descending = _is_descending(daily['date'])
+    if descending:
+        daily = daily[::-1]
+    # Day 0 of M8[D] is a Thursday so shift it to make weeks start Monday.
+    weeks = (daily['date'].astype('i8') + 3) // 7
+    weekly = _daily_groups(daily, weeks)
+    return weekly[::-1] if descending else weekly
+
+
+def monthly_bars(daily: np.array) -> np.array:
+    """
+    Combine daily data into calendar months.
+
+    :param daily: Array of dtype HistoryConn.daily_type in either order.
+    :return: Array of the same dtype and order, one row per month, dated
+        with the last day in daily that falls in that month.
+
+    """
+    descending = _is_descending(daily['date'])
+    if descending:
+        daily = daily[::-1]
+    months = daily['date'].astype('M8[M]').astype('i8')
+    monthly = _daily_groups(daily, months)
+    return monthly[::-1] if descending else monthly
+
+
+def _packed_conds(ticks: np.array) -> np.array:
+    """The four trade conditions of each tick in a u4, cond1 lowest."""
+    if 'conds' in ticks.dtype.names:
+        return np.ascontiguousarray(ticks['conds'])
+    offset = ticks.dtype.fields['cond1'][1]
+    if all(ticks.dtype.fields['cond%d' % (cond_num + 1)][1] ==
+           offset + cond_num for cond_num in range(4)):
+        # cond1 to cond4 are next to each other, so read them in one go.
+        conds_type = np.dtype({'names': ['conds'], 'formats': ['<u4'],
+                               'offsets': [offset],
+                               'itemsize': ticks.dtype.itemsize})
+        return np.ascontiguousarray(ticks.view(conds_type)['conds'])
+    conds = np.zeros(len(ticks), dtype='u4')
+    for cond_num in range(4):
+        conds |= ticks['cond%d' % (cond_num + 1)].astype('u4') << (
+            8 * cond_num)
+    return conds
+
+
+def _kept_ticks(ticks: np.array, exclude_conds, last_types) -> np.array:
+    """Mask of the ticks that pass the filters of tick_bars."""
+    keep = np.ones(len(ticks), dtype=bool)
+    if exclude_conds is not None:
+        conds = _packed_conds(ticks)
+        ones = np.uint32(0x01010101)
+        highs = np.uint32(0x80808080)
+        for cond in exclude_conds:
+            # Bytes of zeros are where conds has cond. A byte of x is zero
+            # exactly when that byte of (x - ones) & ~x has its high bit
+            # set, which checks all four conditions at once.
+            zeros = conds ^ (np.uint32(cond) * ones)
+            keep &= ((zeros - ones) & ~zeros & highs) == 0
+    if last_types is not None:
+        type_ok = np.zeros(256, dtype=bool)
+        for last_type in last_types:
+            type_ok[ord(last_type)] = True
+        keep &= type_ok[ticks['last_type'].view('u1')]
+    return keep
+
+
+def tick_bars(ticks: np.array, interval_len: int, interval_type: str = 's',
+              label_at_beginning: bool = False, exclude_conds=None,
+              last_types=None) -> np.array:
+    """
+    Build bars from tick data.
+
+    :param ticks: Ticks from request_ticks and friends, in either order. May
+        be of dtype HistoryConn.tick_type, tick_ts_type or tick_compact_type.
+    :param interval_len: Length of each bar in interval_type units.
+    :param interval_type: 's' = secs, 'v' = volume, 't' = ticks
+    :param label_at_beginning: Label time bars with the time at the
+        beginning of the bar instead of the end. Volume and tick bars are
+        labelled with the time of their first or last trade.
+    :param exclude_conds: Leave out trades with any of these trade
+        conditions.
+    :param last_types: Only use trades whose last_type is one of these,
+        eg [b'O'] for trades from the last qualified trade feed only.
+    :return: Array of dtype HistoryConn.bar_type, or bar_ts_type for ticks
+        with a timestamp column, in the same order as ticks.
+
+    Time bars are ticks in [label - interval_len, label) counting from
+    midnight. A volume bar ends with the trade that takes the day's volume
+    up to or past the next multiple of interval_len, so a volume bar can
+    have more than interval_len volume in it. Bars start afresh each day
+    and bars with no trades are not returned.
+
+    """
+    assert interval_type in ('s', 'v', 't')
+    assert interval_len > 0
+    timestamps = 'timestamp' in ticks.dtype.names
+    if exclude_conds is not None or last_types is not None:
+        kept = np.flatnonzero(_kept_ticks(ticks, exclude_conds, last_types))
+        if len(kept) < len(ticks):
+            # Gathering the fields needed in one pass over the ticks is
+            # much faster than filtering each column on its own.
+            names = ['timestamp'] if timestamps else ['date', 'time']
+            ticks = ticks[names + ['last', 'last_sz', 'tot_vlm']].take(kept)
+    if timestamps:
+        day = ticks['timestamp'].astype('M8[D]')
+        tod = (ticks['timestamp'] - day).astype('m8[us]')
+    else:
+        day = ticks['date']
+        tod = ticks['time']
+    descending = len(ticks) > 1 and (day[0], tod[0]) > (day[-1], tod[-1])
+    if descending:
+        ticks = ticks[::-1]
+        day = day[::-1]
+        tod = tod[::-1]
+    prices = ticks['last']
+    sizes = ticks['last_sz']
+    tot_vlm = ticks['tot_vlm']
+    num_ticks = len(prices)
+
+    new_day = day[1:] != day[:-1]
+    if interval_type == 's':
+        interval_us = np.int64(interval_len) * 1000000
+        bucket = tod.astype('i8') // interval_us
+    else:
+        day_starts = np.flatnonzero(np.concatenate(([num_ticks > 0],
+                                                    new_day)))
+        day_lens = np.diff(np.concatenate((day_starts, [num_ticks])))
+        if interval_type == 't':
+            count = np.arange(num_ticks)
+            bucket = count - np.repeat(count[day_starts], day_lens)
+        else:
+            # Volume traded earlier in the same day before each tick.
+            vlm = np.cumsum(sizes, dtype='u8')
+            vlm -= sizes
+            bucket = vlm - np.repeat(vlm[day_starts], day_lens)
+        bucket //= interval_len
+    starts = np.flatnonzero(np.concatenate((
+        [num_ticks > 0], (bucket[1:] != bucket[:-1]) | new_day)))
+
+    bar_dtype = HistoryConn.bar_ts_type if timestamps else HistoryConn.bar_type
+    bars = np.empty(len(starts), bar_dtype)
+    if len(starts) > 0:
+        last = np.concatenate((starts[1:], [num_ticks])) - 1
+        if interval_type == 's':
+            label = bucket[starts] + (0 if label_at_beginning else 1)
+            bar_day = day[starts]
+            bar_time = (label * interval_us).astype('m8[us]')
+        else:
+            label_idx = starts if label_at_beginning else last
+            bar_day = day[label_idx]
+            bar_time = tod[label_idx]
+        if timestamps:
+            bars['timestamp'] = bar_day + bar_time
+        else:
+            bars['date'] = bar_day
+            bars['time'] = bar_time
+        bars['open_p'] = prices[starts]
+        bars['high_p'] = np.maximum.reduceat(prices, starts)
+        bars['low_p'] = np.minimum.reduceat(prices, starts)
+        bars['close_p'] = prices[last]
+        bars['tot_vlm'] = tot_vlm[last]
+        bars['prd_vlm'] = np.add.reduceat(sizes, starts, dtype='u8')
+        bars['num_trds'] = np.diff(np.concatenate((starts, [num_ticks])))
+    return bars[::-1] if descending else bars
@@ -0,0 +1,223 @@
+# coding=utf-8
+"""
+Cache futures, spread and option chains until they can have changed.
+
+A chain only changes when a contract is listed or expires. ChainCache is
+a RequestCache that keeps the responses to CFU, CFS, CFO and CEO requests
+on disk until the earliest contract in the chain expires or the next
+listing refresh comes around, whichever is first. Pass it to a LookupConn:
+
+    chains = iq.ChainCache("/data/chains")
+    lookup_conn = iq.LookupConn(name="lookup", cache=chains)
+    lookup_conn.request_futures_chain("@ES", near_months=4)
+
+Other lookup requests are cached like any RequestCache would.
+
+Chains are saved as one JSON file each under root_dir, so a restart reads
+them back instead of downloading them again.
+
+When a contract expires is worked out from its symbol. Equity options have
+the day in the symbol and are good until the end of that day. Futures,
+futures spreads and options on futures only have the contract month, and
+many contracts expire in the month before the contract month, eg crude
+oil, so those are good until the first day of the month before the
+earliest contract month.
+
+"""
+
+import datetime
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+from typing import Sequence
+
+import numpy as np
+from .conn import LookupConn
+from .options import parse_equity_option_symbols
+from .options import parse_futures_option_symbols
+from .request_cache import RequestCache
+
+_futures_month = {letter: month for month, letter in
+                  LookupConn.futures_month_letter_map.items()}
+
+# Month letter and 2 digit year at the end of a futures symbol.
+_contract_month_re = re.compile(r"([A-Z])(\d\d)$")
+
+
+class ChainCache(RequestCache):
+    """
+    RequestCache that keeps chains on disk until they may be out of date.
+
+    :param root_dir: Directory chains are saved in.
+    :param refresh_time: Local time of day after which chains fetched
+        earlier are fetched again, to pick up newly listed contracts.
+    :param refresh_weekdays: Days of the week (Monday is 0) refresh_time
+        applies to. An empty sequence means chains are only refetched
+        when a contract in them expires.
+    :param kwargs: Passed on to RequestCache for other requests. A ttl of
+        0 for a chain type in ttls turns off caching of that type.
+
+    """
+
+    chain_types = ("CFU", "CFS", "CFO", "CEO")
+
+    def __init__(self, root_dir: str,
+                 refresh_time: datetime.time = datetime.time(6, 0),
+                 refresh_weekdays: Sequence[int] = (0, 1, 2, 3, 4, 5, 6),
+                 **kwargs):
+        super().__init__(**kwargs)
+        self._root_dir = root_dir
+        self._refresh_time = refresh_time
+        self._refresh_weekdays = tuple(refresh_weekdays)
+        self._chains = {}
+        self._chain_lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def get(self, key: str):
+        """Return the cached response for key or None."""
+        if not self._is_chain(key):
+            return super().get(key)
+        with self._chain_lock:
+            entry = self._chains.get(key)
+            if entry is None:
+                entry = self._load(key)
+            if entry is not None and entry[0] <= time.time():
+                self._remove_chain(key)
+                entry = None
+            if entry is not None:
+                self._chains[key] = entry
+        with self._lock:
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+        return RequestCache._thaw(entry[1])
+
+    def put(self, key: str, value):
+        """
+        Cache value under key.
+
+        Returns what the caller should hand back to its user in place of
+        value, ie a copy of value.
+
+        """
+        if not self._is_chain(key):
+            return super().put(key, value)
+        value = RequestCache._freeze(value)
+        expires = min(self._next_refresh(), ChainCache.good_until(
+            key.split(',', 1)[0], value))
+        with self._chain_lock:
+            self._chains[key] = (expires, value)
+            file_name = self._file_name(key)
+            tmp_name = file_name + ".tmp"
+            with open(tmp_name, 'w') as tmp_file:
+                json.dump({"expires": expires, "chain": value}, tmp_file)
+            os.replace(tmp_name, file_name)
+        return RequestCache._thaw(value)
+
+    def clear(self) -> None:
+        """Remove all entries, including chains saved on disk."""
+        super().clear()
+        with self._chain_lock:
+            self._chains.clear()
+            for file_name in os.listdir(self._root_dir):
+                if file_name.endswith(".json"):
+                    os.remove(os.path.join(self._root_dir, file_name))
+
+    def stats(self) -> RequestCache.CacheStats:
+        """Hit and miss counts and the current size of the cache."""
+        stats = super().stats()
+        with self._chain_lock:
+            return stats._replace(
+                num_entries=stats.num_entries + len(self._chains),
+                num_bytes=stats.num_bytes + sum(
+                    RequestCache._size(entry[1])
+                    for entry in self._chains.values()))
+
+    @staticmethod
+    def good_until(req_type: str, chain) -> float:
+        """
+        Time, in seconds since the epoch, at which the earliest contract in
+        chain may have expired. inf if no contract in chain is understood.
+
+        :param req_type: "CFU", "CFS", "CFO" or "CEO".
+        :param chain: Response to the request, as returned by LookupConn.
+
+        """
+        if req_type in ("CFO", "CEO"):
+            symbols = list(chain.get("c", [])) + list(chain.get("p", []))
+            if req_type == "CEO":
+                expiry = parse_equity_option_symbols("", symbols)['expiry']
+                if len(expiry) == 0:
+                    return float('inf')
+                return ChainCache._local_midnight(
+                    expiry.min() + np.timedelta64(1, 'D'))
+            months = parse_futures_option_symbols(
+                "", symbols)['expiry'].astype('M8[M]')
+        else:
+            # Spread symbols have a leg for each contract.
+            months = np.array([month for symbol in chain
+                               for month in ChainCache._contract_months(
+                                   symbol)], dtype='M8[M]')
+        if len(months) == 0:
+            return float('inf')
+        return ChainCache._local_midnight(
+            (months.min() - np.timedelta64(1, 'M')).astype('M8[D]'))
+
+    def _next_refresh(self) -> float:
+        """Time of the first listing refresh after now."""
+        if len(self._refresh_weekdays) == 0:
+            return float('inf')
+        now = datetime.datetime.now()
+        refresh = datetime.datetime.combine(now.date(), self._refresh_time)
+        while (refresh <= now or
+               refresh.weekday() not in self._refresh_weekdays):
+            refresh += datetime.timedelta(days=1)
+        return refresh.timestamp()
+
+    def _load(self, key: str):
+        """(expires, chain) saved on disk for key or None."""
+        file_name = self._file_name(key)
+        if not os.path.isfile(file_name):
+            return None
+        try:
+            with open(file_name) as chain_file:
+                saved = json.load(chain_file)
+        except ValueError:
+            return None
+        return saved["expires"], saved["chain"]
+
+    def _remove_chain(self, key: str) -> None:
+        self._chains.pop(key, None)
+        file_name = self._file_name(key)
+        if os.path.isfile(file_name):
+            os.remove(file_name)
+
+    def _file_name(self, key: str) -> str:
+        return os.path.join(self._root_dir, "%s.json" % urllib.parse.quote(
+            key, safe=''))
+
+    def _is_chain(self, key: str) -> bool:
+        return (key.split(',', 1)[0] in ChainCache.chain_types and
+                self.ttl(key) > 0)
+
+    @staticmethod
+    def _contract_months(symbol: str) -> list:
+        """Contract month of each leg of a futures or spread symbol."""
+        months = []
+        for leg in symbol.split('-'):
+            match = _contract_month_re.search(leg)
+            if match is not None and match.group(1) in _futures_month:
+                months.append(np.datetime64('%d-%02d' % (
+                    2000 + int(match.group(2)),
+                    _futures_month[match.group(1)]), 'M'))
+        return months
+
+    @staticmethod
+    def _local_midnight(day: np.datetime64) -> float:
+        """Start of day in local time, in seconds since the epoch."""
+        return datetime.datetime.combine(
+            day.astype(datetime.date), datetime.time(0)).timestamp()
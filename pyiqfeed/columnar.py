@@ -0,0 +1,56 @@
+# coding=utf-8
+"""
+Work with data from a HistoryConn created with columnar=True.
+
+A columnar HistoryConn returns a dict of field name to a numpy array for
+that field instead of a numpy structured array. Code that only looks at a
+column or two, say close_p and tot_vlm, reads contiguous memory instead of
+skipping through whole records.
+
+"""
+
+from typing import Sequence
+
+import numpy as np
+
+
+def concat_columns(chunks: Sequence[dict]) -> dict:
+    """
+    Join the results of several columnar requests end to end.
+
+    :param chunks: Dicts of field name to column, all with the same fields.
+    :return: Dict of field name to the columns of each chunk concatenated.
+
+    Each output column is allocated once and each chunk is copied into it
+    once.
+
+    """
+    assert len(chunks) > 0
+    names = list(chunks[0].keys())
+    num_rows = sum(len(chunk[names[0]]) for chunk in chunks)
+    joined = {}
+    for name in names:
+        col = np.empty(num_rows, chunks[0][name].dtype)
+        row_num = 0
+        for chunk in chunks:
+            chunk_col = chunk[name]
+            col[row_num:row_num + len(chunk_col)] = chunk_col
+            row_num += len(chunk_col)
+        joined[name] = col
+    return joined
+
+
+def to_columns(data: np.array) -> dict:
+    """Split a structured array into a dict of contiguous columns."""
+    return {name: np.ascontiguousarray(data[name])
+            for name in data.dtype.names}
+
+
+def to_records(columns: dict) -> np.array:
+    """Join a dict of columns into a structured array."""
+    names = list(columns.keys())
+    data = np.empty(len(columns[names[0]]),
+                    [(name, columns[name].dtype) for name in names])
+    for name in names:
+        data[name] = columns[name]
+    return data
@@ -46,12 +46,18 @@ See http://www.iqfeed.net/dev/main.cfm for more information.
 """
 
 import os
+import concurrent.futures
+import contextlib
 import datetime
 import itertools
+import multiprocessing
+import re
 import select
 import socket
+import tempfile
 import threading
 import time
+import weakref
 
 from collections import deque, namedtuple
 from typing import Sequence, List
@@ -60,6 +66,8 @@ import xml.etree.ElementTree as ElementTree
 import numpy as np
 from .exceptions import NoDataError, UnexpectedField, UnexpectedMessage
 from .exceptions import UnexpectedProtocol, UnauthorizedError
+from .exceptions import MemoryBudgetError
+from .request_cache import RequestCache
 from . import field_readers as fr
 
 
@@ -503,6 +511,19 @@ class QuoteConn(FeedConn):
     If you don't understand the above two paragraphs, look at the code, look
     at the examples, run the examples and then read the above again.
 
+    If timestamps is True and the fieldset has both Most Recent Trade Date
+    and Most Recent Trade Time, updates also have a field called
+    Most Recent Trade Timestamp of type M8[ns] with the two combined.
+    select_update_fieldnames adds Most Recent Trade Date for you if you
+    ask for Most Recent Trade Time.
+
+    If compact is True, the fields in quote_compact_map are sent with the
+    smaller types given there, for example f4 prices, u4 sizes and the
+    trade conditions packed into one u4 as for HistoryConn.tick_compact_type.
+    A summary or update with a value that doesn't fit is dropped and
+    passed to process_error of each listener as ["E", error message,
+    fields of the message...] instead.
+
     Information like connection statistics etc and news is provided as
     more vanilla Python types.
 
@@ -712,14 +733,47 @@ class QuoteConn(FeedConn):
                      'Volatility': ('Volatility', 'f8', fr.read_float64),
                      'VWAP': ('VWAP', 'f8', fr.read_float64)}
 
+    # Fields that are sent with a smaller type when compact is True
+    quote_compact_map = {
+        'Ask': ('Ask', 'f4', fr.read_float32),
+        'Ask Size': ('Ask Size', 'u4', fr.read_uint32),
+        'Bid': ('Bid', 'f4', fr.read_float32),
+        'Bid Size': ('Bid Size', 'u4', fr.read_uint32),
+        'Change': ('Change', 'f4', fr.read_float32),
+        'Close': ('Close', 'f4', fr.read_float32),
+        'Extended Trade': ('Extended Price', 'f4', fr.read_float32),
+        'Extended Trade Size': ('Extended Trade Size', 'u4',
+                                fr.read_uint32),
+        'High': ('High', 'f4', fr.read_float32),
+        'Last': ('Last', 'f4', fr.read_float32),
+        'Last Size': ('Last Size', 'u4', fr.read_uint32),
+        'Low': ('Low', 'f4', fr.read_float32),
+        'Most Recent Trade': ('Most Recent Trade', 'f4', fr.read_float32),
+        'Most Recent Trade Conditions': ('Most Recent Trade Conditions',
+                                         'u4', fr.read_packed_conds),
+        'Most Recent Trade Size': ('Most Recent Trade Size', 'u4',
+                                   fr.read_uint32),
+        'Number of Trades Today': ('Number of Trades Today', 'u4',
+                                   fr.read_uint32),
+        'Open': ('Open', 'f4', fr.read_float32),
+        'Settle': ('Settle', 'f4', fr.read_float32),
+        'VWAP': ('VWAP', 'f4', fr.read_float32)}
+
+    # Field added to updates when timestamps is True
+    trade_ts_field = 'Most Recent Trade Timestamp'
+
     NewsMsg = namedtuple(
         "NewsMsg", (
             "story_id", "distributor", "symbol_list",
             "story_date", "story_time", "headline"))
 
     def __init__(self, name: str = "QuoteConn", host: str = FeedConn.host,
-                 port: int = port):
+                 port: int = port, timestamps: bool = False,
+                 compact: bool = False):
         super().__init__(name, host, port)
+        self._timestamps = timestamps
+        self._compact = compact
+        self._trade_ts = False
         self._current_update_fields = []
         self._update_names = []
         self._update_dtype = []
@@ -826,7 +880,9 @@ class QuoteConn(FeedConn):
         """Process a symbol summary message"""
         assert len(fields) > 2
         assert fields[0] == "P"
-        update = self._create_update(fields)
+        update = self._read_update(fields)
+        if update is None:
+            return
         for listener in self._listeners:
             listener.process_summary(update)
 
@@ -834,10 +890,24 @@ class QuoteConn(FeedConn):
         """Process a symbol update message."""
         assert len(fields) > 2
         assert fields[0] == "Q"
-        update = self._create_update(fields)
+        update = self._read_update(fields)
+        if update is None:
+            return
         for listener in self._listeners:
             listener.process_update(update)
 
+    def _read_update(self, fields: Sequence[str]) -> np.array:
+        """
+        Create an update message, or report it as an error and return None
+        if a value doesn't fit its compact type.
+
+        """
+        try:
+            return self._create_update(fields)
+        except OverflowError as err:
+            self._process_error(["E", str(err)] + list(fields))
+            return None
+
     def _create_update(self, fields: Sequence[str]) -> np.array:
         """Create an update message."""
         update = self._empty_update_msg
@@ -846,6 +916,10 @@ class QuoteConn(FeedConn):
                 break
             update[self._update_names[field_num]] = self._update_reader[
                 field_num](field)
+        if self._trade_ts:
+            update[QuoteConn.trade_ts_field] = (
+                update['Most Recent Trade Date'] +
+                update['Most Recent Trade Time'].astype('m8[us]'))
         return update
 
     def _process_fundamentals(self, fields: Sequence[str]):
@@ -1085,6 +1159,8 @@ class QuoteConn(FeedConn):
                                    field)
             new_update_fields[field_num] = field
             dtn_update_tup = QuoteConn.quote_msg_map[field]
+            if self._compact and field in QuoteConn.quote_compact_map:
+                dtn_update_tup = QuoteConn.quote_compact_map[field]
             new_update_names[field_num] = dtn_update_tup[0]
             new_update_dtypes[field_num] = (
                 dtn_update_tup[0], dtn_update_tup[1])
@@ -1094,6 +1170,11 @@ class QuoteConn(FeedConn):
         self._update_dtype = new_update_dtypes
         self._update_reader = new_update_reader
         self._num_update_fields = len(new_update_fields)
+        self._trade_ts = (self._timestamps and
+                          'Most Recent Trade Date' in new_update_names and
+                          'Most Recent Trade Time' in new_update_names)
+        if self._trade_ts:
+            self._update_dtype.append((QuoteConn.trade_ts_field, 'M8[ns]'))
 
         self._empty_update_msg = np.zeros(1, dtype=self._update_dtype)
 
@@ -1142,6 +1223,9 @@ class QuoteConn(FeedConn):
         You may want to call this before subscribing to any symbols.
 
         """
+        if (self._timestamps and "Most Recent Trade Time" in field_names and
+                "Most Recent Trade Date" not in field_names):
+            field_names.append("Most Recent Trade Date")
         symbol_field = "Symbol"
         if symbol_field not in field_names:
             field_names.insert(0, symbol_field)
@@ -1637,6 +1721,656 @@ class AdminConn(FeedConn):
         self.save_login_info(save_info)
 
 
+class _MemoryBudget:
+    """
+    Memory used by the responses a conn is reading.
+
+    Buffers allocate through a _RequestMemory from request(). Once a
+    response would take more than max_request_bytes, or all responses
+    together more than max_conn_bytes, the rest of that response goes to a
+    temporary file in spill_dir that is memory-mapped. If spill_dir is None
+    MemoryBudgetError is raised instead.
+
+    """
+
+    err_prefix = "Memory budget exceeded"
+
+    def __init__(self, max_request_bytes: int = None,
+                 max_conn_bytes: int = None, spill_dir: str = None):
+        self.max_request_bytes = max_request_bytes
+        self.max_conn_bytes = max_conn_bytes
+        self.spill_dir = spill_dir
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def request(self) -> "_RequestMemory":
+        return _RequestMemory(self)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return self._in_flight
+
+    def fits(self, request_held: int, nbytes: int) -> bool:
+        """Could a request holding request_held bytes take nbytes more."""
+        if self.max_request_bytes is not None and (
+                request_held + nbytes > self.max_request_bytes):
+            return False
+        with self._lock:
+            return self.max_conn_bytes is None or (
+                self._in_flight + nbytes <= self.max_conn_bytes)
+
+    def reserve(self, request_held: int, nbytes: int) -> bool:
+        """Take nbytes if they fit and return whether they did."""
+        if self.max_request_bytes is not None and (
+                request_held + nbytes > self.max_request_bytes):
+            return False
+        with self._lock:
+            if self.max_conn_bytes is not None and (
+                    self._in_flight + nbytes > self.max_conn_bytes):
+                return False
+            self._in_flight += nbytes
+            return True
+
+    def release(self, nbytes: int) -> None:
+        with self._lock:
+            self._in_flight -= nbytes
+
+
+def _remove_file(file_name: str) -> None:
+    try:
+        os.remove(file_name)
+    except OSError:
+        pass
+
+
+class _TempFile:
+    """
+    Temporary file that is deleted once nothing has it mapped.
+
+    Each np.memmap of the file made by map keeps this object alive until
+    the memmap's mmap has been closed, and the file is deleted when this
+    object is garbage collected. So the file is never deleted while it is
+    mapped, which Windows doesn't allow, and is never left behind.
+
+    """
+
+    def __init__(self, dir_name: str = None, suffix: str = ".npy"):
+        fd, name = tempfile.mkstemp(suffix=suffix, dir=dir_name)
+        os.close(fd)
+        # np.memmap.filename is absolute.
+        self.name = os.path.abspath(name)
+        weakref.finalize(self, _remove_file, self.name)
+
+    def map(self, dtype: np.dtype, length: int, offset: int = 0,
+            grow: bool = True) -> np.memmap:
+        """
+        Map length rows of dtype starting offset bytes into the file. If
+        grow is True the file is first resized to end after them.
+
+        """
+        if grow:
+            self.resize(offset + max(1, length) * dtype.itemsize)
+        mapped = np.memmap(self.name, dtype=dtype, mode='r+',
+                           offset=offset, shape=(length,))
+        weakref.finalize(mapped._mmap, _TempFile._unmapped, self)
+        return mapped
+
+    def resize(self, num_bytes: int) -> None:
+        with open(self.name, 'r+b') as temp_file:
+            temp_file.truncate(num_bytes)
+
+    @staticmethod
+    def _unmapped(temp_file: "_TempFile") -> None:
+        """Called once a map of temp_file has been closed."""
+        pass
+
+
+class _RequestMemory:
+    """Allocates the arrays of one response within a _MemoryBudget."""
+
+    def __init__(self, budget: _MemoryBudget):
+        self._budget = budget
+        self._held = 0
+        # _TempFile of each spill file by name.
+        self._spill_files = {}
+
+    def fits(self, dtype: np.dtype, length: int) -> bool:
+        return self._budget.fits(self._held, length * dtype.itemsize)
+
+    def alloc(self, dtype: np.dtype, length: int) -> np.array:
+        """New array in memory or in a spill file if over budget."""
+        nbytes = length * dtype.itemsize
+        if (len(self._spill_files) == 0 and
+                self._budget.reserve(self._held, nbytes)):
+            self._held += nbytes
+            return np.empty(length, dtype)
+        if self._budget.spill_dir is None:
+            raise MemoryBudgetError(
+                "%s: response would hold %d bytes with %d bytes in flight "
+                "on the conn. Limits are %s per request and %s per conn" % (
+                    _MemoryBudget.err_prefix, self._held + nbytes,
+                    self._budget.in_flight(),
+                    self._budget.max_request_bytes,
+                    self._budget.max_conn_bytes))
+        spill_file = _TempFile(self._budget.spill_dir)
+        self._spill_files[spill_file.name] = spill_file
+        return spill_file.map(dtype, length)
+
+    def grow(self, array: np.array, num_rows: int,
+             new_len: int) -> np.array:
+        """Array of new_len with the first num_rows of array in it."""
+        if isinstance(array, np.memmap):
+            array.flush()
+            return self._spill_files[array.filename].map(array.dtype,
+                                                         new_len)
+        grown = self.alloc(array.dtype, new_len)
+        grown[:num_rows] = array[:num_rows]
+        self.free(array)
+        return grown
+
+    def free(self, array: np.array) -> None:
+        if not isinstance(array, np.memmap):
+            self._budget.release(array.nbytes)
+            self._held -= array.nbytes
+
+    def release(self) -> None:
+        """
+        Give back everything once the data has been handed over. Spill
+        files are deleted once the arrays mapping them are garbage
+        collected.
+
+        """
+        self._budget.release(self._held)
+        self._held = 0
+        self._spill_files = {}
+
+
+class _RowBuffer:
+    """
+    Numpy array that the lines of a history response are decoded into.
+
+    When the maximum number of rows is known when the request is made, the
+    array is allocated once up front. Otherwise it doubles in size every
+    time it fills up. Either way, it is trimmed to the rows actually
+    received when the data is handed back.
+
+    """
+
+    init_len = 1024
+    max_prealloc_len = 1000000
+
+    def __init__(self, dtype: np.dtype, row_reader, max_rows: int = None,
+                 memory: _RequestMemory = None):
+        if memory is None:
+            memory = _MemoryBudget().request()
+        buf_len = _RowBuffer.buf_len(dtype, max_rows, memory)
+        self._memory = memory
+        self._data = memory.alloc(dtype, buf_len)
+        self._row_reader = row_reader
+        self.num_rows = 0
+
+    @staticmethod
+    def buf_len(row_type: np.dtype, max_rows: int,
+                memory: _RequestMemory) -> int:
+        """Rows to allocate up front."""
+        if max_rows is None:
+            return _RowBuffer.init_len
+        buf_len = max(1, min(max_rows, _RowBuffer.max_prealloc_len))
+        if buf_len > _RowBuffer.init_len and not memory.fits(row_type,
+                                                             buf_len):
+            # Don't spill before anything has arrived.
+            buf_len = _RowBuffer.init_len
+        return buf_len
+
+    def append(self, fields: Sequence[str]) -> None:
+        """Decode a line of data into the next row."""
+        if self.num_rows == len(self._data):
+            self._data = self._memory.grow(self._data, self.num_rows,
+                                           2 * len(self._data))
+        self._data[self.num_rows] = self._row_reader(fields)
+        self.num_rows += 1
+
+    def data(self) -> np.array:
+        """
+        The rows received so far. An np.memmap if the response went over
+        the memory budget and was spilled to disk.
+
+        """
+        if self.num_rows == len(self._data) or isinstance(self._data,
+                                                          np.memmap):
+            data = self._data[:self.num_rows]
+        else:
+            data = self._data[:self.num_rows].copy()
+        self._memory.release()
+        return data
+
+    def __del__(self):
+        self._memory.release()
+
+
+class _ColumnBuffer:
+    """
+    One numpy array per field that the lines of a history response are
+    decoded into.
+
+    Like _RowBuffer but the data is handed back as a dict of field name to
+    a contiguous array for that field.
+
+    """
+
+    def __init__(self, dtype: np.dtype, row_reader, max_rows: int = None,
+                 memory: _RequestMemory = None):
+        if memory is None:
+            memory = _MemoryBudget().request()
+        buf_len = _RowBuffer.buf_len(dtype, max_rows, memory)
+        self._memory = memory
+        self._cols = [memory.alloc(dtype[name], buf_len)
+                      for name in dtype.names]
+        self._names = dtype.names
+        self._row_reader = row_reader
+        self.num_rows = 0
+
+    def append(self, fields: Sequence[str]) -> None:
+        """Decode a line of data into the next element of each column."""
+        if self.num_rows == len(self._cols[0]):
+            for col_num, col in enumerate(self._cols):
+                self._cols[col_num] = self._memory.grow(col, self.num_rows,
+                                                        2 * len(col))
+        row_num = self.num_rows
+        for col, val in zip(self._cols, self._row_reader(fields)):
+            col[row_num] = val
+        self.num_rows += 1
+
+    def data(self) -> dict:
+        """Dict of field name to the column received so far."""
+        data = {}
+        for name, col in zip(self._names, self._cols):
+            data[name] = col[:self.num_rows]
+            if self.num_rows < len(col) and not isinstance(col, np.memmap):
+                data[name] = data[name].copy()
+        self._memory.release()
+        return data
+
+    def __del__(self):
+        self._memory.release()
+
+
+def _parse_chunk(raw: bytes, dtype: np.dtype, row_reader,
+                 file_names: Sequence[str], first_row: int) -> int:
+    """
+    Decode lines of a history response into rows first_row onwards of
+    memory-mapped files, one file of dtype or one file for each field.
+
+    """
+    lines = raw.decode('latin-1').splitlines()
+    if len(file_names) == 1:
+        rows = np.memmap(file_names[0], dtype=dtype, mode='r+',
+                         offset=first_row * dtype.itemsize,
+                         shape=(len(lines),))
+    else:
+        rows = np.empty(len(lines), dtype)
+    for row_num, line in enumerate(lines):
+        rows[row_num] = row_reader(line.split(','))
+    if len(file_names) == 1:
+        rows.flush()
+    else:
+        for name, file_name in zip(dtype.names, file_names):
+            col = np.memmap(file_name, dtype=dtype[name], mode='r+',
+                            offset=first_row * dtype[name].itemsize,
+                            shape=(len(lines),))
+            col[:] = rows[name]
+            col.flush()
+            del col
+    del rows
+    return len(lines)
+
+
+class _ParallelBuffer:
+    """
+    Hands the lines of a history response to worker processes to decode.
+
+    The reader thread passes blocks of lines as the bytes IQFeed sent, so
+    nothing is split or decoded on it. Once at least chunk_rows lines have
+    arrived they are sent to a process in pool, which decodes them straight
+    into their rows of a temporary file in temp_dir. data() waits for all
+    the chunks and hands back np.memmaps of the files, so nothing is
+    copied. A response of less than one chunk is decoded on the calling
+    thread.
+
+    """
+
+    def __init__(self, dtype: np.dtype, row_reader, pool,
+                 chunk_rows: int, columnar: bool = False,
+                 temp_dir: str = None):
+        self._dtype = dtype
+        self._row_reader = row_reader
+        self._pool = pool
+        self._chunk_rows = chunk_rows
+        self._columnar = columnar
+        self._temp_dir = temp_dir
+        self._blocks = []
+        self._block_rows = 0
+        # _TempFile of the rows or of each column, made by the first chunk.
+        self._files = None
+        self._futures = []
+        self.num_rows = 0
+
+    def append_raw(self, block: bytes) -> None:
+        """Keep one or more complete lines to be decoded later."""
+        self._blocks.append(block)
+        num_rows = block.count(b'\n')
+        self._block_rows += num_rows
+        self.num_rows += num_rows
+        if self._block_rows >= self._chunk_rows:
+            self._submit()
+
+    def _submit(self) -> None:
+        """Send the lines kept so far to a worker process."""
+        if self._files is None:
+            num_files = len(self._dtype.names) if self._columnar else 1
+            self._files = [_TempFile(self._temp_dir)
+                           for _ in range(num_files)]
+        if self._columnar:
+            itemsizes = [self._dtype[name].itemsize
+                         for name in self._dtype.names]
+        else:
+            itemsizes = [self._dtype.itemsize]
+        for temp_file, itemsize in zip(self._files, itemsizes):
+            temp_file.resize(self.num_rows * itemsize)
+        self._futures.append(self._pool.submit(
+            _parse_chunk, b''.join(self._blocks), self._dtype,
+            self._row_reader, [temp_file.name for temp_file in self._files],
+            self.num_rows - self._block_rows))
+        self._blocks = []
+        self._block_rows = 0
+
+    def data(self):
+        """The rows received so far."""
+        if self._files is None:
+            lines = b''.join(self._blocks).decode('latin-1').splitlines()
+            self._blocks = []
+            data = np.empty(len(lines), self._dtype)
+            for row_num, line in enumerate(lines):
+                data[row_num] = self._row_reader(line.split(','))
+            if self._columnar:
+                return {name: np.ascontiguousarray(data[name])
+                        for name in self._dtype.names}
+            return data
+        if self._block_rows > 0:
+            self._submit()
+        try:
+            for future in self._futures:
+                future.result()
+        except BaseException:
+            self.close()
+            raise
+        files = self._files
+        self._futures = []
+        self._files = None
+        if self._columnar:
+            return {name: temp_file.map(self._dtype[name], self.num_rows,
+                                        grow=False)
+                    for name, temp_file in zip(self._dtype.names, files)}
+        return files[0].map(self._dtype, self.num_rows, grow=False)
+
+    def close(self) -> None:
+        """Stop the workers. The files go once nothing maps them."""
+        for future in self._futures:
+            future.cancel()
+        concurrent.futures.wait(self._futures)
+        self._futures = []
+        self._files = None
+
+    def __del__(self):
+        self.close()
+
+
+class _RawBuffer:
+    """
+    Keeps the lines of a history response exactly as IQFeed sent them.
+
+    If out is None the lines are kept in memory and handed back as one
+    bytes object. Otherwise they are written to out, a file descriptor or
+    an object with a write method, as they arrive.
+
+    """
+
+    def __init__(self, out=None):
+        self._out = out
+        self._chunks = []
+        self.num_rows = 0
+        self.num_bytes = 0
+
+    def append_raw(self, block: bytes) -> None:
+        """Add one or more complete lines."""
+        if isinstance(self._out, int):
+            view = memoryview(block)
+            while len(view) > 0:
+                view = view[os.write(self._out, view):]
+        elif self._out is not None:
+            self._out.write(block)
+        else:
+            self._chunks.append(block)
+        self.num_rows += block.count(b'\n')
+        self.num_bytes += len(block)
+
+    def data(self):
+        """All the lines as bytes, or the number of bytes written to out."""
+        if self._out is not None:
+            return self.num_bytes
+        return b''.join(self._chunks)
+
+
+class _Request:
+    """Everything kept about one request until its response is read."""
+
+    __slots__ = ('buf', 'failed', 'err_msg', 'error', 'done', 'cancelled')
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.failed = False
+        self.err_msg = ""
+        # Exception raised while reading the response, re-raised by wait.
+        self.error = None
+        self.done = threading.Event()
+        self.cancelled = False
+
+    def fail(self, error: Exception) -> None:
+        """Fail now and ignore the rest of the response."""
+        self.failed = True
+        self.err_msg = str(error)
+        self.error = error
+        self.done.set()
+
+
+class _RequestTracker:
+    """
+    Requests made on a lookup socket that haven't been read back yet.
+
+    A request is forgotten as soon as its response is read, it times out or
+    it is cancelled. Anything IQFeed sends afterwards for a forgotten
+    request is thrown away, so requests that never complete don't use
+    memory forever.
+
+    An exception raised while decoding a response, say from a malformed
+    line, fails that request only. It is raised again in the thread
+    waiting for the request and the reader thread carries on.
+
+    """
+
+    def __init__(self, prefix: str):
+        self._prefix = prefix
+        self._req_num = 0
+        self._requests = {}
+        self._lock = threading.Lock()
+
+    def next_req_id(self) -> str:
+        with self._lock:
+            req_id = "%s_%.10d" % (self._prefix, self._req_num)
+            self._req_num += 1
+            return req_id
+
+    def add(self, req_id: str, buf) -> _Request:
+        """Start tracking a request whose lines are appended to buf."""
+        request = _Request(buf)
+        with self._lock:
+            self._requests[req_id] = request
+        return request
+
+    def process_datum(self, fields: Sequence[str]) -> None:
+        """Handle a line of a response. Called from the reader thread."""
+        request = self._requests.get(fields[0])
+        if request is None:
+            # Cancelled or timed out
+            return
+        try:
+            if 'E' == fields[1]:
+                # Error
+                request.failed = True
+                err_msg = "Unknown Error"
+                if len(fields) > 2:
+                    if fields[2] != "":
+                        err_msg = fields[2]
+                request.err_msg = err_msg
+            elif '!ENDMSG!' == fields[1]:
+                request.done.set()
+            elif not request.failed:
+                request.buf.append(fields)
+        except Exception as err:
+            request.fail(err)
+
+    def process_raw(self, req_id: bytes, block: bytes) -> None:
+        """
+        Handle consecutive lines of the response to req_id. The lines are
+        passed as is to the request's buffer if it takes raw lines, and
+        split into fields one by one if not.
+
+        """
+        request = self._requests.get(req_id.decode('latin-1'))
+        if request is None or request.error is not None:
+            return
+        data_end = len(block)
+        end_msg = block.find(req_id + b',!ENDMSG!,')
+        if end_msg != -1:
+            data_end = end_msg
+        err = block.find(req_id + b',E,')
+        if err != -1:
+            data_end = min(data_end, err)
+            fields = block[err:block.index(b'\n', err)].decode(
+                'latin-1').strip().split(',')
+            request.failed = True
+            request.err_msg = "Unknown Error"
+            if len(fields) > 2 and fields[2] != "":
+                request.err_msg = fields[2]
+        try:
+            if data_end > 0 and hasattr(request.buf, 'append_raw'):
+                request.buf.append_raw(block[:data_end])
+            elif data_end > 0:
+                for line in block[:data_end].decode(
+                        'latin-1').splitlines():
+                    request.buf.append(line.split(','))
+        except Exception as err:
+            request.fail(err)
+            return
+        if end_msg != -1:
+            request.done.set()
+
+    def wait(self, req_id: str, timeout: int = None) -> _Request:
+        """
+        Wait for the whole response to req_id to arrive.
+
+        Raises TimeoutError if it doesn't arrive in timeout secs,
+        concurrent.futures.CancelledError if the request is cancelled while
+        waiting and whatever was raised decoding the response if that
+        failed. In each case the request is forgotten.
+
+        """
+        request = self._requests.get(req_id)
+        if request is None or request.cancelled:
+            raise concurrent.futures.CancelledError(
+                "Request %s cancelled" % req_id)
+        if not request.done.wait(timeout=timeout):
+            self.cancel(req_id)
+            raise TimeoutError("Request %s timed out after %s secs" % (
+                req_id, timeout))
+        if request.cancelled:
+            raise concurrent.futures.CancelledError(
+                "Request %s cancelled" % req_id)
+        if request.error is not None:
+            with self._lock:
+                self._requests.pop(req_id, None)
+            raise request.error
+        return request
+
+    def pop(self, req_id: str) -> _Request:
+        """Stop tracking req_id and return what was received for it."""
+        with self._lock:
+            return self._requests.pop(req_id)
+
+    def cancel(self, req_id: str) -> bool:
+        """Forget req_id and wake up anyone waiting on it."""
+        with self._lock:
+            request = self._requests.pop(req_id, None)
+        if request is None:
+            return False
+        request.cancelled = True
+        request.done.set()
+        return True
+
+    def cancel_all(self) -> int:
+        """Cancel all live requests and return how many there were."""
+        return sum(self.cancel(req_id) for req_id in self.live_ids())
+
+    def live_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._requests)
+
+    def num_live(self) -> int:
+        with self._lock:
+            return len(self._requests)
+
+
+class _PtsPerSendTuner:
+    """
+    Moves DatapointsPerSend towards whatever gives the most rows/sec.
+
+    After each request big enough to span several batches, the rows/sec
+    achieved is compared with that of the previous such request. If it went
+    up, DatapointsPerSend keeps moving in the same direction, otherwise it
+    turns around.
+
+    """
+
+    min_pts = 10
+    max_pts = 100000
+    factor = 2
+
+    def __init__(self, pts_per_send: int):
+        self.pts_per_send = pts_per_send
+        self._growing = True
+        self._last_rate = None
+        self._lock = threading.Lock()
+
+    def record(self, pts_per_send: int, num_rows: int, secs: float) -> None:
+        """Record how long a request using pts_per_send took."""
+        if num_rows < 4 * pts_per_send or secs <= 0:
+            return
+        rate = num_rows / secs
+        with self._lock:
+            if pts_per_send != self.pts_per_send:
+                return
+            if self._last_rate is not None and rate < self._last_rate:
+                self._growing = not self._growing
+            self._last_rate = rate
+            if self._growing:
+                pts_per_send *= _PtsPerSendTuner.factor
+            else:
+                pts_per_send //= _PtsPerSendTuner.factor
+            self.pts_per_send = max(_PtsPerSendTuner.min_pts,
+                                    min(_PtsPerSendTuner.max_pts,
+                                        pts_per_send))
+
+
 class HistoryConn(FeedConn):
     """
     HistoryConn is used to get historical data from IQFeed's lookup socket.
@@ -1649,6 +2383,80 @@ class HistoryConn(FeedConn):
     aren't getting what you expect, it may be a good idea to listen for these
     messages to see if that tells you why.
 
+    If you pass a RequestCache as cache, responses are cached as described
+    in request_cache.py.
+
+    If columnar is True, the request_xxx functions return a dict of field
+    name to a numpy array for that field instead of a structured array.
+    The columns are filled in directly as the data arrives, so this is no
+    more work than getting a structured array. Use columnar.concat_columns
+    to join results.
+
+    If timestamps is True, tick and bar data are returned with dtype
+    tick_ts_type and bar_ts_type. These have one M8[ns] timestamp column
+    in place of the date and time columns.
+
+    If compact is True, tick and bar data are returned with dtype
+    tick_compact_type (47 bytes a tick instead of 73, tick_id stays u8)
+    and bar_compact_type (40 bytes a bar instead of 72). These also have a
+    single timestamp column. A value that doesn't fit in its compact type
+    makes the request raise OverflowError. f4 prices have about 7
+    significant digits.
+
+    If raw is True, the request_xxx functions return the response as one
+    bytes object exactly as IQFeed sent it, each line starting with the
+    request id and ending in CR LF. Lines are never split into fields or
+    decoded, which makes archiving raw data I/O bound rather than CPU
+    bound. Inside a "with hist_conn.raw_output(out):" block, requests made
+    by that thread write the response to out as it arrives and return the
+    number of bytes written. out is a file descriptor or an object with a
+    write method such as a file opened in binary mode. Raw responses are
+    never cached or coalesced.
+
+    max_request_bytes and max_conn_bytes limit the memory used by the data
+    of one response and of all the responses the conn is reading at once.
+    A response that would go over either limit is moved to a temporary
+    file in spill_dir and returned as an np.memmap of that file, which is
+    deleted once the array is garbage collected. If spill_dir is None the
+    request raises MemoryBudgetError instead.
+    in_flight_bytes() is the memory held by responses being read right now.
+    Raw responses and responses decoded by parse_workers aren't limited.
+
+    If parse_workers is more than 0, responses that may be longer than
+    parse_chunk_rows lines are decoded by a pool of that many worker
+    processes instead of on the reader thread. The reader thread only
+    collects the bytes IQFeed sends, so a big download doesn't hold the GIL
+    and starve other conns, and a big response is decoded on several
+    cores. The workers decode straight into a temporary file in spill_dir,
+    or the system's temporary directory if spill_dir is None, and the
+    response is returned as an np.memmap of it without being copied. Use
+    a directory on a RAM disk such as /dev/shm to keep it in memory. The
+    file is deleted once the array is garbage collected. The pool is
+    started on the first big response and shut down by disconnect.
+
+    HistoryCache and the functions in parallel.py need a HistoryConn with
+    columnar, timestamps and compact all False.
+
+    pts_per_send is the DatapointsPerSend used for requests that don't
+    specify their own. IQFeed sends data in batches of this many lines.
+    Bigger batches mean fewer round trips and usually more rows/sec for
+    big downloads. If adapt_pts_per_send is True, the conn keeps adjusting
+    the value it uses based on the rows/sec it gets.
+
+    If coalesce is True, a request made while an identical request is
+    already waiting for IQFeed is not sent again. It waits for the
+    request already in flight and gets the same array. Since the array is
+    shared, arrays returned are read-only when coalesce is True.
+
+    A request that doesn't complete in timeout seconds raises TimeoutError.
+    Another thread can cancel a request using cancel_request, in which case
+    the thread waiting for it gets a concurrent.futures.CancelledError.
+    Whatever IQFeed sends for a request after it has timed out or been
+    cancelled is thrown away. If a line of a response can't be decoded,
+    the request raises the exception decoding it raised and the rest of
+    the response is thrown away. Other requests on the conn aren't
+    affected.
+
     For more details see:
     www.iqfeed.net/dev/api/docs/HistoricalviaTCPIP.cfm
 
@@ -1686,6 +2494,35 @@ class HistoryConn(FeedConn):
                             ('tot_vlm', 'u8'), ('prd_vlm', 'u8'),
                             ('num_trds', 'u8')])
 
+    # With timestamps=True, tick and bar data have a single timestamp column
+    # instead of separate date and time columns.
+    tick_ts_type = np.dtype([('tick_id', 'u8'), ('timestamp', 'M8[ns]'),
+                             ('last', 'f8'), ('last_sz', 'u8'),
+                             ('last_type', 'S1'), ('mkt_ctr', 'u4'),
+                             ('tot_vlm', 'u8'), ('bid', 'f8'), ('ask', 'f8'),
+                             ('cond1', 'u1'), ('cond2', 'u1'), ('cond3', 'u1'),
+                             ('cond4', 'u1')])
+    bar_ts_type = np.dtype([('timestamp', 'M8[ns]'),
+                            ('open_p', 'f8'), ('high_p', 'f8'),
+                            ('low_p', 'f8'), ('close_p', 'f8'),
+                            ('tot_vlm', 'u8'), ('prd_vlm', 'u8'),
+                            ('num_trds', 'u8')])
+
+    # With compact=True, tick and bar data use these smaller types. Prices
+    # are f4 and the four trade conditions are packed into one u4, cond1 in
+    # the low byte. See unpack_conds.
+    tick_compact_type = np.dtype([('tick_id', 'u8'),
+                                  ('timestamp', 'M8[ns]'),
+                                  ('last', 'f4'), ('last_sz', 'u4'),
+                                  ('last_type', 'S1'), ('mkt_ctr', 'u2'),
+                                  ('tot_vlm', 'u8'), ('bid', 'f4'),
+                                  ('ask', 'f4'), ('conds', 'u4')])
+    bar_compact_type = np.dtype([('timestamp', 'M8[ns]'),
+                                 ('open_p', 'f4'), ('high_p', 'f4'),
+                                 ('low_p', 'f4'), ('close_p', 'f4'),
+                                 ('tot_vlm', 'u8'), ('prd_vlm', 'u4'),
+                                 ('num_trds', 'u4')])
+
     # Daily data is returned as a numpy array of this type.
     # Daily data means daily, weekly, monthly and annual data.
     daily_type = np.dtype(
@@ -1698,17 +2535,45 @@ class HistoryConn(FeedConn):
              ('open_int', 'u8')])
 
     def __init__(self, name: str = "HistoryConn", host: str = FeedConn.host,
-                 port: int = port):
+                 port: int = port, cache: RequestCache = None,
+                 coalesce: bool = False, pts_per_send: int = 100,
+                 adapt_pts_per_send: bool = False, columnar: bool = False,
+                 timestamps: bool = False, compact: bool = False,
+                 parse_workers: int = 0, parse_chunk_rows: int = 50000,
+                 raw: bool = False, max_request_bytes: int = None,
+                 max_conn_bytes: int = None, spill_dir: str = None):
         super().__init__(name, host, port)
         self._set_message_mappings()
-        self._req_num = 0
-        self._req_buf = {}
-        self._req_numlines = {}
-        self._req_event = {}
-        self._req_failed = {}
-        self._req_err = {}
-        self._req_lock = threading.RLock()
-        self._req_num_lock = threading.RLock()
+        self._cache = cache
+        self._coalesce = coalesce
+        self._columnar = columnar
+        self._timestamps = timestamps
+        self._compact = compact
+        assert pts_per_send > 0
+        self._pts_per_send = pts_per_send
+        self._pts_tuner = None
+        if adapt_pts_per_send:
+            self._pts_tuner = _PtsPerSendTuner(pts_per_send)
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self._requests = _RequestTracker("H")
+        assert parse_workers >= 0 and parse_chunk_rows > 0
+        self._parse_workers = parse_workers
+        self._parse_chunk_rows = parse_chunk_rows
+        self._parse_pool = None
+        self._parse_pool_lock = threading.Lock()
+        self._raw = raw
+        self._raw_buf = bytearray()
+        self._raw_out = threading.local()
+        self._memory = _MemoryBudget(max_request_bytes, max_conn_bytes,
+                                     spill_dir)
+
+    def disconnect(self) -> None:
+        super().disconnect()
+        with self._parse_pool_lock:
+            if self._parse_pool is not None:
+                self._parse_pool.shutdown(cancel_futures=True)
+                self._parse_pool = None
 
     def _set_message_mappings(self) -> None:
         """Set the message mappings"""
@@ -1719,108 +2584,303 @@ class HistoryConn(FeedConn):
         """The lookup socket does not accept connect messages."""
         pass
 
+    def _read_messages(self) -> bool:
+        """
+        Read raw bytes sent by IQFeed on socket if raw is True or
+        parse_workers is more than 0.
+
+        """
+        if not (self._raw or self._parse_workers > 0):
+            return super()._read_messages()
+        ready_list = select.select([self._sock], [], [self._sock], 5)
+        if ready_list[2]:
+            raise RuntimeError(
+                    "Error condition on socket connection to IQFeed: %s,"
+                    "" % self.name())
+        if ready_list[0]:
+            data_recvd = self._sock.recv(65536)
+            with self._buf_lock:
+                self._raw_buf += data_recvd
+                return True
+        return False
+
+    def _process_messages(self) -> None:
+        """
+        If raw is True or parse_workers is more than 0 pass each run of
+        lines for the same request on to the request in one go. Anything
+        else is processed as usual.
+
+        """
+        if not (self._raw or self._parse_workers > 0):
+            return super()._process_messages()
+        with self._buf_lock:
+            text_len = self._raw_buf.rfind(b'\n') + 1
+            text = bytes(self._raw_buf[:text_len])
+            del self._raw_buf[:text_len]
+        pos = 0
+        while pos < text_len:
+            if text.startswith(b'H_', pos):
+                req_id = text[pos:text.index(b',', pos)]
+                if (text.count(b'\n' + req_id + b',', pos) ==
+                        text.count(b'\n', pos) - 1):
+                    # Usually everything left is for the same request.
+                    run_end = text_len
+                else:
+                    run = re.compile(
+                        rb'(?:' + re.escape(req_id) + rb',[^\n]*\n)+')
+                    run_end = run.match(text, pos).end()
+                self._requests.process_raw(req_id, text[pos:run_end])
+                pos = run_end
+            else:
+                line_end = text.index(b'\n', pos) + 1
+                message = text[pos:line_end].decode('latin-1').strip()
+                if message != "":
+                    fields = message.split(',')
+                    self._processing_function(fields)(fields)
+                pos = line_end
+
+    @contextlib.contextmanager
+    def raw_output(self, out):
+        """
+        Context manager in which this thread's raw requests write to out.
+
+        :param out: File descriptor or object with a write method.
+
+        """
+        self._raw_out.out = out
+        try:
+            yield
+        finally:
+            self._raw_out.out = None
+
     def _process_datum(self, fields: Sequence[str]) -> None:
-        req_id = fields[0]
-        if 'E' == fields[1]:
-            # Error
-            self._req_failed[req_id] = True
-            err_msg = "Unknown Error"
-            if len(fields) > 2:
-                if fields[2] != "":
-                    err_msg = fields[2]
-            self._req_err[req_id] = err_msg
-        elif '!ENDMSG!' == fields[1]:
-            self._req_event[req_id].set()
-        else:
-            self._req_buf[req_id].append(fields)
-            self._req_numlines[req_id] += 1
+        self._requests.process_datum(fields)
 
     def _get_next_req_id(self) -> str:
-        with self._req_num_lock:
-            req_id = "H_%.10d" % self._req_num
-            self._req_num += 1
-            return req_id
+        return self._requests.next_req_id()
 
-    def _cleanup_request_data(self, req_id: str) -> None:
-        with self._req_lock:
-            del self._req_failed[req_id]
-            del self._req_err[req_id]
-            del self._req_buf[req_id]
-            del self._req_numlines[req_id]
-
-    def _setup_request_data(self, req_id: str) -> None:
+    def _setup_request_data(self, req_id: str, dtype: np.dtype, row_reader,
+                            max_pts: int = None) -> None:
         """Setup empty buffers and other variables for a request."""
-        with self._req_lock:
-            self._req_buf[req_id] = deque()
-            self._req_numlines[req_id] = 0
-            self._req_failed[req_id] = False
-            self._req_err[req_id] = ""
-            self._req_event[req_id] = threading.Event()
+        if self._raw:
+            buf = _RawBuffer(getattr(self._raw_out, 'out', None))
+        elif self._parse_workers > 0 and (
+                max_pts is None or max_pts > self._parse_chunk_rows):
+            buf = _ParallelBuffer(dtype, row_reader, self._get_parse_pool(),
+                                  self._parse_chunk_rows, self._columnar,
+                                  self._memory.spill_dir)
+        else:
+            buf_type = _ColumnBuffer if self._columnar else _RowBuffer
+            buf = buf_type(dtype, row_reader, max_pts, self._memory.request())
+        self._requests.add(req_id, buf)
+
+    def _get_parse_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        """Worker processes for parse_workers, started when first needed."""
+        with self._parse_pool_lock:
+            if self._parse_pool is None:
+                # Forking a process with a reader thread running isn't safe.
+                self._parse_pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self._parse_workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+            return self._parse_pool
 
     def _get_data_buf(self, req_id: str) -> FeedConn.databuf:
         """Get the data buffer associated with a specific request."""
-        with self._req_lock:
-            buf = FeedConn.databuf(
-                failed=self._req_failed[req_id],
-                err_msg=self._req_err[req_id],
-                num_pts=self._req_numlines[req_id],
-                raw_data=self._req_buf[req_id])
-        self._cleanup_request_data(req_id)
-        return buf
-
-    def _read_ticks(self, req_id: str) -> np.array:
-        """Get buffer for req_id and transform to a numpy array of ticks."""
+        request = self._requests.pop(req_id)
+        return FeedConn.databuf(
+            failed=request.failed, err_msg=request.err_msg,
+            num_pts=request.buf.num_rows, raw_data=request.buf)
+
+    def cancel_request(self, req_id: str) -> bool:
+        """
+        Cancel an outstanding request.
+
+        :param req_id: Request id from live_request_ids.
+        :return: False if there was no such outstanding request.
+
+        The thread waiting for the request gets a
+        concurrent.futures.CancelledError. Data still arriving from IQFeed
+        for the request is thrown away.
+
+        """
+        return self._requests.cancel(req_id)
+
+    def cancel_all_requests(self) -> int:
+        """Cancel all outstanding requests and return how many."""
+        return self._requests.cancel_all()
+
+    def live_request_ids(self) -> List[str]:
+        """Ids of requests sent to IQFeed but not yet fully read."""
+        return self._requests.live_ids()
+
+    def num_live_requests(self) -> int:
+        """Number of requests sent to IQFeed but not yet fully read."""
+        return self._requests.num_live()
+
+    def in_flight_bytes(self) -> int:
+        """Memory held by the data of responses not yet fully read."""
+        return self._memory.in_flight()
+
+    @property
+    def pts_per_send(self) -> int:
+        """DatapointsPerSend used for requests that don't specify one."""
+        if self._pts_tuner is not None:
+            return self._pts_tuner.pts_per_send
+        return self._pts_per_send
+
+    def _pts_per_batch(self, max_pts: int, pts_per_send: int) -> int:
+        """DatapointsPerSend to use for a request."""
+        if pts_per_send is None:
+            pts_per_send = self.pts_per_send
+        if max_pts is not None:
+            pts_per_send = min(pts_per_send, max_pts)
+        return pts_per_send
+
+    def _send_request(self, req_id: str, req_cmd: str, dtype: np.dtype,
+                      row_reader, max_pts: int, pts_per_send: int,
+                      timeout: int) -> np.array:
+        """Send a request and return the data or raise if it failed."""
+        # DatapointsPerSend follows the request id and doesn't change the
+        # data returned so it's not part of the key.
+        cache_key = RequestCache.request_key(
+            req_cmd, "%s,%d" % (req_id, pts_per_send))
+        if self._raw:
+            return self._request_from_iqfeed(req_id, req_cmd, None, dtype,
+                                             row_reader, max_pts,
+                                             pts_per_send, timeout)
+        if self._columnar:
+            cache_key += ",columnar"
+        if self._compact:
+            cache_key += ",compact"
+            dtype, row_reader = HistoryConn._compact_format(dtype, row_reader)
+        elif self._timestamps:
+            cache_key += ",timestamps"
+            dtype, row_reader = HistoryConn._ts_format(dtype, row_reader)
+        if self._cache is not None:
+            data = self._cache.get(cache_key)
+            if data is not None:
+                return data
+        if not self._coalesce:
+            return self._request_from_iqfeed(req_id, req_cmd, cache_key,
+                                             dtype, row_reader, max_pts,
+                                             pts_per_send, timeout)
+        with self._in_flight_lock:
+            in_flight = self._in_flight.get(cache_key)
+            is_first = in_flight is None
+            if is_first:
+                in_flight = concurrent.futures.Future()
+                self._in_flight[cache_key] = in_flight
+        if not is_first:
+            return in_flight.result(timeout=timeout)
+        try:
+            data = self._request_from_iqfeed(req_id, req_cmd, cache_key,
+                                             dtype, row_reader, max_pts,
+                                             pts_per_send, timeout)
+            HistoryConn._set_read_only(data)
+            in_flight.set_result(data)
+            return data
+        except BaseException as err:
+            in_flight.set_exception(err)
+            raise
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[cache_key]
+
+    def _request_from_iqfeed(self, req_id: str, req_cmd: str, cache_key: str,
+                             dtype: np.dtype, row_reader, max_pts: int,
+                             pts_per_send: int, timeout: int) -> np.array:
+        """Send the request to IQFeed and wait for the response."""
+        self._setup_request_data(req_id, dtype, row_reader, max_pts)
+        start = time.monotonic()
+        try:
+            self._send_cmd(req_cmd)
+        except Exception:
+            self._requests.cancel(req_id)
+            raise
+        self._requests.wait(req_id, timeout)
         res = self._get_data_buf(req_id)
         if res.failed:
-            return np.array([res.err_msg], dtype='object')
-        else:
-            data = np.empty(res.num_pts, HistoryConn.tick_type)
-            line_num = 0
-            while res.raw_data and (line_num < res.num_pts):
-                dl = res.raw_data.popleft()
-                (dt, tm) = fr.read_posix_ts_us(dl[1])
-                data[line_num]['date'] = dt
-                data[line_num]['time'] = tm
-                data[line_num]['last'] = np.float64(dl[2])
-                data[line_num]['last_sz'] = np.uint64(dl[3])
-                data[line_num]['tot_vlm'] = np.uint64(dl[4])
-                data[line_num]['bid'] = np.float64(dl[5])
-                data[line_num]['ask'] = np.float64(dl[6])
-                data[line_num]['tick_id'] = np.uint64(dl[7])
-                data[line_num]['last_type'] = dl[8]
-                data[line_num]['mkt_ctr'] = np.uint32(dl[9])
-
-                cond_str = dl[10]
-                num_cond = len(cond_str) / 2
-                if num_cond > 0:
-                    data[line_num]['cond1'] = np.uint8(int(cond_str[0:2], 16))
-                else:
-                    data[line_num]['cond1'] = 0
+            err_msg = "Request: %s, Error: %s" % (req_cmd, res.err_msg)
+            if res.err_msg == '!NO_DATA!':
+                raise NoDataError(err_msg)
+            elif res.err_msg == "Unauthorized user ID.":
+                raise UnauthorizedError(err_msg)
+            else:
+                raise RuntimeError(err_msg)
+        if self._pts_tuner is not None:
+            self._pts_tuner.record(pts_per_send, res.num_pts,
+                                   time.monotonic() - start)
+        data = res.raw_data.data()
+        if self._cache is not None and cache_key is not None:
+            data = self._cache.put(cache_key, data)
+        return data
 
-                if num_cond > 1:
-                    data[line_num]['cond2'] = np.uint8(int(cond_str[2:4], 16))
-                else:
-                    data[line_num]['cond2'] = 0
+    @staticmethod
+    def _set_read_only(data) -> None:
+        """Make a structured array or each array in a dict read-only."""
+        arrays = data.values() if isinstance(data, dict) else (data,)
+        for array in arrays:
+            array.setflags(write=False)
 
-                if num_cond > 2:
-                    data[line_num]['cond3'] = np.uint8(int(cond_str[4:6], 16))
-                else:
-                    data[line_num]['cond3'] = 0
+    @staticmethod
+    def _ts_format(dtype: np.dtype, row_reader):
+        """dtype and row reader to use instead when timestamps is True."""
+        if dtype == HistoryConn.tick_type:
+            return HistoryConn.tick_ts_type, HistoryConn._tick_ts_row
+        if dtype == HistoryConn.bar_type:
+            return HistoryConn.bar_ts_type, HistoryConn._bar_ts_row
+        return dtype, row_reader
 
-                if num_cond > 3:
-                    data[line_num]['cond4'] = np.uint8(int(cond_str[6:8], 16))
-                else:
-                    data[line_num]['cond4'] = 0
+    @staticmethod
+    def _compact_format(dtype: np.dtype, row_reader):
+        """dtype and row reader to use instead when compact is True."""
+        if dtype == HistoryConn.tick_type:
+            return HistoryConn.tick_compact_type, HistoryConn._tick_compact_row
+        if dtype == HistoryConn.bar_type:
+            return HistoryConn.bar_compact_type, HistoryConn._bar_compact_row
+        return dtype, row_reader
 
-                line_num += 1
-                if line_num >= res.num_pts:
-                    assert len(res.raw_data) == 0
-                if len(res.raw_data) == 0:
-                    assert line_num >= res.num_pts
-            return data
+    @staticmethod
+    def unpack_conds(conds: np.array) -> np.array:
+        """
+        Unpack the conds column of tick_compact_type.
+
+        :param conds: Array of packed trade conditions.
+        :return: Array of dtype u1 with an extra last axis of length 4 for
+            cond1 to cond4.
+
+        """
+        shifts = np.array([0, 8, 16, 24], dtype='u4')
+        return ((conds[..., np.newaxis] >> shifts) & 0xFF).astype('u1')
+
+    @staticmethod
+    def _read_conds(cond_str: str) -> List[int]:
+        """Read upto 4 trade conditions packed as hex pairs."""
+        conds = [0, 0, 0, 0]
+        for cond_num in range(min(len(cond_str) // 2, 4)):
+            conds[cond_num] = int(cond_str[2 * cond_num:2 * cond_num + 2], 16)
+        return conds
+
+    @staticmethod
+    def _tick_row(dl: Sequence[str]) -> tuple:
+        """Read a line of tick-data as a row of HistoryConn.tick_type."""
+        (dt, tm) = fr.read_posix_ts_us(dl[1])
+        conds = HistoryConn._read_conds(dl[10])
+        return (int(dl[7]), dt, tm, float(dl[2]), int(dl[3]), dl[8],
+                int(dl[9]), int(dl[4]), float(dl[5]), float(dl[6]),
+                conds[0], conds[1], conds[2], conds[3])
+
+    @staticmethod
+    def _tick_ts_row(dl: Sequence[str]) -> tuple:
+        """Read a line of tick-data as a row of HistoryConn.tick_ts_type."""
+        conds = HistoryConn._read_conds(dl[10])
+        return (int(dl[7]), fr.read_posix_ts_ns(dl[1]), float(dl[2]),
+                int(dl[3]), dl[8], int(dl[9]), int(dl[4]), float(dl[5]),
+                float(dl[6]), conds[0], conds[1], conds[2], conds[3])
 
     def request_ticks(self, ticker: str, max_ticks: int, ascend: bool = False,
-                      timeout: int = None) -> np.array:
+                      timeout: int = None,
+                      pts_per_send: int = None) -> np.array:
         """
         Request historical tickdata. Including upto the last second.
 
@@ -1828,6 +2888,7 @@ class HistoryConn(FeedConn):
         :param max_ticks: The most recent max_ticks trades.
         :param ascend: True means sorted oldest to latest, False opposite
         :param timeout: Wait for timeout seconds. Default None
+        :param pts_per_send: DatapointsPerSend. Default is set by the conn.
         :return: A numpy array of dtype HistoryConn.tick_type
 
         HTX,[Symbol],[MaxDatapoints],[DataDirection],[RequestID],
@@ -1835,30 +2896,19 @@ class HistoryConn(FeedConn):
 
         """
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
-        pts_per_batch = min((max_ticks, 100))
+        pts_per_batch = self._pts_per_batch(max_ticks, pts_per_send)
         req_cmd = ("HTX,%s,%d,%d,%s,%d\r\n" % (
             ticker, max_ticks, ascend, req_id, pts_per_batch))
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_ticks(req_id)
-        if data.dtype == object:
-            iqfeed_err = str(data[0])
-            err_msg = "Request: %s, Error: %s" % (req_cmd, iqfeed_err)
-            if iqfeed_err == '!NO_DATA!':
-                raise NoDataError(err_msg)
-            elif iqfeed_err == "Unauthorized user ID.":
-                raise UnauthorizedError(err_msg)
-            else:
-                raise RuntimeError(err_msg)
-        else:
-            return data
+        return self._send_request(req_id, req_cmd, HistoryConn.tick_type,
+                                  HistoryConn._tick_row, max_ticks,
+                                  pts_per_batch, timeout)
 
     def request_ticks_for_days(self, ticker: str, num_days: int,
                                bgn_flt: datetime.time = None,
                                end_flt: datetime.time = None,
                                ascend: bool = False, max_ticks: int = None,
-                               timeout: int = None) -> np.array:
+                               timeout: int = None,
+                               pts_per_send: int = None) -> np.array:
         """
         Request tickdata for a certain number of days in the past.
 
@@ -1869,6 +2919,7 @@ class HistoryConn(FeedConn):
         :param ascend: True means sorted oldest to latest, False opposite
         :param max_ticks: Only the most recent max_ticks trades. Default None
         :param timeout: Wait upto timeout seconds. Default None
+        :param pts_per_send: DatapointsPerSend. Default is set by the conn.
         :return: A numpy array of dtype HistoryConn.tick_type
 
         HTD,[Symbol],[Days],[MaxDatapoints],[BeginFilterTime],[EndFilterTime],
@@ -1876,37 +2927,24 @@ class HistoryConn(FeedConn):
 
         """
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
         bf_str = fr.time_to_hhmmss(bgn_flt)
         ef_str = fr.time_to_hhmmss(end_flt)
         mt_str = fr.blob_to_str(max_ticks)
-        pts_per_batch = 100
-        if max_ticks is not None:
-            pts_per_batch = min((max_ticks, 100))
+        pts_per_batch = self._pts_per_batch(max_ticks, pts_per_send)
         req_cmd = ("HTD,%s,%d,%s,%s,%s,%d,%s,%d\r\n" % (
             ticker, num_days, mt_str, bf_str, ef_str, ascend, req_id,
             pts_per_batch))
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_ticks(req_id)
-        if data.dtype == object:
-            iqfeed_err = str(data[0])
-            err_msg = "Request: %s, Error: %s" % (req_cmd, iqfeed_err)
-            if iqfeed_err == '!NO_DATA!':
-                raise NoDataError(err_msg)
-            elif iqfeed_err == "Unauthorized user ID.":
-                raise UnauthorizedError(err_msg)
-            else:
-                raise RuntimeError(err_msg)
-        else:
-            return data
+        return self._send_request(req_id, req_cmd, HistoryConn.tick_type,
+                                  HistoryConn._tick_row, max_ticks,
+                                  pts_per_batch, timeout)
 
     def request_ticks_in_period(self, ticker: str, bgn_prd: datetime.datetime,
                                 end_prd: datetime.datetime,
                                 bgn_flt: datetime.time = None,
                                 end_flt: datetime.time = None,
                                 ascend: bool = False, max_ticks: int = None,
-                                timeout: int = None) -> np.array:
+                                timeout: int = None,
+                                pts_per_send: int = None) -> np.array:
         """
         Request tickdata in a certain period.
 
@@ -1918,6 +2956,7 @@ class HistoryConn(FeedConn):
         :param ascend: True means sorted oldest to latest, False opposite
         :param max_ticks: Only the most recent max_ticks trades. Default None
         :param timeout: Wait upto timeout seconds. Default None
+        :param pts_per_send: DatapointsPerSend. Default is set by the conn.
         :return: A numpy array of dtype HistoryConn.tick_type
 
         HTT,[Symbol],[BeginDate BeginTime],[EndDate EndTime],[MaxDatapoints],
@@ -1926,59 +2965,48 @@ class HistoryConn(FeedConn):
 
         """
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
         bp_str = fr.datetime_to_yyyymmdd_hhmmss(bgn_prd)
         ep_str = fr.datetime_to_yyyymmdd_hhmmss(end_prd)
         bf_str = fr.time_to_hhmmss(bgn_flt)
         ef_str = fr.time_to_hhmmss(end_flt)
         mt_str = fr.blob_to_str(max_ticks)
-        pts_per_batch = 100
-        if max_ticks is not None:
-            pts_per_batch = min((max_ticks, 100))
+        pts_per_batch = self._pts_per_batch(max_ticks, pts_per_send)
         req_cmd = ("HTT,%s,%s,%s,%s,%s,%s,%d,%s,%d\r\n" % (
             ticker, bp_str, ep_str, mt_str, bf_str, ef_str, ascend, req_id,
             pts_per_batch))
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_ticks(req_id)
-        if data.dtype == object:
-            iqfeed_err = str(data[0])
-            err_msg = "Request: %s, Error: %s" % (req_cmd, iqfeed_err)
-            if iqfeed_err == '!NO_DATA!':
-                raise NoDataError(err_msg)
-            elif iqfeed_err == "Unauthorized user ID.":
-                raise UnauthorizedError(err_msg)
-            else:
-                raise RuntimeError(err_msg)
-        else:
-            return data
+        return self._send_request(req_id, req_cmd, HistoryConn.tick_type,
+                                  HistoryConn._tick_row, max_ticks,
+                                  pts_per_batch, timeout)
 
-    def _read_bars(self, req_id: str) -> np.array:
-        """Get buffer for req_id and transform to a numpy array of bars."""
-        res = self._get_data_buf(req_id)
-        if res.failed:
-            return np.array([res.err_msg], dtype='object')
-        else:
-            data = np.empty(res.num_pts, HistoryConn.bar_type)
-            line_num = 0
-            while res.raw_data and (line_num < res.num_pts):
-                dl = res.raw_data.popleft()
-                (dt, tm) = fr.read_posix_ts(dl[1])
-                data[line_num]['date'] = dt
-                data[line_num]['time'] = tm
-                data[line_num]['high_p'] = np.float64(dl[2])
-                data[line_num]['low_p'] = np.float64(dl[3])
-                data[line_num]['open_p'] = np.float64(dl[4])
-                data[line_num]['close_p'] = np.float64(dl[5])
-                data[line_num]['tot_vlm'] = np.int64(dl[6])
-                data[line_num]['prd_vlm'] = np.int64(dl[7])
-                data[line_num]['num_trds'] = np.int64(dl[8])
-                line_num += 1
-                if line_num >= res.num_pts:
-                    assert len(res.raw_data) == 0
-                if len(res.raw_data) == 0:
-                    assert line_num >= res.num_pts
-            return data
+    @staticmethod
+    def _tick_compact_row(dl: Sequence[str]) -> tuple:
+        """Read a line of tick-data as a row of tick_compact_type."""
+        return (int(dl[7]), fr.read_posix_ts_ns(dl[1]),
+                fr.read_float32(dl[2]), fr.read_uint32(dl[3]), dl[8],
+                int(dl[9]), int(dl[4]), fr.read_float32(dl[5]),
+                fr.read_float32(dl[6]), fr.read_packed_conds(dl[10]))
+
+    @staticmethod
+    def _bar_row(dl: Sequence[str]) -> tuple:
+        """Read a line of bar-data as a row of HistoryConn.bar_type."""
+        (dt, tm) = fr.read_posix_ts(dl[1])
+        return (dt, tm, float(dl[4]), float(dl[2]), float(dl[3]),
+                float(dl[5]), int(dl[6]), int(dl[7]), int(dl[8]))
+
+    @staticmethod
+    def _bar_compact_row(dl: Sequence[str]) -> tuple:
+        """Read a line of bar-data as a row of HistoryConn.bar_compact_type."""
+        return (fr.read_posix_ts_ns(dl[1]), fr.read_float32(dl[4]),
+                fr.read_float32(dl[2]), fr.read_float32(dl[3]),
+                fr.read_float32(dl[5]), int(dl[6]), fr.read_uint32(dl[7]),
+                fr.read_uint32(dl[8]))
+
+    @staticmethod
+    def _bar_ts_row(dl: Sequence[str]) -> tuple:
+        """Read a line of bar-data as a row of HistoryConn.bar_ts_type."""
+        return (fr.read_posix_ts_ns(dl[1]), float(dl[4]), float(dl[2]),
+                float(dl[3]), float(dl[5]), int(dl[6]), int(dl[7]),
+                int(dl[8]))
 
     def request_bars(self,
                      ticker: str,
@@ -1987,7 +3015,8 @@ class HistoryConn(FeedConn):
                      max_bars: int,
                      ascend: bool = False,
                      label_at_begin=False,
-                     timeout: int = None) -> np.array:
+                     timeout: int = None,
+                     pts_per_send: int = None) -> np.array:
         """
         Get max_bars number of bars of bar_data from IQFeed.
 
@@ -1998,6 +3027,7 @@ class HistoryConn(FeedConn):
         :param ascend: True means oldest to latest, False opposite.
         :param label_at_begin: Is the timestamp the beginning or end of the bar
         :param timeout: Wait no more than timeout secs. Default None
+        :param pts_per_send: DatapointsPerSend. Default is set by the conn.
         :return: A numpy array with dtype HistoryConn.bar_type
 
         If you use an interval type other than seconds, please make sure
@@ -2014,25 +3044,13 @@ class HistoryConn(FeedConn):
         """
         assert interval_type in ('s', 'v', 't')
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
-        bars_per_batch = min((100, max_bars))
+        bars_per_batch = self._pts_per_batch(max_bars, pts_per_send)
         req_cmd = ("HIX,%s,%d,%d,%d,%s,%d,%s,%d\r\n" % (
             ticker, interval_len, max_bars, ascend, req_id, bars_per_batch,
             interval_type, label_at_begin))
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_bars(req_id)
-        if data.dtype == object:
-            iqfeed_err = str(data[0])
-            err_msg = "Request: %s, Error: %s" % (req_cmd, iqfeed_err)
-            if iqfeed_err == '!NO_DATA!':
-                raise NoDataError(err_msg)
-            elif iqfeed_err == "Unauthorized user ID.":
-                raise UnauthorizedError(err_msg)
-            else:
-                raise RuntimeError(err_msg)
-        else:
-            return data
+        return self._send_request(req_id, req_cmd, HistoryConn.bar_type,
+                                  HistoryConn._bar_row, max_bars,
+                                  bars_per_batch, timeout)
 
     def request_bars_for_days(self, ticker: str,
                               interval_len: int,
@@ -2043,7 +3061,8 @@ class HistoryConn(FeedConn):
                               ascend: bool=False,
                               max_bars: int=None,
                               label_at_begin: bool=False,
-                              timeout: int=None) -> np.array:
+                              timeout: int=None,
+                              pts_per_send: int=None) -> np.array:
         """
         Get bars for the previous N days.
 
@@ -2057,6 +3076,7 @@ class HistoryConn(FeedConn):
         :param max_bars: Only the most recent max_bars bars. Default None
         :param label_at_begin: Is the timestamp the beginning of end of the bar
         :param timeout: Wait no more than timeout secs. Default None
+        :param pts_per_send: DatapointsPerSend. Default is set by the conn.
         :return: A numpy array with dtype HistoryConn.bar_type
 
         If you use an interval type other than seconds, please make sure
@@ -2074,30 +3094,16 @@ class HistoryConn(FeedConn):
         """
         assert interval_type in ('s', 'v', 't')
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
         bf_str = fr.time_to_hhmmss(bgn_flt)
         ef_str = fr.time_to_hhmmss(end_flt)
         mb_str = fr.blob_to_str(max_bars)
-        bars_per_batch = 100
-        if max_bars is not None:
-            bars_per_batch = min((100, max_bars))
+        bars_per_batch = self._pts_per_batch(max_bars, pts_per_send)
         req_cmd = "HID,%s,%d,%d,%s,%s,%s,%d,%s,%d,%s,%d\r\n" % (
             ticker, interval_len, days, mb_str, bf_str, ef_str, ascend, req_id,
             bars_per_batch, interval_type, label_at_begin)
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_bars(req_id)
-        if data.dtype == object:
-            iqfeed_err = str(data[0])
-            err_msg = "Request: %s, Error: %s" % (req_cmd, iqfeed_err)
-            if iqfeed_err == '!NO_DATA!':
-                raise NoDataError(err_msg)
-            elif iqfeed_err == "Unauthorized user ID.":
-                raise UnauthorizedError(err_msg)
-            else:
-                raise RuntimeError(err_msg)
-        else:
-            return data
+        return self._send_request(req_id, req_cmd, HistoryConn.bar_type,
+                                  HistoryConn._bar_row, max_bars,
+                                  bars_per_batch, timeout)
 
     def request_bars_in_period(self, ticker: str, interval_len: int,
                                interval_type: str, bgn_prd: datetime.datetime,
@@ -2106,7 +3112,8 @@ class HistoryConn(FeedConn):
                                end_flt: datetime.time = None,
                                ascend: bool = False, max_bars: int = None,
                                label_at_beginning: bool=False,
-                               timeout: int = None) -> np.array:
+                               timeout: int = None,
+                               pts_per_send: int = None) -> np.array:
         """
         Get bars for a specific period.
 
@@ -2121,6 +3128,7 @@ class HistoryConn(FeedConn):
         :param max_bars: Only the most recent max_bars bars. Default None.
         :param label_at_beginning: Is the timestamp the begin or end of the bar
         :param timeout: Wait no more than timeout secs. Default None
+        :param pts_per_send: DatapointsPerSend. Default is set by the conn.
         :return: A numpy array with dtype HistoryConn.bar_type
 
         If you use an interval type other than seconds, please make sure
@@ -2139,59 +3147,28 @@ class HistoryConn(FeedConn):
         """
         assert interval_type in ('s', 'v', 't')
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
         bp_str = fr.datetime_to_yyyymmdd_hhmmss(bgn_prd)
         ep_str = fr.datetime_to_yyyymmdd_hhmmss(end_prd)
         bf_str = fr.time_to_hhmmss(bgn_flt)
         ef_str = fr.time_to_hhmmss(end_flt)
         mb_str = fr.blob_to_str(max_bars)
-        bars_per_batch = 100
-        if max_bars is not None:
-            bars_per_batch = min((100, max_bars))
+        bars_per_batch = self._pts_per_batch(max_bars, pts_per_send)
         req_cmd = ("HIT,%s,%d,%s,%s,%s,%s,%s,%d,%s,%d,%s,%d\r\n" % (
             ticker, interval_len, bp_str, ep_str, mb_str, bf_str, ef_str,
             ascend, req_id, bars_per_batch, interval_type, label_at_beginning))
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_bars(req_id)
-        if data.dtype == object:
-            iqfeed_err = str(data[0])
-            err_msg = "Request: %s, Error: %s" % (req_cmd, iqfeed_err)
-            if iqfeed_err == '!NO_DATA!':
-                raise NoDataError(err_msg)
-            elif iqfeed_err == "Unauthorized user ID.":
-                raise UnauthorizedError(err_msg)
-            else:
-                raise RuntimeError(err_msg)
-        else:
-            return data
+        return self._send_request(req_id, req_cmd, HistoryConn.bar_type,
+                                  HistoryConn._bar_row, max_bars,
+                                  bars_per_batch, timeout)
 
-    def _read_daily_data(self, req_id: str) -> np.array:
-        """Get buffer for req_id and convert to a numpy array of daily data."""
-        res = self._get_data_buf(req_id)
-        if res.failed:
-            return np.array([res.err_msg], dtype='object')
-        else:
-            data = np.empty(res.num_pts, HistoryConn.daily_type)
-            line_num = 0
-            while res.raw_data and (line_num < res.num_pts):
-                dl = res.raw_data.popleft()
-                data[line_num]['date'] = np.datetime64(dl[1], 'D')
-                data[line_num]['high_p'] = np.float64(dl[2])
-                data[line_num]['low_p'] = np.float64(dl[3])
-                data[line_num]['open_p'] = np.float64(dl[4])
-                data[line_num]['close_p'] = np.float64(dl[5])
-                data[line_num]['prd_vlm'] = np.uint64(dl[6])
-                data[line_num]['open_int'] = np.uint64(dl[7])
-                line_num += 1
-                if line_num >= res.num_pts:
-                    assert len(res.raw_data) == 0
-                if len(res.raw_data) == 0:
-                    assert line_num >= res.num_pts
-            return data
+    @staticmethod
+    def _daily_row(dl: Sequence[str]) -> tuple:
+        """Read a line of daily data as a row of HistoryConn.daily_type."""
+        return (np.datetime64(dl[1], 'D'), float(dl[4]), float(dl[2]),
+                float(dl[3]), float(dl[5]), int(dl[6]), int(dl[7]))
 
     def request_daily_data(self, ticker: str, num_days: int,
-                           ascend: bool = False, timeout: int = None):
+                           ascend: bool = False, timeout: int = None,
+                           pts_per_send: int = None):
         """
         Request daily bars for the previous num_days.
 
@@ -2199,6 +3176,7 @@ class HistoryConn(FeedConn):
         :param num_days: Number of days. 1 means today only.
         :param ascend: True means oldest data first, False opposite.
         :param timeout: Wait timeout seconds. Default None
+        :param pts_per_send: DatapointsPerSend. Default is set by the conn.
         :return: A numpy array with dtype HistoryConn.daily_type
 
         HDX,[Symbol],[MaxDatapoints],[DataDirection],[RequestID],
@@ -2206,30 +3184,19 @@ class HistoryConn(FeedConn):
 
         """
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
-        pts_per_batch = min((100, num_days))
+        pts_per_batch = self._pts_per_batch(num_days, pts_per_send)
         req_cmd = ("HDX,%s,%d,%d,%s,%d\r\n" % (
             ticker, num_days, ascend, req_id, pts_per_batch))
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_daily_data(req_id)
-        if data.dtype == object:
-            iqfeed_err = str(data[0])
-            err_msg = "Request: %s, Error: %s" % (req_cmd, iqfeed_err)
-            if iqfeed_err == '!NO_DATA!':
-                raise NoDataError(err_msg)
-            elif iqfeed_err == "Unauthorized user ID.":
-                raise UnauthorizedError(err_msg)
-            else:
-                raise RuntimeError(err_msg)
-        else:
-            return data
+        return self._send_request(req_id, req_cmd, HistoryConn.daily_type,
+                                  HistoryConn._daily_row, num_days,
+                                  pts_per_batch, timeout)
 
     def request_daily_data_for_dates(self, ticker: str, bgn_dt: datetime.date,
                                      end_dt: datetime.date,
                                      ascend: bool = False, max_days: int =
                                      None,
-                                     timeout: int = None):
+                                     timeout: int = None,
+                                     pts_per_send: int = None):
         """
         Request daily bars for a specific period.
 
@@ -2239,6 +3206,7 @@ class HistoryConn(FeedConn):
         :param ascend: True means oldest data first, False opposite.
         :param max_days: Maximum number of days to get data for.
         :param timeout: Wait timeout seconds. Default None
+        :param pts_per_send: DatapointsPerSend. Default is set by the conn.
         :return: A numpy array with dtype HistoryConn.daily_type
 
         HDT,[Symbol],[BeginDate],[EndDate],[MaxDatapoints],[DataDirection],
@@ -2246,32 +3214,19 @@ class HistoryConn(FeedConn):
 
         """
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
         bgn_str = fr.date_to_yyyymmdd(bgn_dt)
         end_str = fr.date_to_yyyymmdd(end_dt)
         md_str = fr.blob_to_str(max_days)
-        pts_per_batch = 100
-        if max_days is not None:
-            pts_per_batch = min((100, max_days))
+        pts_per_batch = self._pts_per_batch(max_days, pts_per_send)
         req_cmd = ("HDT,%s,%s,%s,%s,%d,%s,%d\r\n" % (
             ticker, bgn_str, end_str, md_str, ascend, req_id, pts_per_batch))
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_daily_data(req_id)
-        if data.dtype == object:
-            iqfeed_err = str(data[0])
-            err_msg = "Request: %s, Error: %s" % (req_cmd, iqfeed_err)
-            if iqfeed_err == '!NO_DATA!':
-                raise NoDataError(err_msg)
-            elif iqfeed_err == "Unauthorized user ID.":
-                raise UnauthorizedError(err_msg)
-            else:
-                raise RuntimeError(err_msg)
-        else:
-            return data
+        return self._send_request(req_id, req_cmd, HistoryConn.daily_type,
+                                  HistoryConn._daily_row, max_days,
+                                  pts_per_batch, timeout)
 
     def request_weekly_data(self, ticker: str, num_weeks: int,
-                            ascend: bool = False, timeout: int = None):
+                            ascend: bool = False, timeout: int = None,
+                            pts_per_send: int = None):
         """
         Request weekly bars for the last num_weeks.
 
@@ -2279,6 +3234,7 @@ class HistoryConn(FeedConn):
         :param num_weeks: Number of weeks
         :param ascend: True means oldest data first, False opposite.
         :param timeout: Wait timeout seconds. Default None
+        :param pts_per_send: DatapointsPerSend. Default is set by the conn.
         :return: A numpy array with dtype HistoryConn.daily_type
 
         HWX,[Symbol],[MaxDatapoints],[DataDirection],[RequestID],
@@ -2286,27 +3242,16 @@ class HistoryConn(FeedConn):
 
         """
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
-        pts_per_batch = min((100, num_weeks))
+        pts_per_batch = self._pts_per_batch(num_weeks, pts_per_send)
         req_cmd = ("HWX,%s,%d,%d,%s,%d\r\n" % (
             ticker, num_weeks, ascend, req_id, pts_per_batch))
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_daily_data(req_id)
-        if data.dtype == object:
-            iqfeed_err = str(data[0])
-            err_msg = "Request: %s, Error: %s" % (req_cmd, iqfeed_err)
-            if iqfeed_err == '!NO_DATA!':
-                raise NoDataError(err_msg)
-            elif iqfeed_err == "Unauthorized user ID.":
-                raise UnauthorizedError(err_msg)
-            else:
-                raise RuntimeError(err_msg)
-        else:
-            return data
+        return self._send_request(req_id, req_cmd, HistoryConn.daily_type,
+                                  HistoryConn._daily_row, num_weeks,
+                                  pts_per_batch, timeout)
 
     def request_monthly_data(self, ticker: str, num_months: int,
-                             ascend: bool = False, timeout: int = None):
+                             ascend: bool = False, timeout: int = None,
+                             pts_per_send: int = None):
         """
         Request monthly bars for the last num_months.
 
@@ -2314,6 +3259,7 @@ class HistoryConn(FeedConn):
         :param num_months: Number of months.
         :param ascend: True means oldest data first, False opposite.
         :param timeout: Wait timeout seconds. Default None
+        :param pts_per_send: DatapointsPerSend. Default is set by the conn.
         :return: A numpy array with dtype HistoryConn.daily_type
 
         HMX,[Symbol],[MaxDatapoints],[DataDirection],[RequestID],
@@ -2321,24 +3267,12 @@ class HistoryConn(FeedConn):
 
         """
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
-        pts_per_batch = min((100, num_months))
+        pts_per_batch = self._pts_per_batch(num_months, pts_per_send)
         req_cmd = ("HMX,%s,%d,%d,%s,%d\r\n" % (
             ticker, num_months, ascend, req_id, pts_per_batch))
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_daily_data(req_id)
-        if data.dtype == object:
-            iqfeed_err = str(data[0])
-            err_msg = "Request: %s, Error: %s" % (req_cmd, iqfeed_err)
-            if iqfeed_err == '!NO_DATA!':
-                raise NoDataError(err_msg)
-            elif iqfeed_err == "Unauthorized user ID.":
-                raise UnauthorizedError(err_msg)
-            else:
-                raise RuntimeError(err_msg)
-        else:
-            return data
+        return self._send_request(req_id, req_cmd, HistoryConn.daily_type,
+                                  HistoryConn._daily_row, num_months,
+                                  pts_per_batch, timeout)
 
 
 class TableConn(FeedConn):
@@ -2624,16 +3558,12 @@ class LookupConn(FeedConn):
              ('name', 'S128'), ('sector', 'u8')])
 
     def __init__(self, name: str = "SymbolSearchConn",
-                 host: str = FeedConn.host, port: int = port):
+                 host: str = FeedConn.host, port: int = port,
+                 cache: RequestCache = None):
         super().__init__(name, host, port)
         self._set_message_mappings()
-        self._req_num = 0
-        self._req_buf = {}
-        self._req_numlines = {}
-        self._req_event = {}
-        self._req_failed = {}
-        self._req_err = {}
-        self._req_lock = threading.RLock()
+        self._cache = cache
+        self._requests = _RequestTracker("L")
 
     def _set_message_mappings(self) -> None:
         super()._set_message_mappings()
@@ -2644,52 +3574,65 @@ class LookupConn(FeedConn):
         pass
 
     def _process_lookup_datum(self, fields: Sequence[str]) -> None:
-        req_id = fields[0]
-        if 'E' == fields[1]:
-            # Error
-            self._req_failed[req_id] = True
-            err_msg = "Unknown Error"
-            if len(fields) > 2:
-                if fields[2] != "":
-                    err_msg = fields[2]
-            self._req_err[req_id] = err_msg
-        elif '!ENDMSG!' == fields[1]:
-            self._req_event[req_id].set()
-        else:
-            self._req_buf[req_id].append(fields)
-            self._req_numlines[req_id] += 1
+        self._requests.process_datum(fields)
 
     def _get_next_req_id(self) -> str:
-        with self._req_lock:
-            req_id = "L_%.10d" % self._req_num
-            self._req_num += 1
-            return req_id
-
-    def _cleanup_request_data(self, req_id: str) -> None:
-        with self._req_lock:
-            del self._req_failed[req_id]
-            del self._req_err[req_id]
-            del self._req_buf[req_id]
-            del self._req_numlines[req_id]
+        return self._requests.next_req_id()
 
     def _setup_request_data(self, req_id: str) -> None:
-        with self._req_lock:
-            self._req_buf[req_id] = deque()
-            self._req_numlines[req_id] = 0
-            self._req_failed[req_id] = False
-            self._req_err[req_id] = ""
-            self._req_event[req_id] = threading.Event()
+        self._requests.add(req_id, deque())
 
     def _get_data_buf(self, req_id: str) -> FeedConn.databuf:
         """Get the data buffer for a specific request."""
-        with self._req_lock:
-            buf = FeedConn.databuf(
-                    failed=self._req_failed[req_id],
-                    err_msg=self._req_err[req_id],
-                    num_pts=self._req_numlines[req_id],
-                    raw_data=self._req_buf[req_id])
-        self._cleanup_request_data(req_id)
-        return buf
+        request = self._requests.pop(req_id)
+        return FeedConn.databuf(
+            failed=request.failed, err_msg=request.err_msg,
+            num_pts=len(request.buf), raw_data=request.buf)
+
+    def cancel_request(self, req_id: str) -> bool:
+        """
+        Cancel an outstanding request.
+
+        :param req_id: Request id from live_request_ids.
+        :return: False if there was no such outstanding request.
+
+        The thread waiting for the request gets a
+        concurrent.futures.CancelledError. Data still arriving from IQFeed
+        for the request is thrown away.
+
+        """
+        return self._requests.cancel(req_id)
+
+    def cancel_all_requests(self) -> int:
+        """Cancel all outstanding requests and return how many."""
+        return self._requests.cancel_all()
+
+    def live_request_ids(self) -> List[str]:
+        """Ids of requests sent to IQFeed but not yet fully read."""
+        return self._requests.live_ids()
+
+    def num_live_requests(self) -> int:
+        """Number of requests sent to IQFeed but not yet fully read."""
+        return self._requests.num_live()
+
+    def _send_request(self, req_id: str, req_cmd: str, reader, timeout: int):
+        """Send a request and return what reader makes of the response."""
+        cache_key = RequestCache.request_key(req_cmd, req_id)
+        if self._cache is not None:
+            data = self._cache.get(cache_key)
+            if data is not None:
+                return data
+        self._setup_request_data(req_id)
+        try:
+            self._send_cmd(req_cmd)
+        except Exception:
+            self._requests.cancel(req_id)
+            raise
+        failed = self._requests.wait(req_id, timeout).failed
+        data = reader(req_id)
+        if self._cache is not None and not failed:
+            data = self._cache.put(cache_key, data)
+        return data
 
     def _read_symbols(self, req_id: str) -> np.array:
         """Get a data buffer and turn into np array of dtype asset_type."""
@@ -2737,13 +3680,10 @@ class LookupConn(FeedConn):
         assert filt_type is None or filt_type in ('e', 't')
 
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
         req_cmd = "SBF,%s,%s,%s,%s,%s\r\n" % (
             search_field, search_term, fr.blob_to_str(filt_type),
             fr.blob_to_str(filt_val), req_id)
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_symbols(req_id)
+        data = self._send_request(req_id, req_cmd, self._read_symbols, timeout)
         if data.dtype == object:
             err_msg = "Request: %s, Error: %s" % (req_cmd, str(data[0]))
             raise RuntimeError(err_msg)
@@ -2784,11 +3724,9 @@ class LookupConn(FeedConn):
 
         """
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
         req_cmd = "SBS,%d,%s\r\n" % (sic, req_id)
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_symbols_with_sect(req_id)
+        data = self._send_request(req_id, req_cmd,
+                                  self._read_symbols_with_sect, timeout)
         if data.dtype == object:
             err_msg = "Request: %s, Error: %s" % (req_cmd, str(data[0]))
             raise RuntimeError(err_msg)
@@ -2807,11 +3745,9 @@ class LookupConn(FeedConn):
 
         """
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
-        req_cmd = "SBS,%d,%s\r\n" % (naic, req_id)
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_symbols_with_sect(req_id)
+        req_cmd = "SBN,%d,%s\r\n" % (naic, req_id)
+        data = self._send_request(req_id, req_cmd,
+                                  self._read_symbols_with_sect, timeout)
         if data.dtype == object:
             err_msg = "Request: %s, Error: %s" % (req_cmd, str(data[0]))
             raise RuntimeError(err_msg)
@@ -2859,13 +3795,11 @@ class LookupConn(FeedConn):
             assert years.isdigit()
 
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
         req_cmd = "CFU,%s,%s,%s,%s,%s\r\n" % (
             symbol, fr.blob_to_str(month_codes), fr.blob_to_str(years),
             fr.blob_to_str(near_months), req_id)
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_futures_chain(req_id)
+        data = self._send_request(req_id, req_cmd,
+                                  self._read_futures_chain, timeout)
         if (len(data) == 2) and (data[0] == "!ERROR!"):
             err_msg = "Request: %s, Error: %s" % (req_cmd, str(data[1]))
             raise RuntimeError(err_msg)
@@ -2905,13 +3839,11 @@ class LookupConn(FeedConn):
             assert years.isdigit()
 
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
         req_cmd = "CFS,%s,%s,%s,%s,%s\r\n" % (
             symbol, fr.blob_to_str(month_codes), fr.blob_to_str(years),
             fr.blob_to_str(near_months), req_id)
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_futures_chain(req_id)
+        data = self._send_request(req_id, req_cmd,
+                                  self._read_futures_chain, timeout)
         if (len(data) == 2) and (data[0] == "!ERROR!"):
             err_msg = "Request: %s, Error: %s" % (req_cmd, str(data[1]))
             raise RuntimeError(err_msg)
@@ -2983,7 +3915,6 @@ class LookupConn(FeedConn):
             assert years.isdigit()
 
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
         req_cmd = "CFO,%s,%s,%s,%s,%s,%s\r\n" % (
             symbol,
             opt_type,
@@ -2991,10 +3922,8 @@ class LookupConn(FeedConn):
             fr.blob_to_str(years),
             fr.blob_to_str(near_months),
             req_id)
-
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_option_chain(req_id)
+        data = self._send_request(req_id, req_cmd,
+                                  self._read_option_chain, timeout)
         if (type(data) == list) and (data[0] == "!ERROR!"):
             iqfeed_err = str(data[1])
             err_msg = "Request: %s, Error: %s" % (req_cmd, iqfeed_err)
@@ -3064,17 +3993,21 @@ class LookupConn(FeedConn):
         if filt_type == 1:
             assert filt_val_1 < filt_val_2
         req_id = self._get_next_req_id()
-        self._setup_request_data(req_id)
         req_cmd = "CEO,%s,%s,%s,%s,%d,%d,%s,%s,%s\r\n" % (
             symbol, opt_type, fr.blob_to_str(month_codes),
             fr.blob_to_str(near_months), include_binary, filt_type,
             fr.blob_to_str(filt_val_1), fr.blob_to_str(filt_val_2), req_id)
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
-        data = self._read_option_chain(req_id)
+        data = self._send_request(req_id, req_cmd,
+                                  self._read_option_chain, timeout)
         if (type(data) == list) and (data[0] == "!ERROR!"):
-            err_msg = "Request: %s, Error: %s" % (req_cmd, str(data[1]))
-            raise RuntimeError(err_msg)
+            iqfeed_err = str(data[1])
+            err_msg = "Request: %s, Error: %s" % (req_cmd, iqfeed_err)
+            if iqfeed_err == "!NO_DATA!":
+                raise NoDataError(err_msg)
+            elif iqfeed_err == "Unauthorized user ID.":
+                raise UnauthorizedError(err_msg)
+            else:
+                raise RuntimeError(err_msg)
         else:
             return data
 
@@ -3109,6 +4042,10 @@ class BarConn(FeedConn):
     and
     www.iqfeed.net/dev/api/docs/Derivatives_StreamingIntervalBars_TCPIP.cfm
 
+    If timestamps is True, bars are sent to listeners with dtype
+    interval_data_ts_type, which has one M8[ns] timestamp column in place
+    of the date and time columns.
+
     """
     host = FeedConn.host
     port = FeedConn.deriv_port
@@ -3118,12 +4055,23 @@ class BarConn(FeedConn):
              ('open_p', 'f8'), ('high_p', 'f8'), ('low_p', 'f8'),
              ('close_p', 'f8'), ('tot_vlm', 'u8'), ('prd_vlm', 'u8'),
              ('num_trds', 'u8')])
+    interval_data_ts_type = np.dtype(
+            [('symbol', 'S64'), ('timestamp', 'M8[ns]'),
+             ('open_p', 'f8'), ('high_p', 'f8'), ('low_p', 'f8'),
+             ('close_p', 'f8'), ('tot_vlm', 'u8'), ('prd_vlm', 'u8'),
+             ('num_trds', 'u8')])
 
     def __init__(self, name: str = "BarConn", host: str = host,
-                 port: int = port):
+                 port: int = port, timestamps: bool = False):
         super().__init__(name, host, port)
         self._set_message_mappings()
-        self._empty_interval_msg = np.zeros(1, dtype=BarConn.interval_data_type)
+        self._timestamps = timestamps
+        if timestamps:
+            self._empty_interval_msg = np.zeros(
+                1, dtype=BarConn.interval_data_ts_type)
+        else:
+            self._empty_interval_msg = np.zeros(
+                1, dtype=BarConn.interval_data_type)
 
     def _set_message_mappings(self) -> None:
         super()._set_message_mappings()
@@ -3180,8 +4128,11 @@ class BarConn(FeedConn):
 
         interval_data = self._empty_interval_msg
         interval_data['symbol'] = fields[2]
-        interval_data['date'], interval_data['time'] = fr.read_posix_ts(
-                fields[3])
+        if self._timestamps:
+            interval_data['timestamp'] = fr.read_posix_ts_ns(fields[3])
+        else:
+            interval_data['date'], interval_data['time'] = fr.read_posix_ts(
+                    fields[3])
         interval_data['open_p'] = np.float64(fields[4])
         interval_data['high_p'] = np.float64(fields[5])
         interval_data['low_p'] = np.float64(fields[6])
@@ -3305,13 +4256,7 @@ class NewsConn(FeedConn):
                  port: int = port):
         super().__init__(name, host, port)
         self._set_message_mappings()
-        self._req_num = 0
-        self._req_buf = {}
-        self._req_numlines = {}
-        self._req_event = {}
-        self._req_failed = {}
-        self._req_err = {}
-        self._req_lock = threading.RLock()
+        self._requests = _RequestTracker("N")
 
     def _set_message_mappings(self) -> None:
         super()._set_message_mappings()
@@ -3322,51 +4267,53 @@ class NewsConn(FeedConn):
         pass
 
     def _process_news_datum(self, fields: Sequence[str]) -> None:
-        req_id = fields[0]
-        if 'E' == fields[1]:
-            # Error
-            self._req_failed[req_id] = True
-            err_msg = "Unknown Error"
-            if len(fields) > 2:
-                if fields[2] != "":
-                    err_msg = fields[2]
-            self._req_err[req_id] = err_msg
-        elif '!ENDMSG!' == fields[1]:
-            self._req_event[req_id].set()
-        else:
-            self._req_buf[req_id].append(fields)
-            self._req_numlines[req_id] += 1
+        self._requests.process_datum(fields)
 
     def _get_next_req_id(self) -> str:
-        with self._req_lock:
-            req_id = "N_%.10d" % self._req_num
-            self._req_num += 1
-            return req_id
-
-    def _cleanup_request_data(self, req_id: str) -> None:
-        with self._req_lock:
-            del self._req_failed[req_id]
-            del self._req_err[req_id]
-            del self._req_buf[req_id]
-            del self._req_numlines[req_id]
+        return self._requests.next_req_id()
 
     def _setup_request_data(self, req_id: str) -> None:
-        with self._req_lock:
-            self._req_buf[req_id] = deque()
-            self._req_numlines[req_id] = 0
-            self._req_failed[req_id] = False
-            self._req_err[req_id] = ""
-            self._req_event[req_id] = threading.Event()
+        self._requests.add(req_id, deque())
+
+    def _send_request_cmd(self, req_id: str, req_cmd: str) -> None:
+        """Send the command of a request, forgetting it if that fails."""
+        try:
+            self._send_cmd(req_cmd)
+        except Exception:
+            self._requests.cancel(req_id)
+            raise
 
     def _get_data_buf(self, req_id: str) -> FeedConn.databuf:
-        with self._req_lock:
-            buf = FeedConn.databuf(
-                    failed=self._req_failed[req_id],
-                    err_msg=self._req_err[req_id],
-                    num_pts=self._req_numlines[req_id],
-                    raw_data=self._req_buf[req_id])
-        self._cleanup_request_data(req_id)
-        return buf
+        request = self._requests.pop(req_id)
+        return FeedConn.databuf(
+            failed=request.failed, err_msg=request.err_msg,
+            num_pts=len(request.buf), raw_data=request.buf)
+
+    def cancel_request(self, req_id: str) -> bool:
+        """
+        Cancel an outstanding request.
+
+        :param req_id: Request id from live_request_ids.
+        :return: False if there was no such outstanding request.
+
+        The thread waiting for the request gets a
+        concurrent.futures.CancelledError. Data still arriving from IQFeed
+        for the request is thrown away.
+
+        """
+        return self._requests.cancel(req_id)
+
+    def cancel_all_requests(self) -> int:
+        """Cancel all outstanding requests and return how many."""
+        return self._requests.cancel_all()
+
+    def live_request_ids(self) -> List[str]:
+        """Ids of requests sent to IQFeed but not yet fully read."""
+        return self._requests.live_ids()
+
+    def num_live_requests(self) -> int:
+        """Number of requests sent to IQFeed but not yet fully read."""
+        return self._requests.num_live()
 
     def _get_xml_message(self, req_id: str):
         """Convert a buffer into an XML ElementTree"""
@@ -3405,8 +4352,8 @@ class NewsConn(FeedConn):
         self._setup_request_data(req_id)
 
         req_cmd = "NCG,x,%s\r\n" % req_id
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
+        self._send_request_cmd(req_id, req_cmd)
+        self._requests.wait(req_id, timeout)
         xml_data = self._get_xml_message(req_id)
         if hasattr(xml_data, 'dtype'):
             if xml_data.dtype == object:
@@ -3500,8 +4447,8 @@ class NewsConn(FeedConn):
 
         req_cmd = "NHL,%s,%s,%s,%d,%s,%s\r\n" % (
             sources_str, symbols_str, 'x', limit, date_str, req_id)
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
+        self._send_request_cmd(req_id, req_cmd)
+        self._requests.wait(req_id, timeout)
         xml_data = self._get_xml_message(req_id)
         if hasattr(xml_data, 'dtype'):
             if xml_data.dtype == object:
@@ -3543,8 +4490,8 @@ class NewsConn(FeedConn):
         self._setup_request_data(req_id)
 
         req_cmd = "NSY,%s,x,,%s\r\n" % (story_id, req_id)
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
+        self._send_request_cmd(req_id, req_cmd)
+        self._requests.wait(req_id, timeout)
         xml_data = self._get_xml_message(req_id)
         if hasattr(xml_data, 'dtype'):
             if xml_data.dtype == object:
@@ -3616,8 +4563,8 @@ class NewsConn(FeedConn):
 
         req_cmd = "NSC,%s,x,%s,%s,%s\r\n" % (
             symbols_str, sources_str, date_range_str, req_id)
-        self._send_cmd(req_cmd)
-        self._req_event[req_id].wait(timeout=timeout)
+        self._send_request_cmd(req_id, req_cmd)
+        self._requests.wait(req_id, timeout)
         xml_data = self._get_xml_message(req_id)
         if hasattr(xml_data, 'dtype'):
             if xml_data.dtype == object:
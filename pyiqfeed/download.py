@@ -0,0 +1,250 @@
+# coding=utf-8
+"""
+Download history for a list of symbols from the command line.
+
+    pyiqfeed-download --type bars --interval 60 --bgn 2023-01-01 \
+        --end 2023-06-30 --out /data/iqfeed @ES# @NQ# AAPL
+
+or python -m pyiqfeed.download with the same arguments. IQFeed must
+already be running.
+
+Work is split into units of one symbol and one weekday (one symbol for
+daily data). Saturdays and Sundays are skipped unless --weekends is
+given, say for futures whose week starts on Sunday evening. Units are
+requested in parallel over --conns HistoryConns. Each
+unit is written to its own .npy file under --out as soon as it arrives:
+
+    out/<symbol>/<data type>/<YYYY-MM-DD>.npy
+
+and, if its last day is over, recorded in out/manifest.txt. If a run is
+interrupted, running it again skips the units in the manifest. Units
+that reach today or later are not recorded, so they are downloaded again
+with whatever has arrived since. Rows/sec and MB/sec are
+reported as the download progresses.
+
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from typing import List, Tuple
+
+import numpy as np
+from .conn import HistoryConn
+from .connector import ConnConnector
+from .exceptions import NoDataError, UnauthorizedError
+from .parallel import ConnPool
+
+manifest_file = "manifest.txt"
+
+
+def _read_manifest(out_dir: str) -> set:
+    """Units already downloaded."""
+    done = set()
+    manifest_name = os.path.join(out_dir, manifest_file)
+    if os.path.isfile(manifest_name):
+        with open(manifest_name) as manifest:
+            for line in manifest:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) == 4:
+                    done.add(tuple(fields[:3]))
+    return done
+
+
+def _units(symbols: List[str], data_name: str, bgn: datetime.date,
+           end: datetime.date,
+           weekends: bool = False) -> List[Tuple[str, str, str]]:
+    """(symbol, data_name, day) for each unit of work."""
+    if data_name == "daily":
+        return [(symbol, data_name, "%s_%s" % (bgn, end))
+                for symbol in symbols]
+    days = []
+    day = bgn
+    while day <= end:
+        if weekends or day.weekday() < 5:
+            days.append(day.isoformat())
+        day += datetime.timedelta(days=1)
+    return [(symbol, data_name, day_str) for symbol in symbols
+            for day_str in days]
+
+
+def _is_final(args, day_str: str) -> bool:
+    """True if the data of a unit can't change any more."""
+    today = datetime.date.today()
+    if args.type == "daily":
+        return args.end < today
+    return datetime.date.fromisoformat(day_str) < today
+
+
+def _fetch(hist_conn: HistoryConn, args, symbol: str,
+           day_str: str) -> np.array:
+    """Request one unit of data."""
+    if args.type == "daily":
+        return hist_conn.request_daily_data_for_dates(
+            ticker=symbol, bgn_dt=args.bgn, end_dt=args.end, ascend=True,
+            timeout=args.timeout)
+    day = datetime.date.fromisoformat(day_str)
+    bgn_prd = datetime.datetime.combine(day, datetime.time(0))
+    end_prd = datetime.datetime.combine(day, datetime.time(23, 59, 59))
+    if args.type == "ticks":
+        return hist_conn.request_ticks_in_period(
+            ticker=symbol, bgn_prd=bgn_prd, end_prd=end_prd, ascend=True,
+            timeout=args.timeout)
+    return hist_conn.request_bars_in_period(
+        ticker=symbol, interval_len=args.interval,
+        interval_type=args.interval_type, bgn_prd=bgn_prd, end_prd=end_prd,
+        ascend=True, timeout=args.timeout)
+
+
+def _save(out_dir: str, symbol: str, data_name: str, day_str: str,
+          data: np.array) -> None:
+    data_dir = os.path.join(out_dir, urllib.parse.quote(symbol, safe=''),
+                            data_name)
+    os.makedirs(data_dir, exist_ok=True)
+    file_name = os.path.join(data_dir, "%s.npy" % day_str)
+    tmp_name = file_name + ".tmp"
+    with open(tmp_name, 'wb') as tmp_file:
+        np.save(tmp_file, data)
+    os.replace(tmp_name, file_name)
+
+
+def _parse_args(argv: List[str]):
+    parser = argparse.ArgumentParser(
+        description="Download history from IQFeed to .npy files.")
+    parser.add_argument('symbols', nargs='+',
+                        help="Symbols, or @file to read them from a file "
+                             "with one symbol per line")
+    parser.add_argument('--type', choices=('ticks', 'bars', 'daily'),
+                        default='bars', help="Type of data")
+    parser.add_argument('--bgn', type=datetime.date.fromisoformat,
+                        required=True, help="First day YYYY-MM-DD")
+    parser.add_argument('--end', type=datetime.date.fromisoformat,
+                        required=True, help="Last day YYYY-MM-DD")
+    parser.add_argument('--interval', type=int, default=60,
+                        help="Bar length in interval-type units")
+    parser.add_argument('--interval-type', choices=('s', 'v', 't'),
+                        default='s', dest='interval_type',
+                        help="s = secs, v = volume, t = ticks")
+    parser.add_argument('--weekends', action='store_true',
+                        help="Download Saturdays and Sundays too")
+    parser.add_argument('--out', required=True, help="Output directory")
+    parser.add_argument('--conns', type=int, default=4,
+                        help="Number of connections to IQFeed")
+    parser.add_argument('--retries', type=int, default=2,
+                        help="Retry a failed unit upto this many times")
+    parser.add_argument('--timeout', type=int, default=None,
+                        help="Seconds to wait for each request")
+    parser.add_argument('--host', default=HistoryConn.host,
+                        help="Host IQFeed is running on")
+    parser.add_argument('--port', type=int, default=HistoryConn.port,
+                        help="IQFeed's lookup port")
+    args = parser.parse_args(argv)
+    if args.bgn > args.end:
+        parser.error("--bgn %s is after --end %s" % (args.bgn, args.end))
+    if args.conns < 1:
+        parser.error("--conns must be at least 1")
+    symbols = []
+    for symbol in args.symbols:
+        if symbol.startswith('@') and os.path.isfile(symbol[1:]):
+            with open(symbol[1:]) as symbol_file:
+                symbols.extend(line.strip() for line in symbol_file
+                               if line.strip() != "")
+        else:
+            symbols.append(symbol)
+    args.symbols = symbols
+    return args
+
+
+def main(argv: List[str] = None) -> int:
+    """Run the download. Returns 0 if every unit was downloaded."""
+    args = _parse_args(argv)
+    if args.type == "ticks":
+        data_name = "ticks"
+    elif args.type == "bars":
+        data_name = "bars_%d%s" % (args.interval, args.interval_type)
+    else:
+        data_name = "daily"
+    os.makedirs(args.out, exist_ok=True)
+    done = _read_manifest(args.out)
+    units = [unit for unit in _units(args.symbols, data_name, args.bgn,
+                                     args.end, args.weekends)
+             if unit not in done]
+    print("%d units to download, %d already done" % (
+        len(units), len(done)))
+
+    manifest_lock = threading.Lock()
+    totals = {'rows': 0, 'bytes': 0, 'units': 0, 'failed': 0}
+    start = time.monotonic()
+
+    def download(pool: ConnPool, unit: Tuple[str, str, str]) -> int:
+        symbol, _, day_str = unit
+        for attempt in range(args.retries + 1):
+            try:
+                with pool.conn() as hist_conn:
+                    data = _fetch(hist_conn, args, symbol, day_str)
+                break
+            except NoDataError:
+                data = None
+                break
+            except UnauthorizedError:
+                raise
+            except (RuntimeError, OSError):
+                if attempt == args.retries:
+                    raise
+        num_rows = 0
+        if data is not None:
+            _save(args.out, symbol, data_name, day_str, data)
+            num_rows = len(data)
+        with manifest_lock:
+            if _is_final(args, day_str):
+                with open(os.path.join(args.out, manifest_file),
+                          'a') as manifest:
+                    manifest.write("%s\t%s\t%s\t%d\n" % (
+                        symbol, data_name, day_str, num_rows))
+            totals['rows'] += num_rows
+            totals['bytes'] += 0 if data is None else data.nbytes
+        return num_rows
+
+    hist_conns = [HistoryConn(name="pyiqfeed-download-%d" % conn_num,
+                              host=args.host, port=args.port)
+                  for conn_num in range(args.conns)]
+    with ConnConnector(hist_conns):
+        pool = ConnPool(hist_conns)
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(pool)) as executor:
+            futures = {executor.submit(download, pool, unit): unit
+                       for unit in units}
+            for future in concurrent.futures.as_completed(futures):
+                symbol, _, day_str = futures[future]
+                try:
+                    num_rows = future.result()
+                    totals['units'] += 1
+                except Exception as err:
+                    totals['failed'] += 1
+                    print("%s %s failed: %s" % (symbol, day_str, err),
+                          file=sys.stderr)
+                    continue
+                elapsed = max(time.monotonic() - start, 1e-9)
+                print("%s %s: %d rows. %d/%d units, %.0f rows/sec, "
+                      "%.2f MB/sec" % (
+                          symbol, day_str, num_rows,
+                          totals['units'] + totals['failed'], len(units),
+                          totals['rows'] / elapsed,
+                          totals['bytes'] / elapsed / 1e6))
+
+    elapsed = max(time.monotonic() - start, 1e-9)
+    print("Downloaded %d rows (%.1f MB) in %.1f secs: %.0f rows/sec, "
+          "%.2f MB/sec. %d units failed." % (
+              totals['rows'], totals['bytes'] / 1e6, elapsed,
+              totals['rows'] / elapsed, totals['bytes'] / elapsed / 1e6,
+              totals['failed']))
+    return 0 if totals['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -48,3 +48,8 @@ class UnexpectedProtocol(BaseException):
 
     """
     pass
+
+
+class MemoryBudgetError(MemoryError):
+    """Raised when a response would use more memory than a conn allows."""
+    pass
@@ -10,6 +10,8 @@ import datetime
 import numpy as np
 from pyiqfeed.exceptions import UnexpectedField
 
+_float32_max = float(np.finfo(np.float32).max)
+
 
 def blob_to_str(val) -> str:
     """Convert a blob to a string or a blank."""
@@ -89,6 +91,17 @@ def read_uint64(field: str) -> np.uint64:
     return np.uint64(field) if field != "" else 0
 
 
+def read_uint32(field: str) -> np.uint32:
+    """Read a uint32. Raise OverflowError if it doesn't fit."""
+    if field != "":
+        val = int(field)
+        if not 0 <= val <= 0xFFFFFFFF:
+            raise OverflowError("%s does not fit in a uint32" % field)
+        return np.uint32(val)
+    else:
+        return np.uint32(0)
+
+
 def read_float(field: str) -> float:
     """Read a float."""
     return float(field) if field != "" else float('nan')
@@ -99,6 +112,26 @@ def read_float64(field: str) -> np.float64:
     return np.float64(field) if field != "" else np.nan
 
 
+def read_float32(field: str) -> np.float32:
+    """Read a float32. Raise OverflowError if it doesn't fit."""
+    if field != "":
+        val = float(field)
+        if abs(val) > _float32_max and val not in (np.inf, -np.inf):
+            raise OverflowError("%s does not fit in a float32" % field)
+        return np.float32(val)
+    else:
+        return np.float32(np.nan)
+
+
+def read_packed_conds(field: str) -> int:
+    """Read upto 4 hex pair trade conditions, the first in the low byte."""
+    packed = 0
+    for cond_num in range(min(len(field) // 2, 4)):
+        packed |= int(field[2 * cond_num:2 * cond_num + 2], 16) << (
+            8 * cond_num)
+    return packed
+
+
 def read_split_string(split_str: str) -> Tuple[np.float64, np.datetime64]:
     """Read a field that encodes the last split date and last split factor."""
     split_fld_0, split_fld_1 = ("", "")
@@ -237,6 +270,14 @@ def read_posix_ts_us(dt_tm_str: str) -> Tuple[np.datetime64, int]:
         return np.datetime64(datetime.date(year=1, month=1, day=1), 'D'), 0
 
 
+def read_posix_ts_ns(dt_tm_str: str) -> np.datetime64:
+    """Read a POSIX-Date HH:MM:SS[.us] field as one np.datetime64('ns')."""
+    if dt_tm_str != "":
+        return np.datetime64(dt_tm_str, 'ns')
+    else:
+        return np.datetime64('NaT', 'ns')
+
+
 def read_posix_ts(dt_tm_str: str) -> Tuple[np.datetime64, int]:
     """Read a POSIX-DATE HH:MM:SS field."""
     if dt_tm_str != "":
@@ -0,0 +1,354 @@
+# coding=utf-8
+"""
+Keep tick and bar data from HistoryConn on local disk.
+
+Research jobs tend to request the same or overlapping periods of data for
+the same symbols over and over again. HistoryCache sits in front of a
+HistoryConn and remembers what it has already downloaded. When you ask it
+for a period, it only asks IQFeed for the parts of that period it does not
+already hold, merges what comes back with what is on disk and returns the
+whole period.
+
+Data is stored under root_dir in one directory per symbol and data type
+(ticks or a particular bar interval), with one .npy file per day, so the
+files can be memory-mapped. A file called held.npy in each directory lists
+the time ranges that have already been downloaded.
+
+Seconds bars can be built from finer seconds bars that are already held
+instead of being downloaded. If 60 second bars for a period are held, a
+request for 300 second bars for that period never goes to IQFeed.
+
+"""
+
+import datetime
+import os
+import re
+import threading
+import urllib.parse
+from typing import List, Tuple
+
+import numpy as np
+from .bars import resample_bars
+from .conn import HistoryConn
+from .exceptions import NoDataError
+
+
+class HistoryCache:
+    """
+    Serves request_ticks_in_period and request_bars_in_period from disk.
+
+    Use it like you would use the HistoryConn you pass into the
+    constructor. The HistoryConn must be connected when you make a request
+    that isn't already fully held on disk.
+
+    Anything on or after the start of today is never marked as held since
+    more data for today may still arrive. So requests that reach into
+    today always go to IQFeed for that part of the period.
+
+    Filters (bgn_flt, end_flt) and max_ticks/max_bars are not supported
+    since they would make it impossible to know what has been downloaded.
+
+    :param hist_conn: HistoryConn used for anything not held on disk.
+    :param root_dir: Directory the data is stored under.
+    :param resample: Build seconds bars from finer seconds bars of the
+        same symbol if those are held for the whole period.
+
+    """
+
+    held_file = "held.npy"
+
+    def __init__(self, hist_conn: HistoryConn, root_dir: str,
+                 resample: bool = True):
+        self._hist_conn = hist_conn
+        self._root_dir = root_dir
+        self._resample = resample
+        self._lock = threading.RLock()
+
+    def request_ticks_in_period(self, ticker: str,
+                                bgn_prd: datetime.datetime,
+                                end_prd: datetime.datetime,
+                                ascend: bool = False,
+                                timeout: int = None) -> np.array:
+        """
+        Request tickdata in a certain period.
+
+        :param ticker: Ticker symbol.
+        :param bgn_prd: Start of the period.
+        :param end_prd: End of the period.
+        :param ascend: True means sorted oldest to latest, False opposite
+        :param timeout: Wait upto timeout seconds for each request to IQFeed.
+        :return: A numpy array of dtype HistoryConn.tick_type
+
+        """
+        def fetch(bgn: datetime.datetime, end: datetime.datetime):
+            return self._hist_conn.request_ticks_in_period(
+                ticker=ticker, bgn_prd=bgn, end_prd=end, ascend=True,
+                timeout=timeout)
+
+        return self._request(ticker, "ticks", HistoryConn.tick_type, fetch,
+                             bgn_prd, end_prd, ascend)
+
+    def request_bars_in_period(self, ticker: str, interval_len: int,
+                               interval_type: str,
+                               bgn_prd: datetime.datetime,
+                               end_prd: datetime.datetime,
+                               ascend: bool = False,
+                               label_at_beginning: bool = False,
+                               timeout: int = None) -> np.array:
+        """
+        Get bars for a specific period.
+
+        :param ticker:  Ticker symbol
+        :param interval_len: Length of each bar interval in interval_type units
+        :param interval_type: 's' = secs, 'v' = volume, 't' = ticks
+        :param bgn_prd: Start of the period
+        :param end_prd: End of the period
+        :param ascend: True means oldest to latest, False opposite.
+        :param label_at_beginning: Is the timestamp the begin or end of the bar
+        :param timeout: Wait upto timeout seconds for each request to IQFeed.
+        :return: A numpy array with dtype HistoryConn.bar_type
+
+        """
+        assert interval_type in ('s', 'v', 't')
+
+        def fetch(bgn: datetime.datetime, end: datetime.datetime):
+            return self._hist_conn.request_bars_in_period(
+                ticker=ticker, interval_len=interval_len,
+                interval_type=interval_type, bgn_prd=bgn, end_prd=end,
+                ascend=True, label_at_beginning=label_at_beginning,
+                timeout=timeout)
+
+        if self._resample and interval_type == 's':
+            data = self._resample_held(ticker, interval_len,
+                                       label_at_beginning, bgn_prd, end_prd)
+            if data is not None:
+                return data if ascend else data[::-1]
+        data_name = HistoryCache.bar_data_name(interval_len, interval_type,
+                                               label_at_beginning)
+        return self._request(ticker, data_name, HistoryConn.bar_type, fetch,
+                             bgn_prd, end_prd, ascend)
+
+    @staticmethod
+    def bar_data_name(interval_len: int, interval_type: str,
+                      label_at_beginning: bool = False) -> str:
+        """Name under which bars of this interval are stored."""
+        data_name = "bars_%d%s" % (interval_len, interval_type)
+        if label_at_beginning:
+            data_name += "_begin"
+        return data_name
+
+    def held_ranges(self, ticker: str, data_name: str) -> np.array:
+        """
+        Time ranges of data already held on disk.
+
+        :param ticker: Ticker symbol.
+        :param data_name: "ticks" or the result of bar_data_name.
+        :return: Array of shape (n, 2) of dtype 'M8[us]'. Each row is an
+            inclusive [begin, end] range. Rows are sorted and don't overlap.
+
+        """
+        with self._lock:
+            return HistoryCache._read_held(self._data_dir(ticker, data_name))
+
+    def _request(self, ticker: str, data_name: str, dtype: np.dtype, fetch,
+                 bgn_prd: datetime.datetime, end_prd: datetime.datetime,
+                 ascend: bool) -> np.array:
+        """Fill any gaps in what's held on disk then read from disk."""
+        bgn = np.datetime64(bgn_prd, 'us')
+        end = np.datetime64(end_prd, 'us')
+        assert bgn <= end
+        data_dir = self._data_dir(ticker, data_name)
+        with self._lock:
+            held = HistoryCache._read_held(data_dir)
+            for gap_bgn, gap_end in HistoryCache._missing_ranges(
+                    held, bgn, end):
+                try:
+                    new_data = fetch(gap_bgn.astype(datetime.datetime),
+                                     gap_end.astype(datetime.datetime))
+                except NoDataError:
+                    new_data = np.empty(0, dtype)
+                HistoryCache._store(data_dir, held, new_data, gap_bgn,
+                                    gap_end)
+                held = HistoryCache._add_held(data_dir, held, gap_bgn,
+                                              gap_end)
+            data = HistoryCache._load(data_dir, dtype, bgn, end)
+        if not ascend:
+            data = data[::-1]
+        return data
+
+    def _resample_held(self, ticker: str, interval_len: int,
+                       label_at_beginning: bool,
+                       bgn_prd: datetime.datetime,
+                       end_prd: datetime.datetime) -> np.array:
+        """Build bars from the coarsest held bars that cover the period."""
+        ticker_dir = os.path.join(self._root_dir,
+                                  urllib.parse.quote(ticker, safe=''))
+        if not os.path.isdir(ticker_dir):
+            return None
+        suffix = "_begin" if label_at_beginning else ""
+        name_re = re.compile(r"bars_(\d+)s%s$" % suffix)
+        fine_lens = []
+        for data_name in os.listdir(ticker_dir):
+            match = name_re.match(data_name)
+            if match is not None:
+                fine_len = int(match.group(1))
+                if fine_len < interval_len and interval_len % fine_len == 0:
+                    fine_lens.append(fine_len)
+
+        bgn = np.datetime64(bgn_prd, 'us')
+        end = np.datetime64(end_prd, 'us')
+        interval = np.timedelta64(interval_len, 's').astype('m8[us]')
+        # Widen the period so the first and last bars are complete.
+        if label_at_beginning:
+            fine_bgn = bgn
+            fine_end = end + interval - np.timedelta64(1, 'us')
+        else:
+            fine_bgn = bgn - interval
+            fine_end = end
+        with self._lock:
+            for fine_len in sorted(fine_lens, reverse=True):
+                data_dir = self._data_dir(ticker, HistoryCache.bar_data_name(
+                    fine_len, 's', label_at_beginning))
+                held = HistoryCache._read_held(data_dir)
+                if len(HistoryCache._missing_ranges(
+                        held, fine_bgn, fine_end)) == 0:
+                    fine = HistoryCache._load(data_dir, HistoryConn.bar_type,
+                                              fine_bgn, fine_end)
+                    break
+            else:
+                return None
+        data = resample_bars(fine, interval_len, label_at_beginning)
+        ts = HistoryCache._timestamps(data)
+        return data[(ts >= bgn) & (ts <= end)]
+
+    def _data_dir(self, ticker: str, data_name: str) -> str:
+        return os.path.join(self._root_dir,
+                            urllib.parse.quote(ticker, safe=''),
+                            data_name)
+
+    @staticmethod
+    def _timestamps(data: np.array) -> np.array:
+        if 'time' in data.dtype.names:
+            return data['date'] + data['time']
+        return data['date'].astype('M8[us]')
+
+    @staticmethod
+    def _write_npy(file_name: str, data: np.array) -> None:
+        """Write a .npy so readers never see a half written file."""
+        tmp_name = file_name + ".tmp"
+        with open(tmp_name, 'wb') as tmp_file:
+            np.save(tmp_file, data)
+        os.replace(tmp_name, file_name)
+
+    @staticmethod
+    def _read_held(data_dir: str) -> np.array:
+        held_name = os.path.join(data_dir, HistoryCache.held_file)
+        if os.path.isfile(held_name):
+            return np.load(held_name)
+        return np.empty((0, 2), dtype='M8[us]')
+
+    @staticmethod
+    def _missing_ranges(held: np.array, bgn: np.datetime64,
+                        end: np.datetime64) -> List[Tuple[np.datetime64,
+                                                          np.datetime64]]:
+        """Parts of [bgn, end] not covered by any range in held."""
+        missing = []
+        cur = bgn
+        for held_bgn, held_end in held:
+            if held_end < cur:
+                continue
+            if held_bgn > end:
+                break
+            if held_bgn > cur:
+                missing.append((cur, held_bgn))
+            cur = held_end
+            if cur >= end:
+                return missing
+        missing.append((cur, end))
+        return missing
+
+    @staticmethod
+    def _is_held(held: np.array, ts: np.array) -> np.array:
+        """True for each timestamp in ts that's inside a held range."""
+        if len(held) == 0:
+            return np.zeros(len(ts), dtype=bool)
+        idx = np.searchsorted(held[:, 0], ts, side='right') - 1
+        return (idx >= 0) & (ts <= held[np.maximum(idx, 0), 1])
+
+    @staticmethod
+    def _store(data_dir: str, held: np.array, new_data: np.array,
+               gap_bgn: np.datetime64, gap_end: np.datetime64) -> None:
+        """
+        Replace the rows in [gap_bgn, gap_end] that we don't already hold
+        with new_data in the per-day files. Rows from earlier fetches that
+        weren't marked held, eg today's, are dropped rather than repeated.
+
+        """
+        new_ts = HistoryCache._timestamps(new_data)
+        new_data = new_data[~HistoryCache._is_held(held, new_ts)]
+        days = set(new_data['date'])
+        if os.path.isdir(data_dir):
+            first_day = gap_bgn.astype('M8[D]')
+            last_day = gap_end.astype('M8[D]')
+            for file_name in os.listdir(data_dir):
+                if (file_name.endswith(".npy") and
+                        file_name != HistoryCache.held_file):
+                    day = np.datetime64(file_name[:-4], 'D')
+                    if first_day <= day <= last_day:
+                        days.add(day)
+        if len(days) == 0:
+            return
+        os.makedirs(data_dir, exist_ok=True)
+        for day in sorted(days):
+            day_file = os.path.join(data_dir, "%s.npy" % day)
+            day_data = new_data[new_data['date'] == day]
+            if os.path.isfile(day_file):
+                old_data = np.load(day_file)
+                old_ts = HistoryCache._timestamps(old_data)
+                replaced = ((old_ts >= gap_bgn) & (old_ts <= gap_end) &
+                            ~HistoryCache._is_held(held, old_ts))
+                day_data = np.concatenate((old_data[~replaced], day_data))
+            order = np.argsort(HistoryCache._timestamps(day_data),
+                               kind='stable')
+            HistoryCache._write_npy(day_file, day_data[order])
+
+    @staticmethod
+    def _add_held(data_dir: str, held: np.array, bgn: np.datetime64,
+                  end: np.datetime64) -> np.array:
+        """Record that [bgn, end] is now held, up to the start of today."""
+        today = np.datetime64(datetime.date.today(), 'D').astype('M8[us]')
+        end = min(end, today - np.timedelta64(1, 'us'))
+        if end < bgn:
+            return held
+        ranges = sorted([tuple(rng) for rng in held] + [(bgn, end)])
+        merged = [ranges[0]]
+        for rng_bgn, rng_end in ranges[1:]:
+            last_bgn, last_end = merged[-1]
+            if rng_bgn <= last_end:
+                merged[-1] = (last_bgn, max(last_end, rng_end))
+            else:
+                merged.append((rng_bgn, rng_end))
+        held = np.array(merged, dtype='M8[us]').reshape(-1, 2)
+        os.makedirs(data_dir, exist_ok=True)
+        HistoryCache._write_npy(
+            os.path.join(data_dir, HistoryCache.held_file), held)
+        return held
+
+    @staticmethod
+    def _load(data_dir: str, dtype: np.dtype, bgn: np.datetime64,
+              end: np.datetime64) -> np.array:
+        """Read [bgn, end] from the per-day files, oldest first."""
+        chunks = []
+        day = bgn.astype('M8[D]')
+        while day <= end.astype('M8[D]'):
+            day_file = os.path.join(data_dir, "%s.npy" % day)
+            if os.path.isfile(day_file):
+                day_data = np.load(day_file, mmap_mode='r')
+                ts = HistoryCache._timestamps(day_data)
+                first = np.searchsorted(ts, bgn, side='left')
+                last = np.searchsorted(ts, end, side='right')
+                chunks.append(day_data[first:last])
+            day += np.timedelta64(1, 'D')
+        if len(chunks) == 0:
+            return np.empty(0, dtype)
+        return np.concatenate(chunks)
@@ -0,0 +1,298 @@
+# coding=utf-8
+"""
+Option chains as numpy arrays.
+
+LookupConn.request_equity_option_chain and request_futures_option_chain
+return {"c": [...], "p": [...]}, lists of IQFeed option symbols. OptionChain
+parses the expiry, strike and right out of all the symbols at once and
+holds them in one array sorted by expiry, right and strike, so picking out
+an expiry or a range of strikes is a searchsorted.
+
+    chain = iq.OptionChain.from_equity_chain(
+        "SPY", lookup_conn.request_equity_option_chain("SPY", near_months=3))
+    expiry = chain.expiries()[0]
+    near = chain.near_the_money(expiry, 452.10, 5)
+
+IQFeed equity option symbols are the root, a 2 digit year, a 2 digit day,
+a month letter which is A-L for calls and M-X for puts, and the strike,
+eg AAPL2117F142.5 for the Jun 17 2021 142.5 call. Options on futures are
+the root, a futures month letter, a 2 digit year, C or P and the strike,
+eg @ESZ21C4700. These only say which month the option expires in, so their
+expiry is the first day of that month. Futures option strikes are as they
+appear in the symbol, which for some contracts is the price times a power
+of 10.
+
+"""
+
+import datetime
+from typing import Sequence, Union
+
+import numpy as np
+from .conn import LookupConn
+
+# Anything np.datetime64(x, 'D') understands.
+DateLike = Union[np.datetime64, datetime.date, str]
+
+
+def _letter_table(letter_map: dict) -> np.array:
+    """Month number indexed by the byte value of each month letter."""
+    table = np.zeros(256, dtype='i8')
+    for month, letter in letter_map.items():
+        table[ord(letter)] = month
+    return table
+
+
+_call_months = _letter_table(LookupConn.call_month_letter_map)
+_put_months = _letter_table(LookupConn.put_month_letter_map)
+_futures_months = _letter_table(LookupConn.futures_month_letter_map)
+
+
+def _char_matrix(symbols: Sequence):
+    """Symbols as an S array and as an (n, width) array of bytes."""
+    raw = np.asarray(symbols, dtype='S')
+    if raw.itemsize == 0:
+        raw = raw.astype('S1')
+    return raw, raw.view('u1').reshape(len(raw), raw.itemsize)
+
+
+def _digits(chars: np.array, rows: np.array, cols: np.array) -> np.array:
+    """Value of the 2 digit number at cols and cols + 1 of each row."""
+    tens = chars[rows, cols].astype('i8') - ord('0')
+    units = chars[rows, cols + 1].astype('i8') - ord('0')
+    return np.where((tens >= 0) & (tens <= 9) & (units >= 0) & (units <= 9),
+                    tens * 10 + units, -1)
+
+
+def _strikes(chars: np.array, first: np.array, end: np.array) -> np.array:
+    """Decimal numbers in chars[row, first[row]:end[row]] for each row."""
+    cols = np.arange(chars.shape[1])
+    in_strike = (cols >= first[:, None]) & (cols < end[:, None])
+    is_dot = in_strike & (chars == ord('.'))
+    dot = np.where(is_dot.any(axis=1), np.argmax(is_dot, axis=1), end)
+    digit = chars.astype('i8') - ord('0')
+    is_digit = in_strike & (digit >= 0) & (digit <= 9)
+    has_dot = dot < end
+    num_digits = is_digit.sum(axis=1)
+    valid = (first < end) & ((num_digits + is_dot.sum(axis=1)) ==
+                             (end - first)) & (is_dot.sum(axis=1) <= 1)
+    # Small enough that the digits make an exact integer in an f8.
+    valid &= num_digits <= 15
+    # The digits are read as one integer and divided once by a power of 10
+    # so a strike like 12.35 comes out as the f8 nearest 12.35.
+    power = end[:, None] - 1 - cols - (
+        has_dot[:, None] & (cols < dot[:, None]))
+    power = np.where(is_digit & valid[:, None], power, 0)
+    digits = np.where(is_digit, digit * 10 ** power, 0).sum(axis=1)
+    decimals = np.where(has_dot, end - 1 - dot, 0)
+    strikes = digits / 10.0 ** decimals
+    return np.where(valid, strikes, np.nan)
+
+
+def _roots(chars: np.array, end: np.array, itemsize: int) -> np.array:
+    """chars[row, :end[row]] for each row as bytes."""
+    cols = np.arange(chars.shape[1])
+    kept = np.where(cols < end[:, None], chars, 0).astype('u1')
+    return np.ascontiguousarray(kept).view('S%d' % itemsize).ravel()
+
+
+class OptionChain:
+    """
+    Option contracts sorted by expiry, right and strike.
+
+    :param contracts: Array of OptionChain.contract_type in any order.
+
+    """
+
+    # symbol is the IQFeed symbol of the option. right is b'C' or b'P'.
+    contract_type = np.dtype([('underlying', 'S32'), ('root', 'S32'),
+                              ('expiry', 'M8[D]'), ('strike', 'f8'),
+                              ('right', 'S1'), ('symbol', 'S64')])
+
+    call = b'C'
+    put = b'P'
+
+    def __init__(self, contracts: np.array):
+        order = np.lexsort((contracts['strike'], contracts['right'],
+                            contracts['expiry']))
+        self._data = contracts[order]
+        self._data.flags.writeable = False
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def contracts(self) -> np.array:
+        """Every contract, as a read-only array of contract_type."""
+        return self._data
+
+    @classmethod
+    def from_equity_chain(cls, underlying: str, chain: dict):
+        """OptionChain from request_equity_option_chain's result."""
+        return cls(parse_equity_option_symbols(
+            underlying, list(chain.get("c", [])) + list(chain.get("p", []))))
+
+    @classmethod
+    def from_futures_chain(cls, underlying: str, chain: dict):
+        """OptionChain from request_futures_option_chain's result."""
+        return cls(parse_futures_option_symbols(
+            underlying, list(chain.get("c", [])) + list(chain.get("p", []))))
+
+    def expiries(self) -> np.array:
+        """Distinct expiry dates, earliest first, as M8[D]."""
+        expiry = self._data['expiry']
+        if len(expiry) == 0:
+            return expiry.copy()
+        return expiry[np.concatenate(([True], expiry[1:] != expiry[:-1]))]
+
+    def expiring_between(self, first: DateLike, last: DateLike) -> np.array:
+        """Contracts expiring on or after first and on or before last."""
+        bgn = np.searchsorted(self._data['expiry'],
+                              np.datetime64(first, 'D'), side='left')
+        end = np.searchsorted(self._data['expiry'],
+                              np.datetime64(last, 'D'), side='right')
+        return self._data[bgn:end]
+
+    def for_expiry(self, expiry: DateLike, right: bytes = None) -> np.array:
+        """
+        Contracts expiring on expiry, calls then puts, by strike.
+
+        :param expiry: Expiry date.
+        :param right: OptionChain.call or OptionChain.put for only one of
+            them. None for both.
+
+        """
+        return np.concatenate([self._data[bgn:end] for bgn, end in
+                               self._blocks(expiry, right)])
+
+    def strikes_between(self, expiry: DateLike, low: float, high: float,
+                        right: bytes = None) -> np.array:
+        """Contracts expiring on expiry with low <= strike <= high."""
+        strikes = self._data['strike']
+        slices = []
+        for bgn, end in self._blocks(expiry, right):
+            first = bgn + np.searchsorted(strikes[bgn:end], low, side='left')
+            last = bgn + np.searchsorted(strikes[bgn:end], high, side='right')
+            slices.append(self._data[first:last])
+        return np.concatenate(slices)
+
+    def near_the_money(self, expiry: DateLike, price: float,
+                       num_strikes: int, right: bytes = None) -> np.array:
+        """
+        Contracts expiring on expiry with the strikes closest to price.
+
+        :param expiry: Expiry date.
+        :param price: Price of the underlying.
+        :param num_strikes: Number of strikes wanted below price and at or
+            above price, for each of calls and puts.
+        :param right: OptionChain.call or OptionChain.put for only one of
+            them. None for both.
+
+        """
+        strikes = self._data['strike']
+        slices = []
+        for bgn, end in self._blocks(expiry, right):
+            atm = bgn + np.searchsorted(strikes[bgn:end], price, side='left')
+            slices.append(self._data[max(bgn, atm - num_strikes):
+                                     min(end, atm + num_strikes)])
+        return np.concatenate(slices)
+
+    def _blocks(self, expiry: DateLike, right: bytes) -> list:
+        """(bgn, end) of the rows for expiry, one for each right wanted."""
+        assert right in (None, OptionChain.call, OptionChain.put)
+        expiry = np.datetime64(expiry, 'D')
+        bgn = np.searchsorted(self._data['expiry'], expiry, side='left')
+        end = np.searchsorted(self._data['expiry'], expiry, side='right')
+        rights = self._data['right'][bgn:end]
+        # Calls sort before puts.
+        split = bgn + np.searchsorted(rights, OptionChain.put, side='left')
+        if right == OptionChain.call:
+            return [(bgn, split)]
+        if right == OptionChain.put:
+            return [(split, end)]
+        return [(bgn, split), (split, end)]
+
+
+def parse_equity_option_symbols(underlying: str,
+                                symbols: Sequence) -> np.array:
+    """
+    Parse IQFeed equity option symbols.
+
+    :param underlying: Underlying symbol, stored in each row.
+    :param symbols: IQFeed option symbols as str or bytes.
+    :return: Array of OptionChain.contract_type in the order of symbols.
+        Symbols that don't parse are left out.
+
+    """
+    raw, chars = _char_matrix(symbols)
+    num_syms = len(raw)
+    rows = np.arange(num_syms)
+    lens = np.char.str_len(raw)
+    is_letter = (chars >= ord('A')) & (chars <= ord('Z'))
+    # The month letter is the last letter. The root can have digits in it,
+    # eg adjusted options, so work back from it.
+    pos = chars.shape[1] - 1 - np.argmax(is_letter[:, ::-1], axis=1)
+    valid = is_letter.any(axis=1) & (pos >= 5)
+    pos = np.where(valid, pos, 4)
+    letter = chars[rows, pos]
+    month = _call_months[letter] + _put_months[letter]
+    year = _digits(chars, rows, pos - 4)
+    day = _digits(chars, rows, pos - 2)
+    strike = _strikes(chars, pos + 1, lens)
+    valid &= (month > 0) & (year >= 0) & (day >= 1)
+    valid &= ~np.isnan(strike)
+    months = ((np.where(valid, year, 0) + 30) * 12 + month - 1).astype(
+        'M8[M]')
+    # Days in the month, so Feb 31 is rejected rather than becoming Mar 3.
+    month_len = ((months + 1).astype('M8[D]') -
+                 months.astype('M8[D]')).astype('i8')
+    valid &= day <= month_len
+
+    contracts = np.empty(num_syms, OptionChain.contract_type)
+    contracts['underlying'] = underlying
+    contracts['root'] = _roots(chars, pos - 4, chars.shape[1])
+    contracts['expiry'] = (months.astype('M8[D]') +
+                           np.timedelta64(1, 'D') * (day - 1))
+    contracts['strike'] = strike
+    contracts['right'] = np.where(_call_months[letter] > 0, OptionChain.call,
+                                  OptionChain.put)
+    contracts['symbol'] = raw
+    return contracts[valid]
+
+
+def parse_futures_option_symbols(underlying: str,
+                                 symbols: Sequence) -> np.array:
+    """
+    Parse IQFeed options on futures symbols.
+
+    :param underlying: Underlying symbol, stored in each row.
+    :param symbols: IQFeed option symbols as str or bytes.
+    :return: Array of OptionChain.contract_type in the order of symbols,
+        with expiry the first day of the contract month. Symbols that don't
+        parse are left out.
+
+    """
+    raw, chars = _char_matrix(symbols)
+    num_syms = len(raw)
+    rows = np.arange(num_syms)
+    lens = np.char.str_len(raw)
+    is_letter = (chars >= ord('A')) & (chars <= ord('Z'))
+    # The last letter is C or P, after the month letter and year.
+    pos = chars.shape[1] - 1 - np.argmax(is_letter[:, ::-1], axis=1)
+    valid = is_letter.any(axis=1) & (pos >= 4)
+    pos = np.where(valid, pos, 3)
+    right = chars[rows, pos]
+    month = _futures_months[chars[rows, pos - 3]]
+    year = _digits(chars, rows, pos - 2)
+    strike = _strikes(chars, pos + 1, lens)
+    valid &= (month > 0) & (year >= 0) & ~np.isnan(strike)
+    valid &= (right == ord('C')) | (right == ord('P'))
+
+    contracts = np.empty(num_syms, OptionChain.contract_type)
+    contracts['underlying'] = underlying
+    contracts['root'] = _roots(chars, pos - 3, chars.shape[1])
+    months = (np.where(valid, year, 0) + 30) * 12 + month - 1
+    contracts['expiry'] = months.astype('M8[M]').astype('M8[D]')
+    contracts['strike'] = strike
+    contracts['right'] = right.view('S1')
+    contracts['symbol'] = raw
+    return contracts[valid]
@@ -0,0 +1,214 @@
+# coding=utf-8
+"""
+Spread requests over several connections to IQFeed.
+
+A single HistoryConn or LookupConn has one socket to IQFeed and one reader
+thread. Large downloads go faster if they are broken up and spread over
+several connections. ConnPool holds a set of connections that threads
+check out, use and return. The functions in this module use a ConnPool to
+run requests concurrently.
+
+Connect the connections yourself, say using ConnConnector:
+
+    hist_conns = [iq.HistoryConn(name="hist-%d" % i) for i in range(4)]
+    with iq.ConnConnector(hist_conns):
+        pool = iq.ConnPool(hist_conns)
+        ticks = iq.parallel.request_ticks_in_period(pool, "@ES#", bgn, end)
+
+request_option_chains puts each LookupConn in its pool more than once,
+since a LookupConn can have several requests outstanding on its socket.
+
+"""
+
+import concurrent.futures
+import contextlib
+import datetime
+import queue
+from typing import List, Sequence
+
+import numpy as np
+from .conn import FeedConn, HistoryConn, LookupConn
+from .exceptions import NoDataError, UnauthorizedError
+from .options import OptionChain
+
+
+class ConnPool:
+    """A set of connected XXXConn objects shared between threads."""
+
+    def __init__(self, conns: List[FeedConn]):
+        assert len(conns) > 0
+        self._idle = queue.Queue()
+        for conn in conns:
+            self._idle.put(conn)
+        self._num_conns = len(conns)
+
+    def __len__(self) -> int:
+        return self._num_conns
+
+    @contextlib.contextmanager
+    def conn(self):
+        """Check out a connection, waiting until one is free."""
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+
+def _session_chunks(bgn_prd: datetime.datetime, end_prd: datetime.datetime,
+                    session_start: datetime.time):
+    """Split [bgn_prd, end_prd] at session_start on each day."""
+    chunks = []
+    chunk_bgn = bgn_prd
+    boundary = datetime.datetime.combine(bgn_prd.date(), session_start)
+    while boundary <= chunk_bgn:
+        boundary += datetime.timedelta(days=1)
+    while boundary < end_prd:
+        chunks.append((chunk_bgn, boundary))
+        chunk_bgn = boundary
+        boundary += datetime.timedelta(days=1)
+    chunks.append((chunk_bgn, end_prd))
+    return chunks
+
+
+def request_ticks_in_period(pool: ConnPool, ticker: str,
+                            bgn_prd: datetime.datetime,
+                            end_prd: datetime.datetime,
+                            bgn_flt: datetime.time = None,
+                            end_flt: datetime.time = None,
+                            ascend: bool = False,
+                            session_start: datetime.time = datetime.time(0),
+                            max_retries: int = 2,
+                            timeout: int = None) -> np.array:
+    """
+    Request tickdata in a period one session at a time, in parallel.
+
+    :param pool: ConnPool of connected HistoryConns.
+    :param ticker: Ticker symbol.
+    :param bgn_prd: Start of the period.
+    :param end_prd: End of the period.
+    :param bgn_flt: Each day's data starting at bgn_flt
+    :param end_flt: Each day's data no later than end_flt
+    :param ascend: True means sorted oldest to latest, False opposite
+    :param session_start: Time of day at which the period is split.
+        Midnight splits by day. Use 18:00 for futures which trade
+        overnight to split by session.
+    :param max_retries: Retry a session that fails upto max_retries times.
+    :param timeout: Wait upto timeout seconds for each session.
+    :return: A numpy array of dtype HistoryConn.tick_type
+
+    Each session is requested separately, as many at a time as there are
+    connections in the pool. A session that fails is retried by itself
+    without throwing away the sessions that succeeded. Sessions with no
+    data are skipped.
+
+    """
+    chunks = _session_chunks(bgn_prd, end_prd, session_start)
+
+    def fetch(chunk_bgn: datetime.datetime, chunk_end: datetime.datetime,
+              is_last: bool) -> np.array:
+        for attempt in range(max_retries + 1):
+            try:
+                with pool.conn() as hist_conn:
+                    data = hist_conn.request_ticks_in_period(
+                        ticker=ticker, bgn_prd=chunk_bgn, end_prd=chunk_end,
+                        bgn_flt=bgn_flt, end_flt=end_flt, ascend=True,
+                        timeout=timeout)
+                break
+            except NoDataError:
+                return np.empty(0, HistoryConn.tick_type)
+            except UnauthorizedError:
+                raise
+            except (RuntimeError, OSError):
+                if attempt == max_retries:
+                    raise
+        if not is_last:
+            # chunk_end is the start of the next chunk so ticks at exactly
+            # that time belong to the next chunk.
+            tick_tms = data['date'] + data['time']
+            data = data[tick_tms < np.datetime64(chunk_end, 'us')]
+        return data
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(pool)) as executor:
+        futures = [executor.submit(fetch, chunk_bgn, chunk_end,
+                                   chunk_num == len(chunks) - 1)
+                   for chunk_num, (chunk_bgn, chunk_end) in enumerate(chunks)]
+        data = np.concatenate([future.result() for future in futures])
+    if not ascend:
+        data = data[::-1]
+    return data
+
+
+def request_option_chains(lookup_conns: List[LookupConn],
+                          symbols: Sequence[str], futures: bool = False,
+                          max_in_flight: int = None, max_retries: int = 0,
+                          timeout: int = None, **chain_args):
+    """
+    Request the option chains of many underlyings, yielding each as it
+    arrives.
+
+    :param lookup_conns: Connected LookupConns.
+    :param symbols: Underlying symbols.
+    :param futures: Request options on futures with CFO instead of equity
+        options with CEO.
+    :param max_in_flight: Most requests waiting on IQFeed at once, spread
+        evenly over lookup_conns. Default is 2 per connection.
+    :param max_retries: Retry a chain that fails upto max_retries times.
+    :param timeout: Wait upto timeout seconds for each chain.
+    :param chain_args: Passed on to request_equity_option_chain or
+        request_futures_option_chain, eg near_months=3.
+    :return: Generator of (symbol, chain, error) in the order the chains
+        complete. chain is an OptionChain, or None if the request failed
+        with error.
+
+    A LookupConn can have more than one request outstanding, so more than
+    one request is sent on each connection at a time. An underlying with
+    no options, one you aren't authorized for, one that times out or one
+    cancelled with cancel_request is reported with its error instead of
+    stopping the rest. NoDataError, UnauthorizedError and cancelled
+    requests aren't retried.
+
+    Stopping early, by breaking out of the loop over the generator, cancels
+    the requests that haven't been sent yet.
+
+    """
+    assert len(lookup_conns) > 0
+    if max_in_flight is None:
+        max_in_flight = 2 * len(lookup_conns)
+    assert max_in_flight > 0
+    # Each conn is in the pool once for each request it may have in flight.
+    pool = ConnPool([lookup_conns[slot % len(lookup_conns)]
+                     for slot in range(max_in_flight)])
+
+    def fetch(symbol: str) -> OptionChain:
+        for attempt in range(max_retries + 1):
+            try:
+                with pool.conn() as lookup_conn:
+                    if futures:
+                        return OptionChain.from_futures_chain(
+                            symbol, lookup_conn.request_futures_option_chain(
+                                symbol, timeout=timeout, **chain_args))
+                    return OptionChain.from_equity_chain(
+                        symbol, lookup_conn.request_equity_option_chain(
+                            symbol, timeout=timeout, **chain_args))
+            except (NoDataError, UnauthorizedError):
+                raise
+            except (RuntimeError, OSError):
+                if attempt == max_retries:
+                    raise
+
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_in_flight)
+    try:
+        futures_to_symbols = {executor.submit(fetch, symbol): symbol
+                              for symbol in symbols}
+        for future in concurrent.futures.as_completed(futures_to_symbols):
+            symbol = futures_to_symbols[future]
+            try:
+                yield symbol, future.result(), None
+            except (NoDataError, UnauthorizedError, RuntimeError, OSError,
+                    concurrent.futures.CancelledError) as err:
+                yield symbol, None, err
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,156 @@
+# coding=utf-8
+"""
+In-process cache of responses to HistoryConn and LookupConn requests.
+
+Services that make the same request (say request_daily_data for the same
+symbol or request_futures_chain for the same root) many times a minute can
+pass a RequestCache to the constructor of HistoryConn or LookupConn. Until
+the entry expires, a repeated request is answered from the cache instead of
+going to IQFeed.
+
+Entries are keyed by the request command sent to IQFeed with the request id
+removed. How long an entry lives depends on the request type, the first
+field of the command (HDX, HTX, CFU, SBF etc). The cache is bounded by the
+number of bytes held and evicts the least recently used entries first.
+
+numpy arrays, and dicts of numpy arrays like those returned by a columnar
+HistoryConn, are stored and returned read-only so one user of the cache
+cannot change the data another user gets. Other results (lists of symbols
+etc) are copied on the way in and out.
+
+"""
+
+import copy
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+
+class RequestCache:
+    """
+    LRU cache of responses with a time to live per request type.
+
+    :param max_bytes: Evict entries when more than max_bytes are held.
+    :param default_ttl: Seconds an entry lives if its type isn't in ttls.
+    :param ttls: Dict of request type (eg "HDX") to seconds an entry of
+        that type lives. A ttl of 0 means requests of that type are not
+        cached.
+
+    """
+
+    CacheStats = namedtuple(
+        "CacheStats", ("hits", "misses", "num_entries", "num_bytes"))
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024,
+                 default_ttl: float = 60, ttls: dict = None):
+        self._max_bytes = max_bytes
+        self._default_ttl = default_ttl
+        self._ttls = dict(ttls) if ttls is not None else {}
+        self._entries = OrderedDict()
+        self._num_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def request_key(req_cmd: str, req_id: str) -> str:
+        """The request command without the request id."""
+        return req_cmd.replace(req_id, "").strip()
+
+    def ttl(self, key: str) -> float:
+        """Seconds an entry with this key lives."""
+        return self._ttls.get(key.split(',', 1)[0], self._default_ttl)
+
+    def get(self, key: str):
+        """Return the cached response for key or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return RequestCache._thaw(entry[2])
+
+    def put(self, key: str, value):
+        """
+        Cache value under key.
+
+        Returns what the caller should hand back to its user in place of
+        value, ie a read-only array or a copy of value.
+
+        """
+        ttl = self.ttl(key)
+        value = RequestCache._freeze(value)
+        if ttl <= 0:
+            return RequestCache._thaw(value)
+        num_bytes = RequestCache._size(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if num_bytes <= self._max_bytes:
+                self._entries[key] = (time.monotonic() + ttl, num_bytes,
+                                      value)
+                self._num_bytes += num_bytes
+                while self._num_bytes > self._max_bytes:
+                    self._remove(next(iter(self._entries)))
+        return RequestCache._thaw(value)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._num_bytes = 0
+
+    def stats(self) -> CacheStats:
+        """Hit and miss counts and the current size of the cache."""
+        with self._lock:
+            return RequestCache.CacheStats(
+                hits=self._hits, misses=self._misses,
+                num_entries=len(self._entries), num_bytes=self._num_bytes)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._num_bytes -= entry[1]
+
+    @staticmethod
+    def _is_columns(value) -> bool:
+        return isinstance(value, dict) and len(value) > 0 and all(
+            isinstance(item, np.ndarray) for item in value.values())
+
+    @staticmethod
+    def _freeze(value):
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+            return value
+        if RequestCache._is_columns(value):
+            for item in value.values():
+                item.setflags(write=False)
+            return dict(value)
+        return copy.deepcopy(value)
+
+    @staticmethod
+    def _thaw(value):
+        if isinstance(value, np.ndarray):
+            return value
+        if RequestCache._is_columns(value):
+            return dict(value)
+        return copy.deepcopy(value)
+
+    @staticmethod
+    def _size(value) -> int:
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, dict):
+            return sys.getsizeof(value) + sum(
+                RequestCache._size(item) for item in value.values())
+        if isinstance(value, (list, tuple)):
+            return sys.getsizeof(value) + sum(
+                RequestCache._size(item) for item in value)
+        return sys.getsizeof(value)
@@ -0,0 +1,176 @@
+# coding=utf-8
+"""
+Decide which request goes to IQFeed next when threads share a connection.
+
+When latency sensitive lookups and bulk backfills share a HistoryConn or a
+LookupConn, requests are sent first come first served, so one big backfill
+can hold up a lookup a trader is waiting for. A RequestScheduler makes
+every request wait its turn by priority instead. It also caps the number
+of requests outstanding at IQFeed at any time and can pace requests with a
+token bucket so bursts don't hit IQFeed's limits.
+
+    scheduler = iq.RequestScheduler(max_outstanding=4, rate=20)
+    trader_hist = scheduler.wrap(hist_conn, iq.RequestScheduler.INTERACTIVE)
+    backfill_hist = scheduler.wrap(hist_conn, iq.RequestScheduler.BULK)
+
+trader_hist and backfill_hist have all the request_xxx methods of
+hist_conn. Time spent waiting for a turn and time spent waiting on IQFeed
+are recorded per priority and available from stats(). Call shutdown()
+before disconnecting the conns so no more requests are sent.
+
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import namedtuple
+
+
+class RequestScheduler:
+    """
+    Runs requests in priority order with a cap on how many are outstanding.
+
+    :param max_outstanding: Most requests running at the same time.
+    :param rate: Most requests started per second. Default no limit.
+    :param burst: Requests that can be started at once after a quiet spell.
+
+    Lower numbers are higher priority. Requests with the same priority run
+    in the order they were made.
+
+    """
+
+    INTERACTIVE = 0
+    NORMAL = 1
+    BULK = 2
+
+    PriorityStats = namedtuple(
+        "PriorityStats", ("num_requests", "total_wait", "max_wait",
+                          "total_service", "max_service"))
+
+    def __init__(self, max_outstanding: int = 8, rate: float = None,
+                 burst: int = 1):
+        assert max_outstanding > 0
+        assert rate is None or rate > 0
+        assert burst > 0
+        self._max_outstanding = max_outstanding
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._waiting = []
+        self._order = itertools.count()
+        self._num_outstanding = 0
+        self._is_shut_down = False
+        self._cond = threading.Condition()
+        self._stats = {}
+
+    def call(self, priority: int, func, *args, **kwargs):
+        """Wait for a turn, then return func(*args, **kwargs)."""
+        queued_at = time.monotonic()
+        self._acquire(priority)
+        started_at = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            finished_at = time.monotonic()
+            self._release(priority, started_at - queued_at,
+                          finished_at - started_at)
+
+    def wrap(self, conn, priority: int):
+        """Return conn with its request_xxx methods run by this scheduler."""
+        return _ScheduledConn(self, conn, priority)
+
+    def stats(self) -> dict:
+        """Dict of priority to PriorityStats for that priority."""
+        with self._cond:
+            return dict(self._stats)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop starting requests.
+
+        :param wait: Return only once the requests already running are done.
+
+        Requests waiting for a turn and any made after this raise
+        RuntimeError. Requests already running are left to finish.
+
+        """
+        with self._cond:
+            self._is_shut_down = True
+            self._cond.notify_all()
+            while wait and self._num_outstanding > 0:
+                self._cond.wait()
+
+    def num_waiting(self) -> int:
+        """Number of requests waiting for a turn."""
+        with self._cond:
+            return len(self._waiting)
+
+    def _acquire(self, priority: int) -> None:
+        with self._cond:
+            entry = (priority, next(self._order))
+            heapq.heappush(self._waiting, entry)
+            while True:
+                if self._is_shut_down:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    raise RuntimeError("RequestScheduler is shut down")
+                if (self._waiting[0] == entry and
+                        self._num_outstanding < self._max_outstanding):
+                    wait_secs = self._take_token()
+                    if wait_secs == 0:
+                        break
+                    self._cond.wait(wait_secs)
+                else:
+                    self._cond.wait()
+            heapq.heappop(self._waiting)
+            self._num_outstanding += 1
+            self._cond.notify_all()
+
+    def _release(self, priority: int, wait_secs: float,
+                 service_secs: float) -> None:
+        with self._cond:
+            self._num_outstanding -= 1
+            prev = self._stats.get(priority, RequestScheduler.PriorityStats(
+                0, 0.0, 0.0, 0.0, 0.0))
+            self._stats[priority] = RequestScheduler.PriorityStats(
+                num_requests=prev.num_requests + 1,
+                total_wait=prev.total_wait + wait_secs,
+                max_wait=max(prev.max_wait, wait_secs),
+                total_service=prev.total_service + service_secs,
+                max_service=max(prev.max_service, service_secs))
+            self._cond.notify_all()
+
+    def _take_token(self) -> float:
+        """Take a token and return 0 or return secs until there is one."""
+        if self._rate is None:
+            return 0
+        now = time.monotonic()
+        refill = (now - self._last_refill) * self._rate
+        self._tokens = min(float(self._burst), self._tokens + refill)
+        self._last_refill = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self._rate
+
+
+class _ScheduledConn:
+    """A conn whose request_xxx methods go through a RequestScheduler."""
+
+    def __init__(self, scheduler: RequestScheduler, conn, priority: int):
+        self._scheduler = scheduler
+        self._conn = conn
+        self._priority = priority
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._conn, name)
+        if not name.startswith("request_") or not callable(attr):
+            return attr
+
+        def scheduled(*args, **kwargs):
+            return self._scheduler.call(self._priority, attr, *args, **kwargs)
+
+        return scheduled
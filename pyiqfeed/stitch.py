@@ -0,0 +1,256 @@
+# coding=utf-8
+"""
+Join backfilled ticks from HistoryConn with live trades from QuoteConn.
+
+At startup you typically watch a symbol on a QuoteConn and backfill it
+with HistoryConn.request_ticks_for_days. Trades arrive on the QuoteConn
+while the backfill is running and some of them are also in the backfill.
+TickStitcher holds on to live trades for a symbol until its backfill
+arrives, then hands out one stream of ticks per symbol with no gaps or
+duplicates, using the tick id of each trade to line the two up.
+
+    stitcher = iq.TickStitcher("stitcher", on_ticks=handle_ticks)
+    quote_conn.add_listener(stitcher)
+    quote_conn.select_update_fieldnames([... "TickID" ...])
+    for symbol in symbols:
+        stitcher.start_backfill(symbol)
+        quote_conn.trades_watch(symbol)
+    for symbol in symbols:
+        stitcher.add_backfill(
+            symbol, hist_conn.request_ticks_for_days(symbol, 1, ascend=True))
+
+The QuoteConn fieldset must include TickID and Most Recent Trade, Size,
+Time, Market Center and Conditions, Total Volume, Bid and Ask. If it
+includes Most Recent Trade Date that is used as the date of each trade,
+otherwise today's date is used. Live trades are returned with dtype
+HistoryConn.tick_type, the same as the backfill.
+
+"""
+
+import datetime
+import threading
+
+import numpy as np
+from .conn import HistoryConn
+from .listeners import SilentQuoteListener
+
+
+class _TickBuffer:
+    """The latest max_len ticks, oldest first."""
+
+    def __init__(self, max_len: int):
+        self._max_len = max_len
+        self._data = np.empty(min(max_len, 1024), HistoryConn.tick_type)
+        self._bgn = 0
+        self._end = 0
+
+    def __len__(self) -> int:
+        return self._end - self._bgn
+
+    def append(self, ticks: np.array) -> int:
+        """Add ticks and return how many old ticks were dropped."""
+        if len(ticks) > self._max_len:
+            ticks = ticks[-self._max_len:]
+        if self._end + len(ticks) > len(self._data):
+            keep = self.data()
+            num_dropped = max(0, len(keep) + len(ticks) - self._max_len)
+            keep = keep[num_dropped:]
+            new_len = len(self._data)
+            while new_len < len(keep) + len(ticks):
+                new_len *= 2
+            data = np.empty(min(new_len, 2 * self._max_len),
+                            HistoryConn.tick_type)
+            data[:len(keep)] = keep
+            self._data = data
+            self._bgn = 0
+            self._end = len(keep)
+        else:
+            num_dropped = max(0, len(self) + len(ticks) - self._max_len)
+            self._bgn += num_dropped
+        self._data[self._end:self._end + len(ticks)] = ticks
+        self._end += len(ticks)
+        return num_dropped
+
+    def data(self) -> np.array:
+        return self._data[self._bgn:self._end].copy()
+
+    def clear(self) -> None:
+        self._bgn = 0
+        self._end = 0
+
+
+class _SymbolStream:
+    """What TickStitcher knows about one symbol."""
+
+    __slots__ = ('backfilling', 'pending', 'last_tick_id', 'kept',
+                 'num_dropped')
+
+    def __init__(self, max_buffered: int, keep_ticks: int):
+        self.backfilling = False
+        self.pending = _TickBuffer(max_buffered)
+        self.last_tick_id = None
+        self.kept = _TickBuffer(keep_ticks) if keep_ticks > 0 else None
+        self.num_dropped = 0
+
+
+class TickStitcher(SilentQuoteListener):
+    """
+    QuoteListener that merges backfilled and live ticks for each symbol.
+
+    :param name: Name of the listener.
+    :param on_ticks: Called as on_ticks(symbol, ticks) with each batch of
+        new ticks for symbol, oldest first, as a numpy array of dtype
+        HistoryConn.tick_type. Called with an internal lock held so it
+        must not call back into the TickStitcher.
+    :param max_buffered: Most live ticks held per symbol while waiting
+        for its backfill. If more arrive the oldest are dropped and
+        counted in num_dropped.
+    :param keep_ticks: Keep upto this many of the latest ticks for each
+        symbol, available from ticks(). 0 means keep none.
+
+    Ticks for a symbol that isn't being backfilled are passed straight
+    through, minus any with a tick id that has already been seen.
+
+    """
+
+    def __init__(self, name: str, on_ticks=None, max_buffered: int = 100000,
+                 keep_ticks: int = 0):
+        super().__init__(name)
+        assert max_buffered > 0
+        self._on_ticks = on_ticks
+        self._max_buffered = max_buffered
+        self._keep_ticks = keep_ticks
+        self._streams = {}
+        self._lock = threading.RLock()
+
+    def start_backfill(self, symbol: str) -> None:
+        """Hold live ticks for symbol until add_backfill is called."""
+        with self._lock:
+            stream = self._stream(symbol)
+            stream.backfilling = True
+            stream.pending.clear()
+
+    def add_backfill(self, symbol: str, ticks: np.array) -> None:
+        """
+        Hand over the backfill for symbol and release the held live ticks.
+
+        :param symbol: Symbol the ticks are for.
+        :param ticks: Array of dtype HistoryConn.tick_type in any order.
+
+        """
+        order = np.argsort(ticks['tick_id'], kind='stable')
+        with self._lock:
+            stream = self._stream(symbol)
+            self._emit(symbol, stream, ticks[order])
+            stream.backfilling = False
+            pending = stream.pending.data()
+            stream.pending.clear()
+            self._emit(symbol, stream, pending)
+
+    def ticks(self, symbol: str) -> np.array:
+        """Copy of the latest keep_ticks ticks for symbol, oldest first."""
+        with self._lock:
+            stream = self._streams.get(symbol)
+            if stream is None or stream.kept is None:
+                return np.empty(0, HistoryConn.tick_type)
+            return stream.kept.data()
+
+    def last_tick_id(self, symbol: str) -> int:
+        """Tick id of the last tick handed out for symbol or None."""
+        with self._lock:
+            stream = self._streams.get(symbol)
+            return None if stream is None else stream.last_tick_id
+
+    def num_dropped(self, symbol: str) -> int:
+        """Live ticks dropped because max_buffered was exceeded."""
+        with self._lock:
+            stream = self._streams.get(symbol)
+            return 0 if stream is None else stream.num_dropped
+
+    def symbols(self):
+        """Symbols seen so far."""
+        with self._lock:
+            return list(self._streams)
+
+    def process_summary(self, summary: np.array) -> None:
+        self.process_update(summary)
+
+    def process_update(self, update: np.array) -> None:
+        names = update.dtype.names
+        if 'TickId' not in names:
+            return
+        if 'Message Contents' in names:
+            contents = update['Message Contents'][0]
+            trade_types = [last_type for last_type in (b'C', b'E', b'O')
+                           if last_type in contents]
+            if len(trade_types) == 0:
+                return
+            last_type = trade_types[0]
+        else:
+            last_type = b'O'
+        tick = TickStitcher._update_to_tick(update, last_type)
+        symbol = update['Symbol'][0].decode()
+        with self._lock:
+            stream = self._stream(symbol)
+            if stream.backfilling:
+                stream.num_dropped += stream.pending.append(tick)
+            else:
+                self._emit(symbol, stream, tick)
+
+    def _stream(self, symbol: str) -> _SymbolStream:
+        stream = self._streams.get(symbol)
+        if stream is None:
+            stream = _SymbolStream(self._max_buffered, self._keep_ticks)
+            self._streams[symbol] = stream
+        return stream
+
+    def _emit(self, symbol: str, stream: _SymbolStream,
+              ticks: np.array) -> None:
+        """Pass on the ticks that are newer than any passed on before."""
+        if stream.last_tick_id is not None:
+            ticks = ticks[ticks['tick_id'] > stream.last_tick_id]
+        if len(ticks) == 0:
+            return
+        if len(ticks) > 1:
+            # Live ticks can repeat a tick id if only the quote changed and
+            # can arrive out of order. Drop any not newer than every tick
+            # before it so the ticks handed out always go forwards.
+            tick_ids = ticks['tick_id']
+            new = np.concatenate(
+                ([True], tick_ids[1:] > np.maximum.accumulate(tick_ids)[:-1]))
+            ticks = ticks[new]
+        stream.last_tick_id = int(ticks['tick_id'][-1])
+        if stream.kept is not None:
+            stream.kept.append(ticks)
+        if self._on_ticks is not None:
+            self._on_ticks(symbol, ticks)
+
+    @staticmethod
+    def _update_to_tick(update: np.array, last_type: bytes) -> np.array:
+        """Turn a QuoteConn update into one row of HistoryConn.tick_type."""
+        names = update.dtype.names
+        tick = np.zeros(1, HistoryConn.tick_type)
+        tick['tick_id'] = update['TickId']
+        if 'Most Recent Trade Date' in names:
+            tick['date'] = update['Most Recent Trade Date']
+        else:
+            tick['date'] = np.datetime64(datetime.date.today(), 'D')
+        tick['time'] = update['Most Recent Trade Time'].astype('m8[us]')
+        tick['last'] = update['Most Recent Trade']
+        tick['last_sz'] = update['Most Recent Trade Size']
+        tick['last_type'] = last_type
+        tick['mkt_ctr'] = update['Most Recent Trade Market Center']
+        tick['tot_vlm'] = update['Total Volume']
+        tick['bid'] = update['Bid']
+        tick['ask'] = update['Ask']
+        conds = update['Most Recent Trade Conditions'][0]
+        if update.dtype['Most Recent Trade Conditions'].kind == 'u':
+            # compact=True packs them into one u4
+            for cond_num in range(4):
+                tick['cond%d' % (cond_num + 1)] = (
+                    int(conds) >> (8 * cond_num)) & 0xFF
+        else:
+            for cond_num in range(min(len(conds) // 2, 4)):
+                tick['cond%d' % (cond_num + 1)] = int(
+                    conds[2 * cond_num:2 * cond_num + 2], 16)
+        return tick
@@ -0,0 +1,234 @@
+# coding=utf-8
+"""
+Local copy of IQFeed's symbol universe for fast searches.
+
+LookupConn.request_symbols_by_filter goes to IQFeed for every search,
+which is too slow for type-ahead search in a UI. SymbolMaster pulls the
+symbols once with SBF, SBS and SBN requests, saves them under root_dir
+and memory-maps them when it's created, so startup is instant and
+searches take microseconds.
+
+    master = iq.SymbolMaster("/data/symbols")
+    if len(master) == 0:
+        master.refresh(lookup_conn)
+    master.search("AAP")
+    master.search("APPLE", search_field='d', security_types=[1])
+
+refresh only pulls the parts of the universe you ask for and merges them
+into what is already held, so you can refresh a few prefixes or sectors
+at a time.
+
+"""
+
+import os
+import string
+from typing import Sequence
+
+import numpy as np
+from .conn import LookupConn
+
+
+class SymbolMaster:
+    """
+    Symbols, sorted by symbol, with a prefix index on the words of names.
+
+    :param root_dir: Directory the symbol master is saved in.
+
+    """
+
+    symbols_file = "symbols.npy"
+    words_file = "name_words.npy"
+    word_rows_file = "name_rows.npy"
+
+    # Words of names are indexed upto this many characters.
+    word_len = 24
+
+    # Prefixes pulled by a refresh that doesn't say what to pull.
+    default_prefixes = tuple(string.ascii_uppercase + string.digits + "@+$")
+
+    def __init__(self, root_dir: str):
+        self._root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def symbols(self) -> np.array:
+        """Every symbol held, as a read-only array of LookupConn.asset_type."""
+        return self._data
+
+    def search(self, prefix: str, search_field: str = 's',
+               markets: Sequence[int] = None,
+               security_types: Sequence[int] = None,
+               limit: int = None) -> np.array:
+        """
+        Find symbols starting with prefix, or whose name has a word that does.
+
+        :param prefix: What to search for. Case doesn't matter.
+        :param search_field: 's': search symbols, 'd': search names.
+        :param markets: Only symbols listed on these market ids.
+        :param security_types: Only symbols of these security type ids.
+        :param limit: Return at most this many matches.
+        :return: np.array of dtype LookupConn.asset_type sorted by symbol.
+
+        """
+        assert search_field in ('s', 'd')
+        key = prefix.upper().encode('latin-1')
+        if search_field == 's':
+            first, last = SymbolMaster._prefix_range(self._data['symbol'],
+                                                     key)
+            rows = np.arange(first, last)
+        else:
+            first, last = SymbolMaster._prefix_range(
+                self._words, key[:SymbolMaster.word_len])
+            rows = np.unique(self._word_rows[first:last])
+        return self._select(rows, markets, security_types, limit)
+
+    def filter(self, markets: Sequence[int] = None,
+               security_types: Sequence[int] = None) -> np.array:
+        """All symbols listed on markets and of security_types."""
+        return self._select(np.arange(len(self._data)), markets,
+                            security_types, None)
+
+    def refresh(self, lookup_conn: LookupConn,
+                prefixes: Sequence[str] = None, sics: Sequence[int] = (),
+                naics: Sequence[int] = (), timeout: int = None) -> int:
+        """
+        Pull part of the symbol universe from IQFeed and merge it in.
+
+        :param lookup_conn: Connected LookupConn.
+        :param prefixes: Symbol prefixes to pull with SBF. Symbols held that
+            start with one of these and aren't returned again are removed.
+            Default is default_prefixes if nothing else is asked for.
+        :param sics: SIC codes to pull with SBS. Sets the sector of symbols.
+        :param naics: NAICS codes to pull with SBN. Sets the sector of
+            symbols.
+        :param timeout: Wait upto timeout seconds for each request.
+        :return: Number of symbols held afterwards.
+
+        """
+        if prefixes is None:
+            prefixes = () if (sics or naics) else SymbolMaster.default_prefixes
+        pulled = []
+        for prefix in prefixes:
+            pulled.append(SymbolMaster._pull(
+                lookup_conn.request_symbols_by_filter, search_term=prefix,
+                search_field='s', timeout=timeout))
+        for sic in sics:
+            pulled.append(SymbolMaster._pull(
+                lookup_conn.request_symbols_by_sic, sic, timeout=timeout))
+        for naic in naics:
+            pulled.append(SymbolMaster._pull(
+                lookup_conn.request_symbols_by_naic, naic, timeout=timeout))
+
+        old = np.array(self._data)
+        pulled = np.concatenate(
+            [np.empty(0, LookupConn.asset_type)] + pulled)
+        # SBF doesn't return sectors, so keep the ones held for symbols
+        # that are pulled again.
+        if len(old) > 0:
+            no_sector = np.flatnonzero(pulled['sector'] == 0)
+            idx = np.minimum(np.searchsorted(
+                old['symbol'], pulled['symbol'][no_sector]), len(old) - 1)
+            found = old['symbol'][idx] == pulled['symbol'][no_sector]
+            pulled['sector'][no_sector[found]] = old['sector'][idx[found]]
+
+        keep = np.ones(len(old), dtype=bool)
+        for prefix in prefixes:
+            first, last = SymbolMaster._prefix_range(
+                old['symbol'], prefix.upper().encode('latin-1'))
+            keep[first:last] = False
+        merged = SymbolMaster._merge(np.concatenate((old[keep], pulled)))
+        self._save(merged)
+        return len(self._data)
+
+    def _select(self, rows: np.array, markets: Sequence[int],
+                security_types: Sequence[int], limit: int) -> np.array:
+        """Rows of the master that pass the filters."""
+        if markets is not None:
+            rows = rows[np.isin(self._data['market'][rows], markets)]
+        if security_types is not None:
+            rows = rows[np.isin(self._data['security_type'][rows],
+                                security_types)]
+        if limit is not None:
+            rows = rows[:limit]
+        return self._data[rows]
+
+    def _load(self) -> None:
+        """Memory-map the saved master and its name index."""
+        symbols_name = os.path.join(self._root_dir, SymbolMaster.symbols_file)
+        if os.path.isfile(symbols_name):
+            self._data = np.load(symbols_name, mmap_mode='r')
+            self._words = np.load(os.path.join(
+                self._root_dir, SymbolMaster.words_file), mmap_mode='r')
+            self._word_rows = np.load(os.path.join(
+                self._root_dir, SymbolMaster.word_rows_file), mmap_mode='r')
+        else:
+            self._data = np.empty(0, LookupConn.asset_type)
+            self._words = np.empty(0, 'S%d' % SymbolMaster.word_len)
+            self._word_rows = np.empty(0, 'i4')
+
+    def _save(self, data: np.array) -> None:
+        """Write data sorted by symbol, index its names and reload."""
+        words = []
+        word_rows = []
+        for row_num, name in enumerate(data['name']):
+            for word in name.upper().split():
+                words.append(word[:SymbolMaster.word_len])
+                word_rows.append(row_num)
+        words = np.array(words, dtype='S%d' % SymbolMaster.word_len)
+        word_rows = np.array(word_rows, dtype='i4')
+        order = np.argsort(words, kind='stable')
+        # Write the index first. It's the symbols file that says a master
+        # exists.
+        for file_name, array in ((SymbolMaster.words_file, words[order]),
+                                 (SymbolMaster.word_rows_file,
+                                  word_rows[order]),
+                                 (SymbolMaster.symbols_file, data)):
+            full_name = os.path.join(self._root_dir, file_name)
+            tmp_name = full_name + ".tmp"
+            with open(tmp_name, 'wb') as tmp_file:
+                np.save(tmp_file, array)
+            os.replace(tmp_name, full_name)
+        self._load()
+
+    @staticmethod
+    def _pull(request_func, *args, **kwargs) -> np.array:
+        """Make a lookup request, treating no matches as an empty array."""
+        try:
+            return request_func(*args, **kwargs)
+        except RuntimeError as err:
+            if "!NO_DATA!" in str(err):
+                return np.empty(0, LookupConn.asset_type)
+            raise
+
+    @staticmethod
+    def _merge(data: np.array) -> np.array:
+        """
+        One row per symbol, sorted by symbol. Later rows win but the sector
+        is the latest non-zero one, so an SBS or SBN sector is kept if a
+        later SBF pull has none.
+
+        """
+        data = data[np.argsort(data['symbol'], kind='stable')]
+        if len(data) == 0:
+            return data
+        starts = np.flatnonzero(np.concatenate((
+            [True], data['symbol'][1:] != data['symbol'][:-1])))
+        last = np.concatenate((starts[1:], [len(data)])) - 1
+        merged = data[last]
+        # Index of the latest row with a sector, carried forward.
+        with_sector = np.where(data['sector'] != 0, np.arange(len(data)), -1)
+        latest = np.maximum.accumulate(with_sector)[last]
+        has_sector = latest >= starts
+        merged['sector'][has_sector] = data['sector'][latest[has_sector]]
+        return merged
+
+    @staticmethod
+    def _prefix_range(sorted_keys: np.array, prefix: bytes):
+        """First and one past the last index of keys starting with prefix."""
+        first = np.searchsorted(sorted_keys, prefix, side='left')
+        last = np.searchsorted(sorted_keys, prefix + b'\xff', side='left')
+        return int(first), int(last)
@@ -12,4 +12,6 @@ setup(
     author_email='ashwin.kapur@gmail.com',
     license='GPL v2',
     packages=['pyiqfeed'],
+    entry_points={
+        'console_scripts': ['pyiqfeed-download=pyiqfeed.download:main']},
     zip_safe=False, install_requires=['numpy'])
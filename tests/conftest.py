@@ -0,0 +1,163 @@
+# coding=utf-8
+"""A mock IQFeed lookup socket for testing conns without IQFeed running."""
+
+import re
+import socket
+import threading
+import time
+
+import pytest
+
+_req_id_re = re.compile(r"[A-Z]_\d{10}$")
+
+
+def req_id_of(fields) -> str:
+    """The request id in the fields of a request command."""
+    for field in fields:
+        if _req_id_re.match(field):
+            return field
+    raise ValueError("No request id in %s" % ",".join(fields))
+
+
+def tick_line(tick_id: int, ts: str, last: float = 100.25,
+              last_sz: int = 10, tot_vlm: int = 1000, bid: float = 100.0,
+              ask: float = 100.5, mkt_ctr: int = 11,
+              conds: str = "3D87") -> str:
+    """A line of tick data without the request id."""
+    return "%s,%s,%d,%d,%s,%s,%d,O,%d,%s," % (
+        ts, last, last_sz, tot_vlm, bid, ask, tick_id, mkt_ctr, conds)
+
+
+def bar_line(ts: str, open_p: float = 10.0, high_p: float = 11.0,
+             low_p: float = 9.0, close_p: float = 10.5, tot_vlm: int = 1000,
+             prd_vlm: int = 100, num_trds: int = 5) -> str:
+    """A line of bar data without the request id."""
+    return "%s,%s,%s,%s,%s,%d,%d,%d," % (
+        ts, high_p, low_p, open_p, close_p, tot_vlm, prd_vlm, num_trds)
+
+
+def daily_line(date: str, close_p: float = 10.5) -> str:
+    """A line of daily data without the request id."""
+    return "%s,11.0,9.0,10.0,%s,1000,0," % (date, close_p)
+
+
+class MockIQFeed:
+    """
+    Stands in for IQFeed's lookup socket on a free port on localhost.
+
+    handler is called with the fields of each request command and returns
+    the lines to send back without the request id, or None to send
+    nothing. Each line is sent as "<request id>,<line>" and followed by an
+    !ENDMSG! line. If handler returns bytes they are sent as they are.
+    commands holds every request command received.
+
+    If batch_secs is more than 0, lines are sent in batches of the
+    DatapointsPerSend at the end of the command, waiting batch_secs before
+    each batch, like IQFeed does.
+
+    """
+
+    def __init__(self):
+        self.handler = lambda fields: []
+        self.commands = []
+        self.batch_secs = 0
+        self._clients = []
+        self._lock = threading.Lock()
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen()
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._clients.append(client)
+            threading.Thread(target=self._serve, args=(client,),
+                             daemon=True).start()
+
+    def _serve(self, client: socket.socket) -> None:
+        buf = b""
+        while True:
+            try:
+                data = client.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            buf += data
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                self._handle(client, line.decode('latin-1').strip())
+
+    def _handle(self, client: socket.socket, command: str) -> None:
+        fields = command.split(',')
+        if fields[0] == "S":
+            if fields[1] == "SET PROTOCOL":
+                client.sendall(("S,CURRENT PROTOCOL,%s\r\n" %
+                                fields[2]).encode('latin-1'))
+            return
+        self.commands.append(command)
+        reply = self.handler(fields)
+        if reply is None:
+            return
+        if isinstance(reply, bytes):
+            client.sendall(reply)
+            return
+        req_id = req_id_of(fields)
+        lines = ["%s,%s\r\n" % (req_id, line) for line in reply]
+        batch_len = len(lines) or 1
+        if self.batch_secs > 0 and fields[-1].isdigit():
+            batch_len = int(fields[-1])
+        for first in range(0, len(lines), batch_len):
+            if self.batch_secs > 0:
+                time.sleep(self.batch_secs)
+            client.sendall("".join(
+                lines[first:first + batch_len]).encode('latin-1'))
+        client.sendall(("%s,!ENDMSG!,\r\n" % req_id).encode('latin-1'))
+
+    def nudge(self) -> None:
+        """Send a blank line to wake up the reader threads of clients."""
+        with self._lock:
+            for client in self._clients:
+                try:
+                    client.sendall(b"\r\n")
+                except OSError:
+                    pass
+
+    def close(self) -> None:
+        self._listener.close()
+        with self._lock:
+            for client in self._clients:
+                client.close()
+
+
+@pytest.fixture
+def mock_iqfeed():
+    mock = MockIQFeed()
+    yield mock
+    mock.close()
+
+
+@pytest.fixture
+def connect(mock_iqfeed):
+    """Function that makes and connects a conn to mock_iqfeed."""
+    conns = []
+
+    def make_conn(conn_type, **kwargs):
+        conn = conn_type(name="test-%d" % len(conns), host="127.0.0.1",
+                         port=mock_iqfeed.port, **kwargs)
+        conn.connect()
+        conns.append(conn)
+        return conn
+
+    yield make_conn
+    for conn in conns:
+        # The reader thread only checks for stop between reads.
+        conn._stop.set()
+        mock_iqfeed.nudge()
+        conn.disconnect()
@@ -0,0 +1,49 @@
+# coding=utf-8
+"""AdjustmentCache against a mock IQFeed."""
+
+import numpy as np
+
+import pyiqfeed as iq
+from conftest import daily_line
+
+
+def _fundamentals(symbol, ex_date, amount):
+    fund = np.zeros(1, iq.QuoteConn.fundamental_type)
+    fund['Symbol'] = symbol
+    fund['Ex-dividend Date'] = np.datetime64(ex_date)
+    fund['Dividend Amount'] = amount
+    return fund
+
+
+def test_dividends_resolved_off_the_listener(tmp_path, mock_iqfeed,
+                                             connect):
+    mock_iqfeed.handler = lambda fields: (
+        [daily_line("2023-02-09", close_p=50.0)] if fields[1] == "AAPL"
+        else ["E,!NO_DATA!,"])
+    hist_conn = connect(iq.HistoryConn)
+    cache = iq.AdjustmentCache(str(tmp_path), hist_conn)
+    listener = iq.AdjustmentListener("adj", cache)
+    for _ in range(2):
+        listener.process_fundamentals(
+            _fundamentals("AAPL", "2023-02-10", 0.5))
+        listener.process_fundamentals(
+            _fundamentals("MSFT", "2023-02-15", 0.68))
+    assert mock_iqfeed.commands == []
+    assert np.isnan(cache.events("AAPL")['factor']).all()
+
+    assert cache.resolve_pending(timeout=5) == 1
+    assert len(mock_iqfeed.commands) == 2
+    assert cache.events("AAPL")['factor'][0] == 0.99
+    assert np.isnan(cache.events("MSFT")['factor']).all()
+
+    # MSFT had no data so isn't asked for again.
+    listener.process_fundamentals(_fundamentals("MSFT", "2023-02-15", 0.68))
+    assert cache.resolve_pending(timeout=5) == 0
+    assert len(mock_iqfeed.commands) == 2
+
+    # Unresolved dividends read back after a restart are tried again.
+    cache = iq.AdjustmentCache(str(tmp_path), hist_conn)
+    assert cache.factors("AAPL")['price'][0] == 0.99
+    assert len(cache.events("MSFT")) == 1
+    assert cache.resolve_pending(timeout=5) == 0
+    assert len(mock_iqfeed.commands) == 3
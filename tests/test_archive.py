@@ -0,0 +1,211 @@
+# coding=utf-8
+"""Archive and EncodedArchive round trips."""
+
+import datetime
+
+import numpy as np
+import pytest
+
+import pyiqfeed as iq
+
+
+def make_bars(days, per_day: int = 3) -> np.array:
+    """per_day minute bars from 09:31 on each of days."""
+    bars = np.zeros(len(days) * per_day, iq.HistoryConn.bar_type)
+    bars['date'] = np.repeat(np.array(days, dtype='M8[D]'), per_day)
+    bars['time'] = np.tile(np.timedelta64(9 * 3600 + 1860, 's') +
+                           np.arange(per_day) * np.timedelta64(60, 's'),
+                           len(days)).astype('m8[us]')
+    bars['open_p'] = 100 + np.arange(len(bars)) / 100
+    bars['high_p'] = bars['open_p'] + 0.05
+    bars['low_p'] = bars['open_p'] - 0.05
+    bars['close_p'] = bars['open_p'] + 0.01
+    bars['prd_vlm'] = 100
+    bars['tot_vlm'] = np.cumsum(bars['prd_vlm'])
+    bars['num_trds'] = 1
+    return bars
+
+
+@pytest.mark.parametrize("compression", [None, 'zlib', 'lzma'])
+def test_encoded_round_trip(tmp_path, compression):
+    archive = iq.EncodedArchive(str(tmp_path), compression=compression,
+                                block_rows=2)
+    bars = make_bars(['2023-01-03', '2023-01-04', '2023-01-06'])
+    archive.append("@ES#", "bars_60s", bars[:4])
+    archive.append("@ES#", "bars_60s", bars[4:])
+    read = archive.read("@ES#", "bars_60s")
+    assert read.dtype == bars.dtype
+    assert np.array_equal(read, bars)
+    assert list(archive.days("@ES#", "bars_60s")) == list(
+        np.array(['2023-01-03', '2023-01-04', '2023-01-06'], 'M8[D]'))
+    assert archive.last_timestamp("@ES#", "bars_60s") == np.datetime64(
+        '2023-01-06T09:33:00')
+
+    read = archive.read("@ES#", "bars_60s",
+                        np.datetime64('2023-01-03T09:32'),
+                        np.datetime64('2023-01-04T09:32'))
+    assert np.array_equal(read, bars[1:5])
+
+
+def test_encoded_empty_days(tmp_path):
+    archive = iq.EncodedArchive(str(tmp_path))
+    with pytest.raises(KeyError):
+        archive.read("AAPL", "bars_60s")
+    archive.append("AAPL", "bars_60s", make_bars([])[:0])
+    with pytest.raises(KeyError):
+        archive.read("AAPL", "bars_60s")
+    assert archive.last_timestamp("AAPL", "bars_60s") is None
+
+    bars = make_bars(['2023-01-03', '2023-01-06'])
+    archive.append("AAPL", "bars_60s", bars)
+    # Days with nothing stored, before, between and after the stored ones.
+    for bgn, end in (('2023-01-02', '2023-01-02T23:59'),
+                     ('2023-01-04', '2023-01-05T23:59'),
+                     ('2023-01-09', '2023-01-10')):
+        read = archive.read("AAPL", "bars_60s", np.datetime64(bgn),
+                            np.datetime64(end))
+        assert len(read) == 0
+        assert read.dtype == bars.dtype
+    read = archive.read("AAPL", "bars_60s", np.datetime64('2023-01-04'),
+                        np.datetime64('2023-01-06T09:31'))
+    assert np.array_equal(read, bars[3:4])
+
+
+def test_encoded_edge_values(tmp_path):
+    dtype = np.dtype([('timestamp', 'M8[ns]'), ('i8', 'i8'), ('u8', 'u8'),
+                      ('u1', 'u1'), ('f8', 'f8'), ('f4', 'f4'),
+                      ('tiny', 'f8'), ('nan', 'f8'), ('price', 'f8'),
+                      ('s', 'S1'), ('gap', 'm8[us]')])
+    data = np.zeros(6, dtype)
+    data['timestamp'] = np.datetime64('2023-01-03T09:30') + np.arange(6)
+    i8 = np.iinfo('i8')
+    data['i8'] = [i8.min, i8.max, 0, -1, i8.min, i8.max]
+    data['u8'] = [0, np.iinfo('u8').max, 1, 2 ** 63, 0, 5]
+    data['u1'] = [0, 255, 1, 254, 0, 255]
+    data['f8'] = [-0.0, 0.0, 1e15, -123.456, 0.1, 2 ** 60]
+    data['f4'] = np.array([-0.0, 0.1, 1.5, 3.4e38, -1e-30, 7], 'f4')
+    data['tiny'] = [5e-324, 1e-10, 0.0, -5e-324, 1.0, 2.0]
+    data['nan'] = [np.nan, np.inf, -np.inf, 0.0, 1.0, -0.0]
+    data['price'] = [-0.0, 12.35, 0.0, -0.01, 12.34, -0.0]
+    data['s'] = [b'', b'O', b'\xff', b'C', b'\x00', b'z']
+    data['gap'] = [np.timedelta64('NaT'), 0, -1, 1, 2 ** 62, -2 ** 62]
+    for compression in (None, 'zlib', 'lzma'):
+        archive = iq.EncodedArchive(str(tmp_path / str(compression)),
+                                    compression=compression)
+        archive.append("X", "edge", data)
+        read = archive.read("X", "edge")
+        # Compare the bytes so NaN, NaT and the sign of 0.0 count.
+        assert read.tobytes() == data.tobytes()
+
+
+def test_encoded_u8_within_i8_range(tmp_path):
+    # u8 values that fit in an i8 are delta encoded, even when the
+    # differences between them don't fit.
+    data = np.zeros(3, [('timestamp', 'M8[ns]'), ('vlm', 'u8')])
+    data['timestamp'] = np.datetime64('2023-01-03T09:30') + np.arange(3)
+    data['vlm'] = [np.iinfo('i8').max, 0, np.iinfo('i8').max]
+    archive = iq.EncodedArchive(str(tmp_path))
+    archive.append("X", "vlm", data)
+    assert np.array_equal(archive.read("X", "vlm"), data)
+
+
+def test_round_trip(tmp_path):
+    archive = iq.Archive(str(tmp_path))
+    bars = make_bars(['2023-01-03', '2023-01-04'])
+    archive.append("@ES#", "bars_60s", bars[:2])
+    archive.append("@ES#", "bars_60s", bars[2:])
+    read = archive.read("@ES#", "bars_60s")
+    assert isinstance(read, np.memmap)
+    assert not read.flags.writeable
+    assert np.array_equal(read, bars)
+    assert list(archive.days("@ES#", "bars_60s")) == list(
+        np.array(['2023-01-03', '2023-01-04'], 'M8[D]'))
+    # "@ES#" is quoted so it makes a safe directory name.
+    assert (tmp_path / "%40ES%23" / "bars_60s" / "data.bin").is_file()
+
+    with pytest.raises(ValueError):
+        archive.append("@ES#", "bars_60s", bars[:1])
+    with pytest.raises(ValueError):
+        archive.append("@ES#", "bars_60s", bars[::-1])
+    with pytest.raises(ValueError):
+        archive.append("@ES#", "bars_60s",
+                       make_bars(['2023-01-05']).astype(
+                           iq.HistoryConn.bar_h5_type))
+    with pytest.raises(KeyError):
+        archive.read("@ES#", "ticks")
+    assert archive.last_timestamp("@ES#", "ticks") is None
+    assert np.array_equal(archive.read("@ES#", "bars_60s"), bars)
+
+
+def test_ranges_across_days(tmp_path):
+    archive = iq.Archive(str(tmp_path))
+    bars = make_bars(['2023-01-03', '2023-01-04', '2023-01-06',
+                      '2023-01-09'])
+    archive.append("AAPL", "bars_60s", bars[:5])
+    archive.append("AAPL", "bars_60s", bars[5:])
+    ts = bars['date'] + bars['time']
+
+    def read(bgn, end):
+        return archive.read("AAPL", "bars_60s", bgn, end)
+
+    # Every pair of bar times, and times between bars, as bgn and end.
+    times = np.sort(np.concatenate((ts, ts + np.timedelta64(30, 's'))))
+    for bgn in times:
+        for end in times:
+            expected = bars[(ts >= bgn) & (ts <= end)]
+            assert np.array_equal(read(bgn, end), expected)
+    assert np.array_equal(read(None, ts[4]), bars[:5])
+    assert np.array_equal(read(ts[4], None), bars[4:])
+    # Before, between and after the stored days.
+    assert len(read(np.datetime64('2023-01-02'),
+                    np.datetime64('2023-01-02T23:00'))) == 0
+    assert len(read(np.datetime64('2023-01-05'),
+                    np.datetime64('2023-01-05T23:00'))) == 0
+    assert len(read(np.datetime64('2023-01-10'), None)) == 0
+    assert np.array_equal(read(np.datetime64('2023-01-05'),
+                               np.datetime64('2023-01-07')), bars[6:9])
+
+
+def test_reopen(tmp_path):
+    bars = make_bars(['2023-01-03', '2023-01-04', '2023-01-05'])
+    iq.Archive(str(tmp_path)).append("AAPL", "bars_60s", bars[:4])
+
+    archive = iq.Archive(str(tmp_path))
+    assert archive.last_timestamp("AAPL", "bars_60s") == np.datetime64(
+        '2023-01-04T09:31:00')
+    # A bar on the same day as the last stored one doesn't start a day.
+    archive.append("AAPL", "bars_60s", bars[4:])
+    assert np.array_equal(archive.read("AAPL", "bars_60s"), bars)
+    assert len(archive.days("AAPL", "bars_60s")) == 3
+
+    # Rows written by an append that died before updating the index are
+    # overwritten by the next append.
+    with open(tmp_path / "AAPL" / "bars_60s" / "data.bin", 'ab') as data:
+        data.write(b"\xff" * 100)
+    archive = iq.Archive(str(tmp_path))
+    assert np.array_equal(archive.read("AAPL", "bars_60s"), bars)
+    more = make_bars(['2023-01-06'])
+    archive.append("AAPL", "bars_60s", more)
+    assert np.array_equal(iq.Archive(str(tmp_path)).read(
+        "AAPL", "bars_60s"), np.concatenate((bars, more)))
+
+
+def test_timestamps_and_daily_data(tmp_path):
+    archive = iq.Archive(str(tmp_path))
+    ticks = np.zeros(4, iq.HistoryConn.tick_ts_type)
+    ticks['timestamp'] = np.array(
+        ['2023-01-03T09:30:00.000001', '2023-01-03T09:30:00.000001',
+         '2023-01-03T15:59:59', '2023-01-04T09:30'], 'M8[ns]')
+    ticks['tick_id'] = np.arange(4) + 1
+    archive.append("AAPL", "ticks", ticks)
+    read = archive.read("AAPL", "ticks", ticks['timestamp'][0],
+                        np.datetime64('2023-01-03T16:00'))
+    assert list(read['tick_id']) == [1, 2, 3]
+
+    daily = np.zeros(3, iq.HistoryConn.daily_type)
+    daily['date'] = np.array(['2023-01-03', '2023-01-04', '2023-01-05'],
+                             'M8[D]')
+    archive.append("AAPL", "daily", daily)
+    read = archive.read("AAPL", "daily", datetime.date(2023, 1, 4),
+                        datetime.date(2023, 1, 5))
+    assert np.array_equal(read, daily[1:])
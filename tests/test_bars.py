@@ -0,0 +1,135 @@
+# coding=utf-8
+"""bars.tick_bars on small hand made ticks."""
+
+import numpy as np
+import pytest
+
+import pyiqfeed as iq
+
+
+def make_ticks(rows, dtype=iq.HistoryConn.tick_type) -> np.array:
+    """Ticks from (time, last, last_sz, last_type, conds) on 2023-01-03."""
+    ticks = np.zeros(len(rows), dtype)
+    times = np.array([np.timedelta64(9 * 3600 + 1800, 's') + np.timedelta64(
+        int(row[0] * 1e6), 'us') for row in rows], dtype='m8[us]')
+    if 'timestamp' in dtype.names:
+        ticks['timestamp'] = np.datetime64('2023-01-03') + times
+    else:
+        ticks['date'] = np.datetime64('2023-01-03')
+        ticks['time'] = times
+    ticks['tick_id'] = np.arange(len(rows)) + 1
+    ticks['last'] = [row[1] for row in rows]
+    ticks['last_sz'] = [row[2] for row in rows]
+    ticks['tot_vlm'] = np.cumsum(ticks['last_sz'])
+    ticks['last_type'] = [row[3] for row in rows]
+    for cond_num in range(4):
+        conds = [row[4][cond_num] if cond_num < len(row[4]) else 0
+                 for row in rows]
+        if 'conds' in dtype.names:
+            ticks['conds'] |= np.array(conds, dtype='u4') << (8 * cond_num)
+        else:
+            ticks['cond%d' % (cond_num + 1)] = conds
+    return ticks
+
+
+ROWS = [(0.5, 10.0, 100, b'O', ()),
+        (10.0, 10.5, 200, b'O', (0x3D,)),
+        (59.999999, 9.5, 300, b'C', ()),
+        (60.0, 11.0, 400, b'O', (0, 0x87)),
+        (61.0, 10.0, 500, b'O', ()),
+        (150.0, 12.0, 600, b'O', ())]
+
+
+def test_time_bar_boundaries():
+    bars = iq.bars.tick_bars(make_ticks(ROWS), 60)
+    assert list(bars['time'].astype('i8') // 1000000) == [
+        9 * 3600 + 1860, 9 * 3600 + 1920, 9 * 3600 + 1980]
+    assert (bars['date'] == np.datetime64('2023-01-03')).all()
+    assert list(bars['open_p']) == [10.0, 11.0, 12.0]
+    assert list(bars['high_p']) == [10.5, 11.0, 12.0]
+    assert list(bars['low_p']) == [9.5, 10.0, 12.0]
+    assert list(bars['close_p']) == [9.5, 10.0, 12.0]
+    assert list(bars['prd_vlm']) == [600, 900, 600]
+    assert list(bars['tot_vlm']) == [600, 1500, 2100]
+    assert list(bars['num_trds']) == [3, 2, 1]
+
+    bars = iq.bars.tick_bars(make_ticks(ROWS), 60, label_at_beginning=True)
+    assert list(bars['time'].astype('i8') // 1000000) == [
+        9 * 3600 + 1800, 9 * 3600 + 1860, 9 * 3600 + 1920]
+
+
+def test_partial_last_bar():
+    bars = iq.bars.tick_bars(make_ticks(ROWS), 2, interval_type='t')
+    assert list(bars['num_trds']) == [2, 2, 2]
+    bars = iq.bars.tick_bars(make_ticks(ROWS), 4, interval_type='t')
+    assert list(bars['num_trds']) == [4, 2]
+    assert list(bars['open_p']) == [10.0, 10.0]
+    assert list(bars['close_p']) == [11.0, 12.0]
+    assert bars['time'][-1] == make_ticks(ROWS)['time'][-1]
+
+
+def test_volume_bars():
+    # Day volume before each tick is 0, 100, 300, 600, 1000 and 1500, so
+    # with 600 a bar the 4th and 6th ticks start new bars.
+    bars = iq.bars.tick_bars(make_ticks(ROWS), 600, interval_type='v')
+    assert list(bars['num_trds']) == [3, 2, 1]
+    assert list(bars['prd_vlm']) == [600, 900, 600]
+    assert list(bars['close_p']) == [9.5, 10.0, 12.0]
+
+
+def test_bars_restart_each_day():
+    ticks = make_ticks(ROWS)
+    ticks['date'][3:] += 1
+    bars = iq.bars.tick_bars(ticks, 4, interval_type='t')
+    assert list(bars['num_trds']) == [3, 3]
+    assert list(bars['date']) == [np.datetime64('2023-01-03'),
+                                  np.datetime64('2023-01-04')]
+
+
+@pytest.mark.parametrize("dtype", [iq.HistoryConn.tick_type,
+                                   iq.HistoryConn.tick_ts_type,
+                                   iq.HistoryConn.tick_compact_type])
+def test_filters(dtype):
+    ticks = make_ticks(ROWS, dtype)
+    bars = iq.bars.tick_bars(ticks, 60, exclude_conds=[0x87, 0x3D])
+    assert list(bars['num_trds']) == [2, 1, 1]
+    assert list(bars['high_p']) == [10.0, 10.0, 12.0]
+    assert list(bars['prd_vlm']) == [400, 500, 600]
+
+    bars = iq.bars.tick_bars(ticks, 60, last_types=[b'O'])
+    assert list(bars['num_trds']) == [2, 2, 1]
+    assert list(bars['low_p']) == [10.0, 10.0, 12.0]
+
+    bars = iq.bars.tick_bars(ticks, 60, exclude_conds=[0x3D],
+                             last_types=[b'O'])
+    assert list(bars['num_trds']) == [1, 2, 1]
+    if 'timestamp' in dtype.names:
+        assert bars.dtype == iq.HistoryConn.bar_ts_type
+
+    bars = iq.bars.tick_bars(ticks, 60, last_types=[b'X'])
+    assert len(bars) == 0
+
+
+def test_conds_match_whole_bytes():
+    # Conditions either side of 0x3D, or 0x3D with the high bit set, must
+    # not be taken for 0x3D.
+    ticks = make_ticks([(1.0, 10.0, 100, b'O', (0x3C, 0x3E, 0x01, 0xFF)),
+                        (2.0, 10.0, 100, b'O', (0, 0, 0, 0x3D)),
+                        (3.0, 10.0, 100, b'O', (0xBD, 0xBC))])
+    bars = iq.bars.tick_bars(ticks, 60, exclude_conds=[0x3D])
+    assert list(bars['num_trds']) == [2]
+    bars = iq.bars.tick_bars(ticks, 60, exclude_conds=[0])
+    assert list(bars['num_trds']) == [1]
+
+
+def test_descending_ticks():
+    ticks = make_ticks(ROWS)
+    forward = iq.bars.tick_bars(ticks, 60, exclude_conds=[0x3D])
+    backward = iq.bars.tick_bars(ticks[::-1], 60, exclude_conds=[0x3D])
+    assert (backward == forward[::-1]).all()
+
+
+def test_no_ticks():
+    bars = iq.bars.tick_bars(make_ticks([]), 60)
+    assert bars.dtype == iq.HistoryConn.bar_type
+    assert len(bars) == 0
@@ -0,0 +1,58 @@
+# coding=utf-8
+"""ChainCache against a mock IQFeed."""
+
+import datetime
+
+import pyiqfeed as iq
+
+_chain_line = "AAPL9917F142.5,AAPL9917F145,:,AAPL9917R142.5,"
+
+
+def test_chains_survive_restarts(tmp_path, mock_iqfeed, connect):
+    mock_iqfeed.handler = lambda fields: [_chain_line]
+    chains = iq.ChainCache(str(tmp_path), refresh_weekdays=())
+    lookup_conn = connect(iq.LookupConn, cache=chains)
+    chain = lookup_conn.request_equity_option_chain("AAPL", near_months=1,
+                                                    timeout=5)
+    assert chain == {"c": ["AAPL9917F142.5", "AAPL9917F145"],
+                     "p": ["AAPL9917R142.5"]}
+    assert lookup_conn.request_equity_option_chain(
+        "AAPL", near_months=1, timeout=5) == chain
+    assert len(mock_iqfeed.commands) == 1
+
+    chains = iq.ChainCache(str(tmp_path), refresh_weekdays=())
+    lookup_conn = connect(iq.LookupConn, cache=chains)
+    assert lookup_conn.request_equity_option_chain(
+        "AAPL", near_months=1, timeout=5) == chain
+    assert len(mock_iqfeed.commands) == 1
+    assert chains.stats().num_entries == 1
+
+    chains.clear()
+    lookup_conn.request_equity_option_chain("AAPL", near_months=1,
+                                            timeout=5)
+    assert len(mock_iqfeed.commands) == 2
+
+
+def test_expired_chains_are_fetched_again(tmp_path, mock_iqfeed, connect):
+    mock_iqfeed.handler = lambda fields: [_chain_line.replace("99", "21")]
+    lookup_conn = connect(iq.LookupConn, cache=iq.ChainCache(
+        str(tmp_path), refresh_weekdays=()))
+    for _ in range(2):
+        lookup_conn.request_equity_option_chain("AAPL", near_months=1,
+                                                timeout=5)
+    assert len(mock_iqfeed.commands) == 2
+
+
+def test_good_until():
+    def local_midnight(year, month, day):
+        return datetime.datetime(year, month, day).timestamp()
+
+    assert iq.ChainCache.good_until("CEO", {
+        "c": ["AAPL9917F142.5"], "p": ["AAPL9910R142.5"]}) == \
+        local_midnight(2099, 6, 11)
+    # Futures may expire in the month before the contract month.
+    assert iq.ChainCache.good_until(
+        "CFU", ["@ESZ99", "@ESH98"]) == local_midnight(2098, 2, 1)
+    assert iq.ChainCache.good_until(
+        "CFS", ["@ESZ99-@ESH99"]) == local_midnight(2099, 2, 1)
+    assert iq.ChainCache.good_until("CFU", []) == float('inf')
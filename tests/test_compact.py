@@ -0,0 +1,66 @@
+# coding=utf-8
+"""compact=True on HistoryConn and QuoteConn."""
+
+import pytest
+
+import pyiqfeed as iq
+from conftest import bar_line, tick_line
+
+
+def test_compact_ticks_and_bars(mock_iqfeed, connect):
+    hist_conn = connect(iq.HistoryConn, compact=True)
+    mock_iqfeed.handler = lambda fields: [
+        tick_line(5000000000, "2023-01-03 09:30:00.000001")]
+    ticks = hist_conn.request_ticks("AAPL", 10, timeout=5)
+    assert ticks.dtype == iq.HistoryConn.tick_compact_type
+    assert ticks['tick_id'][0] == 5000000000
+    assert list(iq.HistoryConn.unpack_conds(ticks['conds'])[0]) == [
+        0x3D, 0x87, 0, 0]
+
+    mock_iqfeed.handler = lambda fields: [bar_line("2023-01-03 09:31:00")]
+    bars = hist_conn.request_bars("AAPL", 60, 's', 10, timeout=5)
+    assert bars.dtype == iq.HistoryConn.bar_compact_type
+    assert bars['close_p'][0] == pytest.approx(10.5)
+
+
+def test_compact_overflow_reaches_caller(mock_iqfeed, connect):
+    hist_conn = connect(iq.HistoryConn, compact=True)
+    mock_iqfeed.handler = lambda fields: [
+        tick_line(1, "2023-01-03 09:30:00.000001", last_sz=5000000000)]
+    with pytest.raises(OverflowError):
+        hist_conn.request_ticks("AAPL", 10, timeout=5)
+    assert hist_conn.reader_running()
+
+    mock_iqfeed.handler = lambda fields: [
+        tick_line(2, "2023-01-03 09:30:00.000001")]
+    assert len(hist_conn.request_ticks("AAPL", 10, timeout=5)) == 1
+
+
+class _Listener(iq.SilentQuoteListener):
+    def __init__(self):
+        super().__init__("test")
+        self.updates = []
+        self.errors = []
+
+    def process_update(self, update):
+        self.updates.append(update.copy())
+
+    def process_error(self, fields):
+        self.errors.append(fields)
+
+
+def test_compact_quote_overflow_is_reported():
+    quote_conn = iq.QuoteConn(name="test", compact=True)
+    listener = _Listener()
+    quote_conn.add_listener(listener)
+    quote_conn._recv_buf = (
+        "Q,AAPL,150.25,5000000000,09:30:00.000001,11,1000,150.2,100,"
+        "150.3,100,149,151,148,149.5,C,3D,\n"
+        "Q,AAPL,150.25,100,09:30:00.000001,11,1000,150.2,100,"
+        "150.3,100,149,151,148,149.5,C,3D,\n")
+    quote_conn._process_messages()
+    assert len(listener.updates) == 1
+    assert listener.updates[0]['Most Recent Trade Size'][0] == 100
+    assert len(listener.errors) == 1
+    assert listener.errors[0][0] == "E"
+    assert listener.errors[0][2:4] == ["Q", "AAPL"]
@@ -0,0 +1,112 @@
+# coding=utf-8
+"""pyiqfeed-download against the mock IQFeed."""
+
+import argparse
+import datetime
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from conftest import bar_line
+from pyiqfeed import download
+
+
+def test_only_past_units_are_final():
+    today = datetime.date.today()
+    yesterday = today - datetime.timedelta(days=1)
+    args = argparse.Namespace(type="bars", bgn=yesterday, end=today)
+    units = download._units(["AAPL"], "bars_60s", args.bgn, args.end,
+                            weekends=True)
+    assert [download._is_final(args, day_str)
+            for _, _, day_str in units] == [True, False]
+
+    args = argparse.Namespace(type="daily", bgn=yesterday, end=today)
+    (_, _, day_str), = download._units(["AAPL"], "daily", args.bgn,
+                                       args.end)
+    assert not download._is_final(args, day_str)
+    args.end = yesterday
+    assert download._is_final(args, day_str)
+
+
+def test_units_skip_weekends():
+    # 2023-01-06 is a Friday and 2023-01-09 a Monday.
+    units = download._units(["AAPL", "MSFT"], "ticks",
+                            datetime.date(2023, 1, 5),
+                            datetime.date(2023, 1, 9))
+    assert [day_str for symbol, _, day_str in units if symbol == "AAPL"] == [
+        "2023-01-05", "2023-01-06", "2023-01-09"]
+    assert len(units) == 6
+    assert len(download._units(["AAPL"], "ticks", datetime.date(2023, 1, 5),
+                               datetime.date(2023, 1, 9),
+                               weekends=True)) == 5
+    assert download._units(["AAPL"], "ticks", datetime.date(2023, 1, 7),
+                           datetime.date(2023, 1, 8)) == []
+
+
+def test_bgn_after_end_is_a_usage_error(tmp_path, capsys):
+    with pytest.raises(SystemExit) as exc_info:
+        download.main(["--bgn", "2023-01-09", "--end", "2023-01-05",
+                       "--out", str(tmp_path), "AAPL"])
+    assert exc_info.value.code == 2
+    assert "--bgn 2023-01-09 is after --end 2023-01-05" in (
+        capsys.readouterr().err)
+
+
+def test_download(mock_iqfeed, tmp_path, capsys):
+    def handler(fields):
+        # HIT,symbol,interval,bgn,end,...
+        day = fields[3][:8]
+        if fields[1] == "MSFT" and day == "20230106":
+            return ["E,!NO_DATA!,"]
+        if fields[1] == "BAD":
+            return ["E,Unknown server error,"]
+        return [bar_line("%s-%s-%s 09:31:00" % (day[:4], day[4:6], day[6:])),
+                bar_line("%s-%s-%s 09:32:00" % (day[:4], day[4:6], day[6:]))]
+
+    mock_iqfeed.handler = handler
+    # main disconnects its conns, whose reader threads only check for stop
+    # between reads, so keep waking them up.
+    done = threading.Event()
+
+    def nudge():
+        while not done.wait(0.05):
+            mock_iqfeed.nudge()
+
+    threading.Thread(target=nudge, daemon=True).start()
+    argv = ["--bgn", "2023-01-05", "--end", "2023-01-09", "--out",
+            str(tmp_path), "--conns", "2", "--retries", "1", "--timeout",
+            "5", "--host", "127.0.0.1", "--port", str(mock_iqfeed.port),
+            "AAPL", "MSFT"]
+    assert download.main(argv) == 0
+    assert capsys.readouterr().out.startswith(
+        "6 units to download, 0 already done")
+    # No requests for the weekend.
+    assert sorted((command.split(',')[1], command.split(',')[3][:8])
+                  for command in mock_iqfeed.commands) == [
+        ("AAPL", "20230105"), ("AAPL", "20230106"), ("AAPL", "20230109"),
+        ("MSFT", "20230105"), ("MSFT", "20230106"), ("MSFT", "20230109")]
+    bars = np.load(tmp_path / "AAPL" / "bars_60s" / "2023-01-09.npy")
+    assert list(bars['date']) == [np.datetime64('2023-01-09')] * 2
+    assert sorted(os.listdir(tmp_path / "MSFT" / "bars_60s")) == [
+        "2023-01-05.npy", "2023-01-09.npy"]
+    with open(tmp_path / download.manifest_file) as manifest:
+        lines = sorted(manifest.read().splitlines())
+    assert len(lines) == 6
+    assert "MSFT\tbars_60s\t2023-01-06\t0" in lines
+
+    # Running again finds everything in the manifest.
+    mock_iqfeed.commands.clear()
+    assert download.main(argv) == 0
+    assert capsys.readouterr().out.startswith(
+        "0 units to download, 6 already done")
+    assert mock_iqfeed.commands == []
+
+    # A unit that keeps failing is retried, then reported.
+    argv[argv.index("AAPL")] = "BAD"
+    assert download.main(argv) == 1
+    assert "BAD 2023-01-05 failed" in capsys.readouterr().err
+    assert len([command for command in mock_iqfeed.commands
+                if command.startswith("HIT,BAD,")]) == 6
+    done.set()
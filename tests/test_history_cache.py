@@ -0,0 +1,79 @@
+# coding=utf-8
+"""HistoryCache with a stub HistoryConn."""
+
+import datetime
+
+import numpy as np
+
+import pyiqfeed as iq
+
+
+class _StubConn:
+    """Returns one bar a minute for the period asked for."""
+
+    def __init__(self):
+        self.requests = []
+
+    def request_bars_in_period(self, ticker, interval_len, interval_type,
+                               bgn_prd, end_prd, ascend, label_at_beginning,
+                               timeout):
+        self.requests.append((bgn_prd, end_prd))
+        first = np.datetime64(bgn_prd, 'm')
+        if first < np.datetime64(bgn_prd, 'us'):
+            first += np.timedelta64(1, 'm')
+        ts = np.arange(first, np.datetime64(end_prd, 'm') +
+                       np.timedelta64(1, 'm'), np.timedelta64(1, 'm'))
+        ts = ts[ts <= np.datetime64(end_prd, 'us')]
+        bars = np.zeros(len(ts), iq.HistoryConn.bar_type)
+        bars['date'] = ts.astype('M8[D]')
+        bars['time'] = ts - ts.astype('M8[D]')
+        bars['close_p'] = np.arange(len(ts))
+        return bars
+
+
+def test_only_missing_ranges_fetched(tmp_path):
+    stub = _StubConn()
+    cache = iq.HistoryCache(stub, str(tmp_path))
+    bgn = datetime.datetime(2023, 1, 3, 9, 30)
+    first = cache.request_bars_in_period("AAPL", 60, 's', bgn,
+                                         bgn + datetime.timedelta(hours=1),
+                                         ascend=True)
+    assert len(first) == 61
+    again = cache.request_bars_in_period("AAPL", 60, 's', bgn,
+                                         bgn + datetime.timedelta(hours=1),
+                                         ascend=True)
+    assert len(stub.requests) == 1
+    assert np.array_equal(first, again)
+
+    wider = cache.request_bars_in_period("AAPL", 60, 's', bgn,
+                                         bgn + datetime.timedelta(hours=2),
+                                         ascend=True)
+    assert len(stub.requests) == 2
+    assert stub.requests[1][0] == bgn + datetime.timedelta(hours=1)
+    assert len(wider) == 121
+    assert len(np.unique(wider['time'])) == 121
+
+
+def test_resampled_from_held_bars(tmp_path):
+    stub = _StubConn()
+    cache = iq.HistoryCache(stub, str(tmp_path))
+    bgn = datetime.datetime(2023, 1, 3, 9, 30)
+    cache.request_bars_in_period("AAPL", 60, 's', bgn,
+                                 bgn + datetime.timedelta(hours=1))
+    bars = cache.request_bars_in_period(
+        "AAPL", 300, 's', bgn + datetime.timedelta(minutes=5),
+        bgn + datetime.timedelta(minutes=30), ascend=True)
+    assert len(stub.requests) == 1
+    assert len(bars) == 6
+
+
+def test_repeated_request_into_today_does_not_duplicate(tmp_path):
+    stub = _StubConn()
+    cache = iq.HistoryCache(stub, str(tmp_path))
+    now = datetime.datetime.now().replace(second=0, microsecond=0)
+    bgn = datetime.datetime.combine(datetime.date.today(),
+                                    datetime.time(0, 0))
+    lens = [len(cache.request_bars_in_period("AAPL", 60, 's', bgn, now))
+            for _ in range(3)]
+    assert len(stub.requests) == 3
+    assert lens[0] == lens[1] == lens[2]
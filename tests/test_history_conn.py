@@ -0,0 +1,269 @@
+# coding=utf-8
+"""HistoryConn against a mock IQFeed."""
+
+import concurrent.futures
+import datetime
+import gc
+import io
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import pyiqfeed as iq
+from pyiqfeed.conn import _ParallelBuffer
+from conftest import bar_line, daily_line, req_id_of, tick_line
+
+
+def test_ticks(mock_iqfeed, connect):
+    mock_iqfeed.handler = lambda fields: [
+        tick_line(1, "2023-01-03 09:30:00.000001"),
+        tick_line(2, "2023-01-03 09:30:01.500000", last=100.5)]
+    hist_conn = connect(iq.HistoryConn)
+    ticks = hist_conn.request_ticks("AAPL", 10, ascend=True, timeout=5)
+    assert ticks.dtype == iq.HistoryConn.tick_type
+    assert list(ticks['tick_id']) == [1, 2]
+    assert ticks['last'][1] == 100.5
+    assert ticks['time'][0] == datetime.timedelta(hours=9, minutes=30,
+                                                  microseconds=1)
+    assert list(ticks[0][['cond1', 'cond2']]) == [0x3D, 0x87]
+    assert mock_iqfeed.commands[0].startswith("HTX,AAPL,10,1,H_")
+
+
+def _history_handler(fields):
+    if fields[0] == "HTX":
+        return [tick_line(1, "2023-01-03 09:30:00.000001"),
+                tick_line(2, "2023-01-03 09:30:01.500000", last=100.5)]
+    if fields[0] == "HIX":
+        return [bar_line("2023-01-03 09:31:00"),
+                bar_line("2023-01-03 09:32:00", close_p=10.75)]
+    return [daily_line("2023-01-03"), daily_line("2023-01-04", 10.75)]
+
+
+def _request_all(hist_conn):
+    """Ticks, bars and daily data from _history_handler."""
+    return (hist_conn.request_ticks("AAPL", 10, timeout=5),
+            hist_conn.request_bars("AAPL", 60, 's', 10, timeout=5),
+            hist_conn.request_daily_data("AAPL", 10, timeout=5))
+
+
+def test_columnar(mock_iqfeed, connect):
+    mock_iqfeed.handler = _history_handler
+    rows = _request_all(connect(iq.HistoryConn))
+    columns = _request_all(connect(iq.HistoryConn, columnar=True))
+    for data, cols in zip(rows, columns):
+        assert list(cols) == list(data.dtype.names)
+        for name in data.dtype.names:
+            assert cols[name].flags['C_CONTIGUOUS']
+            assert (cols[name] == data[name]).all()
+    joined = iq.columnar.concat_columns([columns[0], columns[0]])
+    assert list(joined['tick_id']) == [1, 2, 1, 2]
+
+
+def test_timestamps(mock_iqfeed, connect):
+    mock_iqfeed.handler = _history_handler
+    ticks, bars, daily = _request_all(connect(iq.HistoryConn,
+                                              timestamps=True))
+    assert ticks.dtype == iq.HistoryConn.tick_ts_type
+    assert ticks['timestamp'][1] == np.datetime64(
+        "2023-01-03T09:30:01.500000000")
+    assert bars.dtype == iq.HistoryConn.bar_ts_type
+    assert bars['timestamp'][0] == np.datetime64("2023-01-03T09:31")
+    assert daily.dtype == iq.HistoryConn.daily_type
+
+
+def test_raw(mock_iqfeed, connect):
+    mock_iqfeed.handler = _history_handler
+    hist_conn = connect(iq.HistoryConn, raw=True)
+    data = hist_conn.request_ticks("AAPL", 10, timeout=5)
+    req_id = req_id_of(mock_iqfeed.commands[-1].split(',')).encode()
+    lines = [line.encode() for line in _history_handler(["HTX"])]
+    assert data == b"".join(b"%s,%s\r\n" % (req_id, line)
+                            for line in lines)
+
+    out = io.BytesIO()
+    with hist_conn.raw_output(out):
+        num_bytes = hist_conn.request_bars("AAPL", 60, 's', 10, timeout=5)
+    assert num_bytes == len(out.getvalue())
+    assert out.getvalue().count(b"\r\n") == 2
+    assert out.getvalue().startswith(b"H_")
+
+    mock_iqfeed.handler = lambda fields: ["E,!NO_DATA!,"]
+    with pytest.raises(iq.NoDataError):
+        hist_conn.request_ticks("AAPL", 10, timeout=5)
+
+
+def test_parse_workers(tmp_path, mock_iqfeed, connect):
+    mock_iqfeed.handler = lambda fields: [
+        tick_line(tick_id, "2023-01-03 09:30:%02d.000001" % tick_id)
+        for tick_id in range(min(7, int(fields[2])))]
+    ticks = connect(iq.HistoryConn).request_ticks("AAPL", 10, timeout=5)
+    # Send 2 lines at a time so the response is decoded in several chunks.
+    mock_iqfeed.batch_secs = 0.01
+    hist_conn = connect(iq.HistoryConn, parse_workers=1,
+                        parse_chunk_rows=2, pts_per_send=2,
+                        spill_dir=str(tmp_path))
+    parsed = hist_conn.request_ticks("AAPL", 10, timeout=30)
+    assert hist_conn._parse_pool is not None
+    assert isinstance(parsed, np.memmap)
+    assert parsed.dtype == ticks.dtype
+    assert (parsed == ticks).all()
+
+    hist_conn = connect(iq.HistoryConn, parse_workers=1,
+                        parse_chunk_rows=2, pts_per_send=2, columnar=True,
+                        spill_dir=str(tmp_path))
+    columns = hist_conn.request_ticks("AAPL", 10, timeout=30)
+    for name in ticks.dtype.names:
+        assert (columns[name] == ticks[name]).all()
+
+    # Requests for less than a chunk are decoded as they arrive.
+    small = hist_conn.request_ticks("AAPL", 1, timeout=5)
+    assert list(small['tick_id']) == [0]
+
+    del parsed, columns
+    gc.collect()
+    assert os.listdir(tmp_path) == []
+
+
+def test_parallel_buffer_short_response():
+    # Less than a chunk is decoded on the calling thread.
+    buf = _ParallelBuffer(iq.HistoryConn.tick_type,
+                          iq.HistoryConn._tick_row, None, 10)
+    buf.append_raw(b"H_0000000001,%s\r\n" % tick_line(
+        3, "2023-01-03 09:30:00.000001").encode())
+    ticks = buf.data()
+    assert not isinstance(ticks, np.memmap)
+    assert list(ticks['tick_id']) == [3]
+
+
+def test_memory_budget(tmp_path, mock_iqfeed, connect):
+    mock_iqfeed.handler = lambda fields: [
+        tick_line(tick_id, "2023-01-03 09:30:%02d.000001" % tick_id)
+        for tick_id in range(min(5, int(fields[2])))]
+    ticks = connect(iq.HistoryConn).request_ticks("AAPL", 10, timeout=5)
+    max_bytes = 2 * iq.HistoryConn.tick_type.itemsize
+
+    hist_conn = connect(iq.HistoryConn, max_request_bytes=max_bytes)
+    with pytest.raises(iq.MemoryBudgetError):
+        hist_conn.request_ticks("AAPL", 10, timeout=5)
+    assert hist_conn.in_flight_bytes() == 0
+    assert len(hist_conn.request_ticks("AAPL", 2, timeout=5)) == 2
+
+    hist_conn = connect(iq.HistoryConn, max_conn_bytes=max_bytes,
+                        spill_dir=str(tmp_path))
+    spilled = hist_conn.request_ticks("AAPL", 10, timeout=5)
+    assert isinstance(spilled, np.memmap)
+    assert (spilled == ticks).all()
+    assert hist_conn.in_flight_bytes() == 0
+
+    # Spill files stay while the data is mapped and go once it's gone.
+    assert len(os.listdir(tmp_path)) == 1
+    first_rows = spilled[:2]
+    del spilled
+    gc.collect()
+    assert len(os.listdir(tmp_path)) == 1
+    assert (first_rows == ticks[:2]).all()
+    del first_rows
+    gc.collect()
+    assert os.listdir(tmp_path) == []
+
+
+def test_timeout_and_late_data(mock_iqfeed, connect):
+    mock_iqfeed.handler = lambda fields: None
+    hist_conn = connect(iq.HistoryConn)
+    with pytest.raises(TimeoutError):
+        hist_conn.request_ticks("AAPL", 10, timeout=0.2)
+    assert hist_conn.num_live_requests() == 0
+    late_id = req_id_of(mock_iqfeed.commands[-1].split(','))
+
+    # What IQFeed sends for the timed out request is thrown away.
+    def handler(fields):
+        late = "%s,%s\r\n%s,!ENDMSG!,\r\n" % (
+            late_id, tick_line(9, "2023-01-03 09:30:00.000001"), late_id)
+        req_id = req_id_of(fields)
+        return (late + "%s,%s\r\n%s,!ENDMSG!,\r\n" % (
+            req_id, tick_line(1, "2023-01-03 09:30:00.000001"),
+            req_id)).encode()
+
+    mock_iqfeed.handler = handler
+    ticks = hist_conn.request_ticks("AAPL", 10, timeout=5)
+    assert list(ticks['tick_id']) == [1]
+
+
+def test_cancel(mock_iqfeed, connect):
+    mock_iqfeed.handler = lambda fields: None
+    hist_conn = connect(iq.HistoryConn)
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        futures = [executor.submit(hist_conn.request_ticks, "AAPL", 10)
+                   for _ in range(2)]
+        while hist_conn.num_live_requests() < 2:
+            time.sleep(0.01)
+        req_ids = hist_conn.live_request_ids()
+        assert hist_conn.cancel_request(req_ids[0])
+        assert not hist_conn.cancel_request(req_ids[0])
+        assert hist_conn.cancel_all_requests() == 1
+        for future in futures:
+            with pytest.raises(concurrent.futures.CancelledError):
+                future.result(timeout=5)
+    assert hist_conn.num_live_requests() == 0
+
+
+def test_coalesce(mock_iqfeed, connect):
+    release = threading.Event()
+
+    def handler(fields):
+        release.wait(5)
+        return _history_handler(fields)
+
+    mock_iqfeed.handler = handler
+    hist_conn = connect(iq.HistoryConn, coalesce=True)
+    with concurrent.futures.ThreadPoolExecutor(3) as executor:
+        futures = [executor.submit(hist_conn.request_ticks, "AAPL", 10,
+                                   timeout=5) for _ in range(3)]
+        # Give every thread time to find the request in flight.
+        time.sleep(0.5)
+        release.set()
+        results = [future.result() for future in futures]
+    assert len(mock_iqfeed.commands) == 1
+    assert all(ticks is results[0] for ticks in results)
+    assert not results[0].flags['WRITEABLE']
+
+    # Once it's done the same request goes to IQFeed again.
+    hist_conn.request_ticks("AAPL", 10, timeout=5)
+    assert len(mock_iqfeed.commands) == 2
+
+
+def test_bad_line_fails_only_its_request(mock_iqfeed, connect):
+    mock_iqfeed.handler = lambda fields: [
+        tick_line(1, "2023-01-03 09:30:00.000001"),
+        tick_line(2, "not a timestamp")]
+    hist_conn = connect(iq.HistoryConn)
+    with pytest.raises(ValueError):
+        hist_conn.request_ticks("AAPL", 10, timeout=5)
+    assert hist_conn.reader_running()
+    assert hist_conn.num_live_requests() == 0
+
+    mock_iqfeed.handler = lambda fields: [
+        tick_line(3, "2023-01-03 09:30:00.000001")]
+    ticks = hist_conn.request_ticks("AAPL", 10, timeout=5)
+    assert list(ticks['tick_id']) == [3]
+
+
+@pytest.mark.parametrize("conn_type", [iq.HistoryConn, iq.LookupConn])
+def test_failed_send_forgets_request(mock_iqfeed, connect, monkeypatch,
+                                     conn_type):
+    conn = connect(conn_type)
+
+    def send_cmd(cmd):
+        raise BrokenPipeError("Broken pipe")
+
+    monkeypatch.setattr(conn, "_send_cmd", send_cmd)
+    with pytest.raises(BrokenPipeError):
+        if conn_type is iq.HistoryConn:
+            conn.request_ticks("AAPL", 10, timeout=5)
+        else:
+            conn.request_symbols_by_sic(3571, timeout=5)
+    assert conn.num_live_requests() == 0
+    assert conn.live_request_ids() == []
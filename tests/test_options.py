@@ -0,0 +1,72 @@
+# coding=utf-8
+"""Parsing option symbols into an OptionChain."""
+
+import numpy as np
+
+import pyiqfeed as iq
+from pyiqfeed.options import parse_equity_option_symbols
+from pyiqfeed.options import parse_futures_option_symbols
+
+
+def test_parse_equity_option_symbols():
+    # Adjusted options can have digits in the root.
+    contracts = parse_equity_option_symbols(
+        "AAPL", ["AAPL2117F142.5", b"AAPL2117R145", "AAPL12117F10",
+                 "NOT AN OPTION", ""])
+    assert list(contracts['symbol']) == [b"AAPL2117F142.5", b"AAPL2117R145",
+                                         b"AAPL12117F10"]
+    assert list(contracts['root']) == [b"AAPL", b"AAPL", b"AAPL1"]
+    assert (contracts['expiry'] == np.datetime64("2021-06-17")).all()
+    assert list(contracts['strike']) == [142.5, 145.0, 10.0]
+    assert list(contracts['right']) == [b"C", b"P", b"C"]
+
+
+def test_impossible_dates_are_rejected():
+    contracts = parse_equity_option_symbols(
+        "AAPL", ["AAPL2131B10", "AAPL2128B10", "AAPL2429B10", "AAPL2131D10",
+                 "AAPL2130D10", "AAPL2100A10"])
+    assert list(contracts['expiry']) == [
+        np.datetime64("2021-02-28"), np.datetime64("2024-02-29"),
+        np.datetime64("2021-04-30")]
+
+
+def test_parse_futures_option_symbols():
+    contracts = parse_futures_option_symbols(
+        "@ESZ21", ["@ESZ21C4700", "@ESZ21P4650", "@ES"])
+    assert list(contracts['root']) == [b"@ES", b"@ES"]
+    assert (contracts['expiry'] == np.datetime64("2021-12-01")).all()
+    assert list(contracts['strike']) == [4700.0, 4650.0]
+    assert list(contracts['right']) == [b"C", b"P"]
+
+
+def test_option_chain():
+    chain = iq.OptionChain.from_equity_chain("AAPL", {
+        "c": ["AAPL2117F145", "AAPL2117F140", "AAPL2118G150",
+              "AAPL2117F150"],
+        "p": ["AAPL2117R145", "AAPL2117R140"]})
+    assert len(chain) == 6
+    assert list(chain.expiries()) == [np.datetime64("2021-06-17"),
+                                      np.datetime64("2021-07-18")]
+    june = chain.for_expiry("2021-06-17")
+    assert list(june['strike']) == [140.0, 145.0, 150.0, 140.0, 145.0]
+    assert list(june['right']) == [b"C"] * 3 + [b"P"] * 2
+    assert list(chain.strikes_between(
+        "2021-06-17", 141, 150, right=iq.OptionChain.call)['strike']) == [
+        145.0, 150.0]
+    near = chain.near_the_money("2021-06-17", 146.0, 1)
+    assert list(near['symbol']) == [b"AAPL2117F145", b"AAPL2117F150",
+                                    b"AAPL2117R145"]
+    assert len(chain.expiring_between("2021-07-01", "2021-12-31")) == 1
+
+
+def test_exact_decimal_strikes():
+    chain = iq.OptionChain.from_equity_chain("AAPL", {
+        "c": ["AAPL2117F12.35", "AAPL2117F12.3", "AAPL2117F0.1"],
+        "p": ["AAPL2117R12.35"]})
+    assert sorted(set(chain.contracts['strike'])) == [0.1, 12.3, 12.35]
+    found = chain.strikes_between("2021-06-17", 12.35, 12.35)
+    assert list(found['symbol']) == [b"AAPL2117F12.35", b"AAPL2117R12.35"]
+    # A strike equal to the price counts as at or above it.
+    near = chain.near_the_money("2021-06-17", 12.35, 1,
+                                right=iq.OptionChain.call)
+    assert list(near['strike']) == [12.3, 12.35]
@@ -0,0 +1,132 @@
+# coding=utf-8
+"""Parallel requests against a mock IQFeed."""
+
+import collections
+import concurrent.futures
+import datetime
+import threading
+
+import pytest
+
+import pyiqfeed as iq
+from conftest import req_id_of, tick_line
+
+
+def test_option_chains_report_cancelled_requests(mock_iqfeed, connect):
+    lookup_conn = connect(iq.LookupConn)
+
+    def handler(fields):
+        if fields[1] == "SLOW":
+            threading.Timer(0.1, lookup_conn.cancel_request,
+                            (req_id_of(fields),)).start()
+            return None
+        return ["AAPL2117F142.5,AAPL2117F145,:,AAPL2117R142.5,"]
+
+    mock_iqfeed.handler = handler
+    results = {symbol: (chain, err) for symbol, chain, err in
+               iq.parallel.request_option_chains(
+                   [lookup_conn], ["AAPL", "SLOW"], timeout=5, near_months=1)}
+    chain, err = results["AAPL"]
+    assert err is None
+    assert len(chain) == 3
+    chain, err = results["SLOW"]
+    assert chain is None
+    assert isinstance(err, concurrent.futures.CancelledError)
+
+
+TICKS = [(1, "2023-01-03 17:30:00.000000"),
+         (2, "2023-01-03 18:00:00.000000"),
+         (3, "2023-01-04 09:30:00.000000"),
+         (4, "2023-01-04 18:00:00.000000"),
+         (5, "2023-01-05 11:00:00.000000"),
+         (6, "2023-01-05 12:00:00.000000")]
+
+
+def ticks_handler(fields):
+    """Ticks in [bgn, end] of an HTT command, both inclusive like IQFeed."""
+    bgn, end = (datetime.datetime.strptime(field, "%Y%m%d %H%M%S")
+                for field in fields[2:4])
+    lines = [tick_line(tick_id, ts) for tick_id, ts in TICKS
+             if bgn <= datetime.datetime.fromisoformat(ts) <= end]
+    if not lines:
+        return ["E,!NO_DATA!,"]
+    return lines if fields[7] == "1" else lines[::-1]
+
+
+def test_ticks_in_period_split_by_session(mock_iqfeed, connect):
+    pool = iq.ConnPool([connect(iq.HistoryConn) for _ in range(2)])
+    mock_iqfeed.handler = ticks_handler
+    ticks = iq.parallel.request_ticks_in_period(
+        pool, "@ES#", datetime.datetime(2023, 1, 3, 17),
+        datetime.datetime(2023, 1, 5, 12), ascend=True,
+        session_start=datetime.time(18), timeout=5)
+    assert sorted(command.split(',')[2:4] for command in
+                  mock_iqfeed.commands) == [
+        ["20230103 170000", "20230103 180000"],
+        ["20230103 180000", "20230104 180000"],
+        ["20230104 180000", "20230105 120000"]]
+    # Ticks at 18:00 are in two sessions' replies but only returned once.
+    assert list(ticks['tick_id']) == [1, 2, 3, 4, 5, 6]
+    # Every session is asked for oldest first whatever ascend is.
+    assert all(command.split(',')[7] == "1"
+               for command in mock_iqfeed.commands)
+
+    ticks = iq.parallel.request_ticks_in_period(
+        pool, "@ES#", datetime.datetime(2023, 1, 3, 17),
+        datetime.datetime(2023, 1, 5, 12), ascend=False,
+        session_start=datetime.time(18), timeout=5)
+    assert list(ticks['tick_id']) == [6, 5, 4, 3, 2, 1]
+
+
+def test_ticks_in_period_split_by_day(mock_iqfeed, connect):
+    pool = iq.ConnPool([connect(iq.HistoryConn)])
+    mock_iqfeed.handler = ticks_handler
+    ticks = iq.parallel.request_ticks_in_period(
+        pool, "AAPL", datetime.datetime(2023, 1, 3, 12),
+        datetime.datetime(2023, 1, 6), ascend=True, timeout=5)
+    assert [command.split(',')[2:4] for command in mock_iqfeed.commands] == [
+        ["20230103 120000", "20230104 000000"],
+        ["20230104 000000", "20230105 000000"],
+        ["20230105 000000", "20230106 000000"]]
+    assert list(ticks['tick_id']) == [1, 2, 3, 4, 5, 6]
+
+
+@pytest.mark.parametrize("failure", ["error", "timeout"])
+def test_ticks_in_period_retries(mock_iqfeed, connect, failure):
+    pool = iq.ConnPool([connect(iq.HistoryConn)])
+    attempts = collections.Counter()
+
+    def handler(fields):
+        attempts[fields[2]] += 1
+        if fields[2] == "20230104 000000" and attempts[fields[2]] <= 2:
+            # An unknown error raises RuntimeError and a timeout raises
+            # TimeoutError, which is an OSError.
+            return ["E,Could not connect to History socket.,"] if (
+                failure == "error") else None
+        return ticks_handler(fields)
+
+    mock_iqfeed.handler = handler
+    ticks = iq.parallel.request_ticks_in_period(
+        pool, "AAPL", datetime.datetime(2023, 1, 3),
+        datetime.datetime(2023, 1, 6), ascend=True, max_retries=2,
+        timeout=0.5)
+    assert list(ticks['tick_id']) == [1, 2, 3, 4, 5, 6]
+    assert attempts == {"20230103 000000": 1, "20230104 000000": 3,
+                        "20230105 000000": 1}
+
+    attempts.clear()
+    with pytest.raises(RuntimeError if failure == "error" else OSError):
+        iq.parallel.request_ticks_in_period(
+            pool, "AAPL", datetime.datetime(2023, 1, 3),
+            datetime.datetime(2023, 1, 6), max_retries=1, timeout=0.5)
+    assert attempts["20230104 000000"] == 2
+
+
+def test_ticks_in_period_skips_sessions_without_data(mock_iqfeed, connect):
+    pool = iq.ConnPool([connect(iq.HistoryConn)])
+    mock_iqfeed.handler = ticks_handler
+    ticks = iq.parallel.request_ticks_in_period(
+        pool, "AAPL", datetime.datetime(2023, 1, 1),
+        datetime.datetime(2023, 1, 4), timeout=5)
+    assert len(mock_iqfeed.commands) == 3
+    assert list(ticks['tick_id']) == [2, 1]
@@ -0,0 +1,76 @@
+# coding=utf-8
+"""DatapointsPerSend and its tuning, against a mock IQFeed."""
+
+import pyiqfeed as iq
+from pyiqfeed.conn import _PtsPerSendTuner
+from conftest import tick_line
+
+
+def _ticks_handler(fields):
+    return [tick_line(tick_id, "2023-01-03 09:30:00.000001")
+            for tick_id in range(int(fields[2]))]
+
+
+def _pts_sent(mock_iqfeed):
+    return [int(command.split(',')[-1]) for command in mock_iqfeed.commands]
+
+
+def test_pts_per_send_is_sent(mock_iqfeed, connect):
+    mock_iqfeed.handler = _ticks_handler
+    hist_conn = connect(iq.HistoryConn, pts_per_send=500)
+    hist_conn.request_ticks("AAPL", 1000, timeout=5)
+    hist_conn.request_ticks("AAPL", 1000, timeout=5, pts_per_send=250)
+    # Never more than the most points asked for.
+    hist_conn.request_ticks("AAPL", 20, timeout=5)
+    assert _pts_sent(mock_iqfeed) == [500, 250, 20]
+    assert hist_conn.pts_per_send == 500
+
+
+def test_adapts_upwards_against_mock(mock_iqfeed, connect):
+    # Each batch costs a round trip, so bigger batches are faster until
+    # a request fits in fewer than 4 batches and isn't measured any more.
+    mock_iqfeed.handler = _ticks_handler
+    mock_iqfeed.batch_secs = 0.01
+    hist_conn = connect(iq.HistoryConn, pts_per_send=10,
+                        adapt_pts_per_send=True)
+    for _ in range(6):
+        assert len(hist_conn.request_ticks("AAPL", 400, timeout=10)) == 400
+    assert _pts_sent(mock_iqfeed) == [10, 20, 40, 80, 160, 160]
+    assert hist_conn.pts_per_send == 160
+
+
+def test_tuner_turns_around():
+    tuner = _PtsPerSendTuner(100)
+    tuner.record(100, 1000, 1.0)
+    assert tuner.pts_per_send == 200
+    tuner.record(200, 1000, 0.5)
+    assert tuner.pts_per_send == 400
+    # Slower than last time, so go back down.
+    tuner.record(400, 2000, 2.0)
+    assert tuner.pts_per_send == 200
+    # Faster again, keep going down.
+    tuner.record(200, 2000, 1.0)
+    assert tuner.pts_per_send == 100
+    # Slower, turn around again.
+    tuner.record(100, 2000, 4.0)
+    assert tuner.pts_per_send == 200
+
+
+def test_tuner_ignores_what_it_cant_judge():
+    tuner = _PtsPerSendTuner(100)
+    # Too few rows to span several batches.
+    tuner.record(100, 399, 1.0)
+    # A request sent with a value the tuner has since moved away from.
+    tuner.record(50, 1000, 0.01)
+    tuner.record(100, 1000, 0.0)
+    assert tuner.pts_per_send == 100
+
+
+def test_tuner_limits():
+    tuner = _PtsPerSendTuner(_PtsPerSendTuner.max_pts)
+    tuner.record(_PtsPerSendTuner.max_pts, 10 ** 6, 1.0)
+    assert tuner.pts_per_send == _PtsPerSendTuner.max_pts
+    tuner = _PtsPerSendTuner(_PtsPerSendTuner.min_pts)
+    tuner.record(_PtsPerSendTuner.min_pts, 1000, 1.0)
+    tuner.record(20, 1000, 2.0)
+    assert tuner.pts_per_send == _PtsPerSendTuner.min_pts
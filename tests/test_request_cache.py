@@ -0,0 +1,113 @@
+# coding=utf-8
+"""RequestCache on its own, with a fake clock."""
+
+import types
+
+import numpy as np
+import pytest
+
+import pyiqfeed as iq
+from pyiqfeed import request_cache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A clock for the cache that only moves when now is changed."""
+    fake = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(request_cache, "time", types.SimpleNamespace(
+        monotonic=lambda: fake.now))
+    return fake
+
+
+def test_ttl_expiry(clock):
+    cache = iq.RequestCache(default_ttl=60, ttls={"HTX": 5, "SBF": 0})
+    cache.put("HDX,AAPL,10", np.arange(3))
+    cache.put("HTX,AAPL,10", np.arange(3))
+    assert cache.put("SBF,s,AAPL", ["AAPL"]) == ["AAPL"]
+    assert cache.get("SBF,s,AAPL") is None
+
+    clock.now += 5
+    assert cache.get("HTX,AAPL,10") is not None
+    clock.now += 0.001
+    assert cache.get("HTX,AAPL,10") is None
+    assert cache.get("HDX,AAPL,10") is not None
+    clock.now += 55
+    assert cache.get("HDX,AAPL,10") is None
+    assert cache.stats().num_entries == 0
+    assert cache.stats().num_bytes == 0
+
+
+def test_lru_eviction_by_bytes(clock):
+    cache = iq.RequestCache(max_bytes=3000)
+    for num in range(3):
+        cache.put("HDX,%d" % num, np.zeros(1000, 'u1'))
+    assert cache.stats().num_entries == 3
+    # Using 0 makes 1 the least recently used.
+    assert cache.get("HDX,0") is not None
+    cache.put("HDX,3", np.zeros(1000, 'u1'))
+    assert cache.get("HDX,1") is None
+    assert all(cache.get("HDX,%d" % num) is not None for num in (0, 2, 3))
+
+    # Big enough to push out all but the most recently used.
+    cache.put("HDX,4", np.zeros(2000, 'u1'))
+    assert cache.stats().num_entries == 2
+    assert cache.get("HDX,3") is not None
+    assert cache.stats().num_bytes == 3000
+
+    # Too big to cache at all, but still handed back.
+    assert len(cache.put("HDX,5", np.zeros(3001, 'u1'))) == 3001
+    assert cache.get("HDX,5") is None
+    assert cache.stats().num_entries == 2
+
+    cache.put("HDX,3", np.zeros(500, 'u1'))
+    assert cache.stats().num_bytes == 2500
+
+
+def test_stats(clock):
+    cache = iq.RequestCache(ttls={"HDX": 10})
+    assert cache.stats() == (0, 0, 0, 0)
+    cache.get("HDX,AAPL")
+    cache.put("HDX,AAPL", np.zeros(10, 'f8'))
+    cache.get("HDX,AAPL")
+    cache.get("HDX,AAPL")
+    clock.now += 11
+    cache.get("HDX,AAPL")
+    stats = cache.stats()
+    assert (stats.hits, stats.misses) == (2, 2)
+    assert (stats.num_entries, stats.num_bytes) == (0, 0)
+    cache.put("HDX,AAPL", np.zeros(10, 'f8'))
+    assert cache.stats().num_bytes == 80
+    cache.clear()
+    assert cache.stats() == (2, 2, 0, 0)
+
+
+def test_arrays_read_only(clock):
+    cache = iq.RequestCache()
+    data = np.arange(5)
+    returned = cache.put("HDX,AAPL", data)
+    with pytest.raises(ValueError):
+        returned[0] = 10
+    with pytest.raises(ValueError):
+        cache.get("HDX,AAPL")[0] = 10
+
+    columns = {'date': np.arange(3), 'close_p': np.ones(3)}
+    returned = cache.put("HDX,MSFT", columns)
+    with pytest.raises(ValueError):
+        returned['close_p'][0] = 2
+    # Replacing a column only changes the caller's dict.
+    returned['close_p'] = np.zeros(3)
+    assert list(cache.get("HDX,MSFT")['close_p']) == [1, 1, 1]
+    assert cache.stats().num_bytes > data.nbytes + sum(
+        col.nbytes for col in columns.values())
+
+
+def test_lists_deep_copied(clock):
+    cache = iq.RequestCache()
+    chain = {'c': ["AAPL2117F142.5"], 'p': [["AAPL2117R142.5"]]}
+    returned = cache.put("CEO,AAPL", chain)
+    chain['c'].append("changed")
+    returned['p'][0].append("changed")
+    assert cache.get("CEO,AAPL") == {'c': ["AAPL2117F142.5"],
+                                     'p': [["AAPL2117R142.5"]]}
+    cache.get("CEO,AAPL")['c'].clear()
+    assert cache.get("CEO,AAPL")['c'] == ["AAPL2117F142.5"]
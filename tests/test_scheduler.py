@@ -0,0 +1,158 @@
+# coding=utf-8
+"""RequestScheduler with plain functions standing in for requests."""
+
+import threading
+import time
+
+import pytest
+
+import pyiqfeed as iq
+
+
+def wait_for(cond, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def start_call(scheduler, priority, func, *args) -> threading.Thread:
+    """Call func through scheduler on a new thread."""
+    thread = threading.Thread(target=scheduler.call,
+                              args=(priority, func) + args, daemon=True)
+    thread.start()
+    return thread
+
+
+def start_busy(scheduler) -> threading.Event:
+    """Start a request that runs until the returned event is set."""
+    running = threading.Event()
+    busy = threading.Event()
+
+    def request():
+        running.set()
+        busy.wait(5)
+
+    start_call(scheduler, iq.RequestScheduler.BULK, request)
+    assert running.wait(5)
+    return busy
+
+
+def test_priority_order():
+    scheduler = iq.RequestScheduler(max_outstanding=1)
+    busy = start_busy(scheduler)
+
+    order = []
+    threads = []
+    requests = [(iq.RequestScheduler.BULK, "bulk 1"),
+                (iq.RequestScheduler.NORMAL, "normal 1"),
+                (iq.RequestScheduler.INTERACTIVE, "interactive 1"),
+                (iq.RequestScheduler.BULK, "bulk 2"),
+                (iq.RequestScheduler.INTERACTIVE, "interactive 2"),
+                (iq.RequestScheduler.NORMAL, "normal 2")]
+    for num, (priority, name) in enumerate(requests):
+        threads.append(start_call(scheduler, priority, order.append, name))
+        # Queue them one at a time so ties are in a known order.
+        wait_for(lambda: scheduler.num_waiting() == num + 1)
+    busy.set()
+    for thread in threads:
+        thread.join(5)
+    assert order == ["interactive 1", "interactive 2", "normal 1",
+                     "normal 2", "bulk 1", "bulk 2"]
+    stats = scheduler.stats()
+    assert stats[iq.RequestScheduler.BULK].num_requests == 3
+    assert stats[iq.RequestScheduler.BULK].max_wait > 0
+    assert stats[iq.RequestScheduler.INTERACTIVE].num_requests == 2
+    assert stats[iq.RequestScheduler.BULK].max_service > 0
+    assert stats[iq.RequestScheduler.NORMAL].total_wait > 0
+
+
+def test_max_outstanding():
+    scheduler = iq.RequestScheduler(max_outstanding=2)
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def request():
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+
+    threads = [start_call(scheduler, iq.RequestScheduler.NORMAL, request)
+               for _ in range(8)]
+    for thread in threads:
+        thread.join(5)
+    assert running == [0, 2]
+
+
+def test_token_bucket():
+    scheduler = iq.RequestScheduler(rate=50, burst=2)
+    started = []
+    for _ in range(7):
+        scheduler.call(iq.RequestScheduler.NORMAL,
+                       lambda: started.append(time.monotonic()))
+    gaps = [later - earlier for earlier, later in zip(started, started[1:])]
+    # Two go at once from the burst, then one every 1 / rate secs.
+    assert gaps[0] < 0.015
+    assert all(gap > 0.015 for gap in gaps[1:])
+    assert started[-1] - started[0] >= 5 / 50 * 0.95
+
+    # After a quiet spell the bucket is full again but holds no more than
+    # burst tokens.
+    time.sleep(0.1)
+    started.clear()
+    for _ in range(3):
+        scheduler.call(iq.RequestScheduler.NORMAL,
+                       lambda: started.append(time.monotonic()))
+    assert started[1] - started[0] < 0.015
+    assert started[2] - started[1] > 0.015
+
+
+def test_shutdown():
+    scheduler = iq.RequestScheduler(max_outstanding=1)
+    busy = start_busy(scheduler)
+    done = []
+    errors = []
+
+    def waiting_request():
+        try:
+            scheduler.call(iq.RequestScheduler.INTERACTIVE, done.append, 1)
+        except RuntimeError as err:
+            errors.append(err)
+
+    waiter = threading.Thread(target=waiting_request, daemon=True)
+    waiter.start()
+    wait_for(lambda: scheduler.num_waiting() == 1)
+
+    shutdown = threading.Thread(target=scheduler.shutdown, daemon=True)
+    shutdown.start()
+    waiter.join(5)
+    assert len(errors) == 1
+    assert scheduler.num_waiting() == 0
+    # shutdown waits for the request that was already running.
+    assert shutdown.is_alive()
+    busy.set()
+    shutdown.join(5)
+    assert not shutdown.is_alive()
+    assert scheduler.stats()[iq.RequestScheduler.BULK].num_requests == 1
+
+    with pytest.raises(RuntimeError):
+        scheduler.call(iq.RequestScheduler.NORMAL, done.append, 2)
+    assert done == []
+    scheduler.shutdown(wait=False)
+
+
+def test_wrap():
+    class Conn:
+        name = "conn"
+
+        def request_thing(self, arg):
+            return arg * 2
+
+    scheduler = iq.RequestScheduler()
+    conn = scheduler.wrap(Conn(), iq.RequestScheduler.BULK)
+    assert conn.name == "conn"
+    assert conn.request_thing(21) == 42
+    assert scheduler.stats()[iq.RequestScheduler.BULK].num_requests == 1
@@ -0,0 +1,134 @@
+# coding=utf-8
+"""TickStitcher fed with backfills and QuoteConn style updates."""
+
+import numpy as np
+
+import pyiqfeed as iq
+
+update_type = np.dtype([('Symbol', 'S64'), ('Message Contents', 'S9'),
+                        ('TickId', 'u8'), ('Most Recent Trade', 'f8'),
+                        ('Most Recent Trade Size', 'u8'),
+                        ('Most Recent Trade Time', 'u8'),
+                        ('Most Recent Trade Date', 'M8[D]'),
+                        ('Most Recent Trade Market Center', 'u1'),
+                        ('Most Recent Trade Conditions', 'S16'),
+                        ('Total Volume', 'u8'), ('Bid', 'f8'), ('Ask', 'f8')])
+
+
+def update(tick_id: int, symbol: str = "AAPL",
+           contents: bytes = b"Cba") -> np.array:
+    """A trade update from QuoteConn with tick id tick_id."""
+    upd = np.zeros(1, update_type)
+    upd['Symbol'] = symbol.encode()
+    upd['Message Contents'] = contents
+    upd['TickId'] = tick_id
+    upd['Most Recent Trade'] = 100 + tick_id / 100
+    upd['Most Recent Trade Size'] = 10
+    upd['Most Recent Trade Time'] = (9 * 3600 + 1800) * 1000000 + tick_id
+    upd['Most Recent Trade Date'] = np.datetime64('2023-01-03')
+    upd['Most Recent Trade Market Center'] = 11
+    upd['Most Recent Trade Conditions'] = b"3D87"
+    upd['Total Volume'] = 10 * tick_id
+    return upd
+
+
+def backfill(tick_ids) -> np.array:
+    """Ticks from HistoryConn with these tick ids."""
+    ticks = np.zeros(len(tick_ids), iq.HistoryConn.tick_type)
+    ticks['tick_id'] = tick_ids
+    ticks['date'] = np.datetime64('2023-01-03')
+    ticks['time'] = np.array(tick_ids, 'i8').astype('m8[us]')
+    return ticks
+
+
+class Collector:
+    """on_ticks that records the tick ids it is called with."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, symbol, ticks):
+        self.batches.append((symbol, list(ticks['tick_id'])))
+
+    def tick_ids(self, symbol: str = "AAPL") -> list:
+        return [tick_id for batch_symbol, tick_ids in self.batches
+                if batch_symbol == symbol for tick_id in tick_ids]
+
+
+def test_overlap_removed_by_tick_id():
+    collector = Collector()
+    stitcher = iq.TickStitcher("stitcher", on_ticks=collector,
+                               keep_ticks=100)
+    stitcher.start_backfill("AAPL")
+    for tick_id in (4, 5, 6, 7):
+        stitcher.process_update(update(tick_id))
+    assert collector.batches == []
+
+    # The backfill overlaps the live ticks held so far.
+    stitcher.add_backfill("AAPL", backfill([3, 1, 2, 4, 5]))
+    assert collector.batches == [("AAPL", [1, 2, 3, 4, 5]),
+                                 ("AAPL", [6, 7])]
+    stitcher.process_update(update(7))
+    stitcher.process_update(update(8))
+    assert collector.tick_ids() == [1, 2, 3, 4, 5, 6, 7, 8]
+    assert stitcher.last_tick_id("AAPL") == 8
+
+    ticks = stitcher.ticks("AAPL")
+    assert list(ticks['tick_id']) == [1, 2, 3, 4, 5, 6, 7, 8]
+    live = ticks[-1]
+    assert live['date'] == np.datetime64('2023-01-03')
+    assert live['last'] == 100 + 8 / 100
+    assert live['last_type'] == b'C'
+    assert (live['cond1'], live['cond2']) == (0x3D, 0x87)
+
+
+def test_gaps():
+    collector = Collector()
+    stitcher = iq.TickStitcher("stitcher", on_ticks=collector,
+                               max_buffered=3)
+    stitcher.start_backfill("AAPL")
+    for tick_id in (20, 21, 22, 23, 24):
+        stitcher.process_update(update(tick_id))
+    # Only the latest max_buffered live ticks are held.
+    assert stitcher.num_dropped("AAPL") == 2
+    # The backfill ended before the live ticks started, so there is a gap
+    # between them which can't be filled and is passed on as is.
+    stitcher.add_backfill("AAPL", backfill([1, 2, 3]))
+    assert collector.tick_ids() == [1, 2, 3, 22, 23, 24]
+
+    stitcher.process_update(update(40))
+    assert collector.tick_ids()[-1] == 40
+
+
+def test_out_of_order_ticks():
+    collector = Collector()
+    stitcher = iq.TickStitcher("stitcher", on_ticks=collector)
+    stitcher.start_backfill("AAPL")
+    for tick_id in (10, 14, 12, 13, 14, 15, 11, 16):
+        stitcher.process_update(update(tick_id))
+    stitcher.add_backfill("AAPL", backfill([9, 7, 8]))
+    # Ticks older than one already handed out are dropped.
+    assert collector.tick_ids() == [7, 8, 9, 10, 14, 15, 16]
+
+    stitcher.process_update(update(12))
+    stitcher.process_update(update(16))
+    stitcher.process_update(update(17))
+    assert collector.tick_ids()[-2:] == [16, 17]
+
+
+def test_symbols_and_passthrough():
+    collector = Collector()
+    stitcher = iq.TickStitcher("stitcher", on_ticks=collector)
+    stitcher.start_backfill("AAPL")
+    stitcher.process_update(update(5, "AAPL"))
+    # MSFT isn't being backfilled so its ticks go straight through.
+    stitcher.process_update(update(1, "MSFT"))
+    stitcher.process_update(update(1, "MSFT"))
+    # Updates that aren't trades are ignored.
+    stitcher.process_update(update(2, "MSFT", contents=b"ba"))
+    assert collector.batches == [("MSFT", [1])]
+    stitcher.add_backfill("AAPL", backfill([]))
+    assert collector.tick_ids("AAPL") == [5]
+    assert sorted(stitcher.symbols()) == ["AAPL", "MSFT"]
+    assert stitcher.ticks("AAPL").dtype == iq.HistoryConn.tick_type
+    assert len(stitcher.ticks("AAPL")) == 0
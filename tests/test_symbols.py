@@ -0,0 +1,48 @@
+# coding=utf-8
+"""SymbolMaster against a mock IQFeed."""
+
+import pyiqfeed as iq
+
+
+def _symbol_handler(fields):
+    if fields[0] == "SBF":
+        if fields[2] != "A":
+            return []
+        return ["AAPL,5,1,APPLE INC,", "AMZN,5,1,AMAZON COM INC,"]
+    if fields[0] == "SBS":
+        return ["%s,AAPL,5,1,APPLE INC," % fields[1]]
+    return ["%s,AMZN,5,1,AMAZON COM INC," % fields[1]]
+
+
+def _sectors(master):
+    return {row['symbol'].decode(): int(row['sector'])
+            for row in master.symbols}
+
+
+def test_refresh_and_search(tmp_path, mock_iqfeed, connect):
+    mock_iqfeed.handler = _symbol_handler
+    lookup_conn = connect(iq.LookupConn)
+    master = iq.SymbolMaster(str(tmp_path))
+    assert master.refresh(lookup_conn, prefixes=["A"], timeout=5) == 2
+    assert list(master.search("am")['symbol']) == [b"AMZN"]
+    assert list(master.search("apple", search_field='d')['symbol']) == [
+        b"AAPL"]
+    assert len(iq.SymbolMaster(str(tmp_path))) == 2
+
+
+def test_refresh_keeps_sectors(tmp_path, mock_iqfeed, connect):
+    mock_iqfeed.handler = _symbol_handler
+    lookup_conn = connect(iq.LookupConn)
+    master = iq.SymbolMaster(str(tmp_path))
+    master.refresh(lookup_conn, prefixes=["A"], timeout=5)
+    master.refresh(lookup_conn, sics=[3571], timeout=5)
+    master.refresh(lookup_conn, naics=[454110], timeout=5)
+    assert _sectors(master) == {"AAPL": 3571, "AMZN": 454110}
+
+    # SBF has no sectors. Pulling the prefix again mustn't lose them.
+    master.refresh(lookup_conn, timeout=5)
+    assert _sectors(master) == {"AAPL": 3571, "AMZN": 454110}
+
+    # The latest sector pulled wins, not the largest.
+    master.refresh(lookup_conn, sics=[1000], timeout=5)
+    assert _sectors(master)["AAPL"] == 1000